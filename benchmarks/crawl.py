@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# Runs a single spider for benchmarks/run.py and writes its stats as JSON
+#
+# Usage:
+# $ python benchmarks/crawl.py SPIDER FEED STATS [NAME=VALUE ...] [--set SETTING=VALUE ...]
+#
+# NAME=VALUE pairs are spider arguments (like scrapy's -a), --set overrides
+# a project setting (like scrapy's -s).
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+
+def main(argv):
+    spider, feed, stats_path = argv[:3]
+    spider_args = {}
+    overrides = {}
+    rest = iter(argv[3:])
+    for arg in rest:
+        if arg == '--set':
+            name, value = next(rest).split('=', 1)
+            overrides[name] = value
+        else:
+            name, value = arg.split('=', 1)
+            spider_args[name] = value
+
+    settings = get_project_settings()
+    settings.set('FEEDS', {feed: {'format': 'csv', 'overwrite': True}})
+    for name, value in overrides.items():
+        settings.set(name, value)
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(spider)
+    process.crawl(crawler, **spider_args)
+    process.start()
+
+    with open(stats_path, 'w') as stats_file:
+        json.dump(crawler.stats.get_stats(), stats_file, indent=2, sort_keys=True, default=str)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
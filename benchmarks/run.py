@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# Offline benchmark of the whole pipeline against the GitHub API simulator
+#
+# Starts benchmarks/simulator.py, then crawls toggled_repos, augments the
+# repositories found with augment_toggled_repos and looks up their
+# top_contributors, every spider in its own process with the project
+# settings and (fake) tokens of its own. Reported per spider: requests,
+# rate limited (403) responses, requests per repository, wall time and
+# peak RSS.
+#
+# Usage:
+# $ python benchmarks/run.py --files 20000 --tokens 4 --json benchmark.json
+#
+# Spider arguments and settings go to a single spider (--toggled, --augment,
+# --top) or to every spider (--set), arguments of the simulator with --sim:
+# $ python benchmarks/run.py --toggled query_batch=5 --augment api=graphql --set GITHUB_HTTPCACHE_ENABLED=True
+# $ python benchmarks/run.py --sim=--search-limit=1000 --sim=--recorded=responses.jsonl
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.join(ROOT, 'benchmarks')
+
+SPIDERS = ['toggled_repos', 'augment_toggled_repos', 'top_contributors']
+
+# Settings of every benchmark crawl, before --set
+DEFAULT_SETTINGS = {
+    'DOWNLOAD_DELAY': '0',
+    'LOG_LEVEL': 'WARNING',
+}
+
+
+def start_simulator(files, seed, sim_args):
+    simulator = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, 'simulator.py'),
+                                  '--files', str(files), '--seed', str(seed)] + sim_args,
+                                 stdout=subprocess.PIPE, universal_newlines=True)
+    base_url = simulator.stdout.readline().strip()
+    if not base_url:
+        simulator.kill()
+        raise SystemExit('The simulator did not start')
+    return simulator, base_url
+
+
+def crawl(spider, feed, stats_path, spider_args, settings, env):
+    """(stats, wall time in seconds, peak RSS in bytes) of a crawl"""
+    command = [sys.executable, os.path.join(BENCHMARKS, 'crawl.py'), spider, feed, stats_path] + spider_args
+    for name, value in settings.items():
+        command += ['--set', '%s=%s' % (name, value)]
+    started = time.time()
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.time() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise SystemExit('%s exited with %d' % (spider, process.returncode))
+    with open(stats_path) as stats_file:
+        stats = json.load(stats_file)
+    # ru_maxrss is in kilobytes on Linux
+    return stats, wall, usage.ru_maxrss * 1024
+
+
+def read_rows(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def write_rows(filename, fieldnames, rows):
+    with open(filename, 'w') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def unique(rows, fieldnames):
+    seen = set()
+    for row in rows:
+        key = tuple(row[fieldname] for fieldname in fieldnames)
+        if key not in seen:
+            seen.add(key)
+            yield dict(zip(fieldnames, key))
+
+
+def report(spider, stats, wall, rss, repositories):
+    # Requests answered from the repository store never reach the API
+    requests = stats.get('downloader/request_count', 0) - stats.get('repo_store/local_requests', 0)
+    return {
+        'spider': spider,
+        'requests': requests,
+        'rate_limited': stats.get('downloader/response_status_count/403', 0),
+        'items': stats.get('item_scraped_count', 0),
+        'repositories': repositories,
+        'requests_per_repository': float(requests) / repositories if repositories else None,
+        'wall_seconds': wall,
+        'peak_rss_bytes': rss,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark against the GitHub API simulator')
+    parser.add_argument('--files', type=int, default=1000, help='files in the simulated data set')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tokens', type=int, default=2, help='number of (fake) Github_N tokens')
+    parser.add_argument('--spiders', default=','.join(SPIDERS), help='comma separated spiders to run, in pipeline order')
+    parser.add_argument('--toggled', action='append', default=[], help='toggled_repos argument NAME=VALUE')
+    parser.add_argument('--augment', action='append', default=[], help='augment_toggled_repos argument NAME=VALUE')
+    parser.add_argument('--top', action='append', default=[], help='top_contributors argument NAME=VALUE')
+    parser.add_argument('--set', action='append', default=[], help='setting NAME=VALUE of every spider')
+    parser.add_argument('--sim', action='append', default=[], help='argument of benchmarks/simulator.py')
+    parser.add_argument('--workdir', help='directory of the feeds and stats, a temporary one by default')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='githubdisco-benchmark-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    settings = dict(DEFAULT_SETTINGS, **dict(setting.split('=', 1) for setting in args.set))
+    spider_args = {
+        'toggled_repos': args.toggled,
+        'augment_toggled_repos': args.augment,
+        'top_contributors': args.top,
+    }
+
+    simulator, base_url = start_simulator(args.files, args.seed, args.sim)
+    env = {name: value for name, value in os.environ.items() if not name.startswith('Github_')}
+    env['GITHUB_API_URL'] = base_url
+    env['GITHUB_RAW_URL'] = base_url + '/raw'
+
+    results = []
+    toggled = os.path.join(workdir, 'toggled_repos.csv')
+    try:
+        for spider in args.spiders.split(','):
+            feed = os.path.join(workdir, '%s.csv' % spider)
+            stats_path = os.path.join(workdir, '%s-stats.json' % spider)
+            extra = list(spider_args[spider])
+            if spider == 'augment_toggled_repos':
+                repos = os.path.join(workdir, 'repositories.csv')
+                write_rows(repos, ['repo_name'], unique(read_rows(toggled), ['repo_name']))
+                extra.append('repos_filename=%s' % repos)
+            elif spider == 'top_contributors':
+                libraries = os.path.join(workdir, 'libraries.csv')
+                write_rows(libraries, ['library', 'repo_name'], unique(read_rows(toggled), ['library', 'repo_name']))
+                extra.append('repos_filename=%s' % libraries)
+
+            # Tokens of their own, every spider starts with the full rate limits
+            tokens = {'Github_%d' % (index + 1): '%s-token-%d' % (spider, index + 1) for index in range(args.tokens)}
+            stats, wall, rss = crawl(spider, feed, stats_path, extra, settings, dict(env, **tokens))
+            repositories = len(set(row['repo_name'] for row in read_rows(feed) if row.get('repo_name')))
+            results.append(report(spider, stats, wall, rss, repositories))
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+    print('%-22s %9s %9s %9s %9s %9s %9s %9s' % ('spider', 'requests', '403s', 'items', 'repos', 'req/repo', 'wall s', 'RSS MB'))
+    for result in results:
+        print('%-22s %9d %9d %9d %9d %9s %9.1f %9.1f' % (
+            result['spider'], result['requests'], result['rate_limited'], result['items'], result['repositories'],
+            '%.2f' % result['requests_per_repository'] if result['requests_per_repository'] is not None else '-',
+            result['wall_seconds'], result['peak_rss_bytes'] / 1048576.0))
+    print('feeds and stats in %s' % workdir)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'files': args.files, 'seed': args.seed, 'tokens': args.tokens, 'settings': settings,
+                       'spider_args': spider_args, 'results': results}, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
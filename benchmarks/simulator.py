@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+
+# GitHub API simulator for the benchmarks
+#
+# Serves a synthetic, seeded data set through the endpoints the spiders use:
+# code search, repositories, contributors, commits, contents, blobs, raw
+# files and GraphQL. It models what the spiders depend on:
+#
+# * total_count and the 1000 results limit of code search, results sorted
+#   by s=indexed in both orders, file sizes with a log-normal distribution
+#   so the size splits behave like on GitHub
+# * Link headers on contributors and commits pages
+# * X-RateLimit-* headers per token and bucket, with a 403 (or a GraphQL
+#   RATE_LIMITED error) once a token runs out in its window
+#
+# Search phrases are not known in advance: every file contains any quoted
+# phrase with probability --density, and contains it verbatim (as opposed
+# to only tokenized, e.g. "paypal com") with probability --match-rate.
+#
+# Recorded responses, one JSON object per line with "method", "url" (path
+# and query), "status", "headers" and "body", are replayed before anything
+# is simulated:
+#
+# $ python benchmarks/simulator.py --port 8700 --files 20000 --recorded responses.jsonl
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import string
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, unquote_plus, urlencode, urlparse
+
+MAX_RESULTS = 1000
+# Size of the files generated from a template (--template-rate), the
+# spiders have to split their searches by query
+TEMPLATE_SIZE = 1337
+WORD_CHARS = string.ascii_lowercase + string.digits
+
+# Requests per window (seconds) for every token
+DEFAULT_RATE_LIMITS = {
+    'search': (30, 60),
+    'core': (5000, 3600),
+    'graphql': (5000, 3600),
+}
+
+
+def sha1(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class Dataset(object):
+
+    def __init__(self, files=5000, owners=1000, density=0.5, match_rate=0.33, missing_rate=0.02, template_rate=0.0, seed=1,
+                 files_per_repo=1):
+        self.files_per_repo = files_per_repo
+        self.density = density
+        self.match_rate = match_rate
+        self.missing_rate = missing_rate
+        self.seed = seed
+        self.phrases = set()
+
+        rng = random.Random(seed)
+        self.files = []
+        for idx in range(files):
+            repo, nth = divmod(idx, files_per_repo)
+            self.files.append({
+                'idx': idx,
+                'repo': 'owner%d/repo%d' % (repo % owners, repo),
+                # Index of the first file of the repository, its metadata are the repository's
+                'first': idx - nth,
+                'path': 'README.md' if nth == 0 else 'NOTES%d.md' % nth,
+                'sha': sha1(seed, 'file', idx),
+                'ref': sha1(seed, 'ref', idx),
+                # Only files smaller than 384 KB are searchable, templates all have the same size
+                'size': TEMPLATE_SIZE if rng.random() < template_rate else min(int(rng.lognormvariate(8, 1.2)), 384 * 1024),
+                'words': set(rng.choice(WORD_CHARS) + rng.choice(WORD_CHARS[:10]) for _ in range(5)) |
+                         set(rng.choice(WORD_CHARS) for _ in range(2)),
+            })
+
+    def chance(self, *parts):
+        return (zlib.crc32(':'.join(str(part) for part in parts).encode('utf-8')) % 10000) / 10000.0
+
+    def contains(self, f, phrase):
+        return self.chance(self.seed, 'contains', phrase, f['idx']) < self.density
+
+    def verbatim(self, f, phrase):
+        return self.chance(self.seed, 'verbatim', phrase, f['idx']) < self.match_rate
+
+    def search(self, phrases, any_phrase, words, size_from, size_to, descending):
+        self.phrases.update(phrases)
+        items = []
+        for f in self.files:
+            if not size_from <= f['size'] <= size_to or not words <= f['words']:
+                continue
+            found = [self.contains(f, phrase) for phrase in phrases]
+            if phrases and not (any(found) if any_phrase else all(found)):
+                continue
+            items.append(f)
+        items.sort(key=lambda f: f['idx'], reverse=descending)
+        return items
+
+    def content(self, f):
+        lines = ['# %s' % f['repo'], '']
+        for phrase in sorted(self.phrases):
+            if self.contains(f, phrase):
+                if self.verbatim(f, phrase):
+                    lines.append('Donate at https://%s/example' % phrase)
+                else:
+                    lines.append('Mentions %s in passing' % re.sub(r'\W+', ' ', phrase))
+        lines.append('lorem ipsum ' * 20)
+        return '\n'.join(lines).encode('utf-8')
+
+    def file_by_repo(self, repo_name):
+        match = re.match(r'^owner\d+/repo(\d+)$', repo_name)
+        first = int(match.group(1)) * self.files_per_repo if match else None
+        if first is None or first >= len(self.files):
+            return None
+        f = self.files[first]
+        if self.chance(self.seed, 'missing', f['idx']) < self.missing_rate:
+            return None
+        return f
+
+    def repository(self, f):
+        rng = random.Random(sha1(self.seed, 'repository', f['idx']))
+        commits = 0 if rng.random() < 0.02 else max(1, int(rng.lognormvariate(3, 1.5)))
+        created = 1262304000 + rng.randint(0, 300000000)
+        return {
+            'size': int(rng.lognormvariate(7, 2)),
+            'language': rng.choice(['JavaScript', 'Python', 'Java', 'Go', 'Ruby', None]),
+            'created_at': created,
+            'pushed_at': created + rng.randint(0, 100000000),
+            'parent': 'upstream%d/repo%d' % (f['idx'] % 97, f['idx']) if rng.random() < 0.1 else None,
+            'commits': commits,
+            'contributors': min(commits, max(1, int(rng.lognormvariate(1, 1.3)))) if commits else 0,
+        }
+
+    def commit_sha(self, f, offset):
+        """sha of the commit offset commits before the head"""
+        return sha1(self.seed, 'commit', f['idx'], offset)
+
+
+class RateLimiter(object):
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def hit(self, token, bucket):
+        """(allowed, headers) for one more request of token in bucket"""
+        limit, window = self.limits[bucket]
+        now = time.time()
+        with self.lock:
+            reset, used = self.windows.get((token, bucket), (now + window, 0))
+            if now >= reset:
+                reset, used = now + window, 0
+            allowed = used < limit
+            if allowed:
+                used += 1
+            self.windows[(token, bucket)] = (reset, used)
+        return allowed, {
+            'X-RateLimit-Limit': str(limit),
+            'X-RateLimit-Remaining': str(limit - used),
+            'X-RateLimit-Reset': str(int(reset) + 1),
+            'X-RateLimit-Resource': bucket,
+        }
+
+
+def iso(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+def link_header(path, query, page, last_page):
+    links = []
+    if page < last_page:
+        links.append('<%s?%s>; rel="next"' % (path, urlencode(dict(query, page=page + 1))))
+    links.append('<%s?%s>; rel="last"' % (path, urlencode(dict(query, page=last_page))))
+    return ', '.join(links)
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'GitHubSimulator/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def dataset(self):
+        return self.server.dataset
+
+    def respond(self, status, body=b'', headers=None, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def replay(self, method):
+        recorded = self.server.recorded.get((method, self.path))
+        if recorded is None:
+            return False
+        body = recorded.get('body', '')
+        self.respond(recorded.get('status', 200), body.encode('utf-8') if isinstance(body, str) else body,
+                     recorded.get('headers'), recorded.get('headers', {}).get('Content-Type', 'application/json'))
+        return True
+
+    def limited(self, bucket):
+        """Rate limit headers for the request, None if it was answered with a rate limit error"""
+        token = self.headers.get('Authorization', 'anonymous')
+        allowed, headers = self.server.rate_limiter.hit(token, bucket)
+        if allowed:
+            return headers
+        if bucket == 'graphql':
+            self.respond(200, {'errors': [{'type': 'RATE_LIMITED', 'message': 'API rate limit exceeded'}]}, headers)
+        else:
+            self.respond(403, {'message': 'API rate limit exceeded'}, headers)
+        return None
+
+    def do_GET(self):
+        self.server.count('GET')
+        if self.replay('GET'):
+            return
+
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+
+        if parts[0] == 'raw':
+            return self.raw(parts[1:])
+        headers = self.limited('search' if parts[0] == 'search' else 'core')
+        if headers is None:
+            return
+        if parts[:2] == ['search', 'code']:
+            return self.search(url, headers)
+        if parts[0] != 'repos' or len(parts) < 3:
+            return self.respond(404, {'message': 'Not Found'}, headers)
+
+        f = self.dataset.file_by_repo('/'.join(parts[1:3]))
+        if f is None:
+            return self.respond(404, {'message': 'Not Found'}, headers)
+        rest = parts[3:]
+        if not rest:
+            return self.repository(f, headers)
+        if rest == ['contributors']:
+            return self.contributors(f, url.path, query, headers)
+        if rest == ['commits']:
+            return self.commits(f, url.path, query, headers)
+        if rest[0] == 'contents':
+            return self.respond(200, {'path': f['path'], 'sha': f['sha'], 'encoding': 'base64',
+                                      'content': base64.b64encode(self.dataset.content(f)).decode('ascii')}, headers)
+        if rest[:2] == ['git', 'blobs']:
+            if 'raw' in self.headers.get('Accept', ''):
+                return self.respond(200, self.dataset.content(f), headers, 'application/vnd.github.v3.raw')
+            return self.respond(200, {'sha': f['sha'], 'encoding': 'base64',
+                                      'content': base64.b64encode(self.dataset.content(f)).decode('ascii')}, headers)
+        self.respond(404, {'message': 'Not Found'}, headers)
+
+    def raw(self, parts):
+        f = self.dataset.file_by_repo('/'.join(parts[:2]))
+        if f is None:
+            return self.respond(404, b'404: Not Found', content_type='text/plain')
+        self.respond(200, self.dataset.content(f), content_type='text/plain')
+
+    def search(self, url, headers):
+        query = parse_qs(url.query)
+        q = unquote_plus(query.get('q', [''])[0])
+        phrases = re.findall(r'"([^"]*)"', q)
+        tokens = re.sub(r'"[^"]*"', ' ', q).split()
+        words = set(token for token in tokens if ':' not in token and token not in ('OR', 'AND', 'NOT'))
+        size = re.search(r'size:(\d+)\.\.(\d+)', q)
+        size_from, size_to = (int(size.group(1)), int(size.group(2))) if size else (0, sys.maxsize)
+        descending = query.get('o', ['desc'])[0] == 'desc'
+        page = int(query.get('page', ['1'])[0])
+        per_page = min(int(query.get('per_page', ['30'])[0]), 100)
+
+        if page * per_page > MAX_RESULTS and (page - 1) * per_page >= MAX_RESULTS:
+            return self.respond(422, {'message': 'Only the first 1000 search results are available'}, headers)
+
+        items = self.dataset.search(phrases, ' OR ' in q, words, size_from, size_to, descending)
+        text_match = 'text-match' in self.headers.get('Accept', '')
+        results = []
+        for f in items[(page - 1) * per_page:page * per_page]:
+            result = {
+                'name': f['path'],
+                'path': f['path'],
+                'sha': f['sha'],
+                'url': '%s/repos/%s/contents/%s?ref=%s' % (self.server.base_url, f['repo'], f['path'], f['ref']),
+                'score': 1.0,
+                'repository': {'full_name': f['repo'], 'fork': f['first'] % 10 == 0},
+            }
+            if text_match:
+                result['text_matches'] = [{'fragment': line} for line in self.dataset.content(f).decode('utf-8').splitlines()
+                                          if any(re.sub(r'\W+', ' ', phrase) in re.sub(r'\W+', ' ', line) for phrase in phrases)]
+            results.append(result)
+        self.respond(200, {'total_count': len(items), 'incomplete_results': False, 'items': results}, headers)
+
+    def repository(self, f, headers):
+        info = self.dataset.repository(f)
+        self.respond(200, {
+            'full_name': f['repo'],
+            'size': info['size'],
+            'language': info['language'],
+            'created_at': iso(info['created_at']),
+            'pushed_at': iso(info['pushed_at']),
+            'fork': info['parent'] is not None,
+            'source': {'full_name': info['parent']} if info['parent'] else None,
+        }, headers)
+
+    def contributors(self, f, path, query, headers):
+        info = self.dataset.repository(f)
+        if not info['contributors']:
+            return self.respond(204, b'', headers)
+        page = int(query.get('page', 1))
+        per_page = min(int(query.get('per_page', 30)), 100)
+        total = info['contributors']
+        contributors = [{'login': 'user%d' % index, 'contributions': max(1, info['commits'] // (index + 2))}
+                        for index in range((page - 1) * per_page, min(page * per_page, total))]
+        last_page = max(1, (total + per_page - 1) // per_page)
+        if last_page > 1:
+            headers = dict(headers, Link=link_header(path, query, page, last_page))
+        self.respond(200, contributors, headers)
+
+    def commit(self, f, offset):
+        login = 'user%d' % (offset % 7)
+        chance = self.dataset.chance(self.dataset.seed, 'commit', f['idx'], login, offset)
+        # Some authors hide their email, some commits are made through the web interface
+        email = '%s@users.noreply.github.com' % login if chance < 0.2 else '%s@example.org' % login
+        committer = {'name': 'GitHub', 'email': 'noreply@github.com'} if chance > 0.7 else {'name': login, 'email': email}
+        return {
+            'sha': self.dataset.commit_sha(f, offset),
+            # None when the email isn't linked to the GitHub account
+            'author': {'login': login} if chance < 0.9 else None,
+            'commit': {
+                'author': {'name': login, 'email': email},
+                'committer': committer,
+            },
+        }
+
+    def commits(self, f, path, query, headers):
+        info = self.dataset.repository(f)
+        if not info['commits']:
+            return self.respond(409, {'message': 'Git Repository is empty.'}, headers)
+        page = int(query.get('page', 1))
+        per_page = min(int(query.get('per_page', 30)), 100)
+        if 'author' in query:
+            # Commits linked to the login, the history is authored by user0..user6 in turns
+            history = (self.commit(f, offset) for offset in range(info['commits']))
+            matching = [commit for commit in history if commit['author'] and commit['author']['login'] == query['author']]
+            total = len(matching)
+            commits = matching[(page - 1) * per_page:page * per_page]
+        else:
+            total = info['commits']
+            commits = [self.commit(f, offset) for offset in range((page - 1) * per_page, min(page * per_page, total))]
+        last_page = max(1, (total + per_page - 1) // per_page)
+        if last_page > 1:
+            headers = dict(headers, Link=link_header(path, query, page, last_page))
+        self.respond(200, commits, headers)
+
+    def do_POST(self):
+        self.server.count('POST')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.replay('POST'):
+            return
+        if urlparse(self.path).path != '/graphql':
+            return self.respond(404, {'message': 'Not Found'})
+        headers = self.limited('graphql')
+        if headers is None:
+            return
+
+        query = json.loads(body)['query']
+        data = {}
+        errors = []
+        for alias, owner, name, fields in re.findall(r'(\w+): repository\(owner: "([^"]+)", name: "([^"]+)"\) \{(.*?)\n  \}',
+                                                     query, re.DOTALL):
+            f = self.dataset.file_by_repo('%s/%s' % (owner, name))
+            if f is None:
+                data[alias] = None
+                errors.append({'type': 'NOT_FOUND', 'path': [alias], 'message': 'Could not resolve to a Repository'})
+                continue
+            info = self.dataset.repository(f)
+            history = re.search(r'history\(first: (\d+)\) \{\s*nodes \{\s*author', fields)
+            if history:
+                nodes = []
+                for offset in range(min(int(history.group(1)), info['commits'])):
+                    commit = self.commit(f, offset)
+                    nodes.append({
+                        'author': dict(commit['commit']['author'], user=commit['author']),
+                        'committer': dict(commit['commit']['committer'], user=None),
+                    })
+                data[alias] = {'defaultBranchRef': {'target': {'history': {'nodes': nodes}}} if nodes else None}
+                continue
+            after = re.search(r'after: "(\w+) (\d+)"', fields)
+            if after:
+                offset = int(after.group(2)) + 1
+                nodes = [{'oid': self.dataset.commit_sha(f, offset)}] if offset < info['commits'] else []
+                data[alias] = {'object': {'history': {'nodes': nodes}}}
+                continue
+            data[alias] = {
+                'nameWithOwner': f['repo'],
+                'diskUsage': info['size'],
+                'pushedAt': iso(info['pushed_at']),
+                'createdAt': iso(info['created_at']),
+                'primaryLanguage': {'name': info['language']} if info['language'] else None,
+                'parent': {'nameWithOwner': info['parent'], 'isFork': False} if info['parent'] else None,
+                'defaultBranchRef': {'target': {'oid': self.dataset.commit_sha(f, 0), 'history': {'totalCount': info['commits']}}}
+                                    if info['commits'] else None,
+            }
+        self.respond(200, dict({'data': data}, **({'errors': errors} if errors else {})), headers)
+
+
+class Simulator(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, dataset, rate_limits=DEFAULT_RATE_LIMITS, recorded=None):
+        ThreadingHTTPServer.__init__(self, address, SimulatorHandler)
+        self.dataset = dataset
+        self.rate_limiter = RateLimiter(rate_limits)
+        self.recorded = recorded or {}
+        self.base_url = 'http://%s:%d' % self.server_address[:2]
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def count(self, method):
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+
+def load_recorded(path):
+    recorded = {}
+    with open(path) as recorded_file:
+        for line in recorded_file:
+            if line.strip():
+                response = json.loads(line)
+                recorded[(response.get('method', 'GET'), response['url'])] = response
+    return recorded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='GitHub API simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--files', type=int, default=5000, help='files in the data set')
+    parser.add_argument('--files-per-repo', type=int, default=1, help='matching files of every repository')
+    parser.add_argument('--owners', type=int, default=1000)
+    parser.add_argument('--density', type=float, default=0.5, help='probability of a file to contain a searched phrase')
+    parser.add_argument('--match-rate', type=float, default=0.33, help='probability of a phrase to be in a file verbatim')
+    parser.add_argument('--missing-rate', type=float, default=0.02, help='probability of a repository to be gone (404)')
+    parser.add_argument('--template-rate', type=float, default=0.0, help='share of files of the very same size')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--search-limit', type=int, default=DEFAULT_RATE_LIMITS['search'][0])
+    parser.add_argument('--search-window', type=int, default=DEFAULT_RATE_LIMITS['search'][1])
+    parser.add_argument('--core-limit', type=int, default=DEFAULT_RATE_LIMITS['core'][0])
+    parser.add_argument('--core-window', type=int, default=DEFAULT_RATE_LIMITS['core'][1])
+    parser.add_argument('--recorded', help='JSON lines of recorded responses to replay')
+    args = parser.parse_args(argv)
+
+    dataset = Dataset(args.files, args.owners, args.density, args.match_rate, args.missing_rate, args.template_rate, args.seed,
+                      args.files_per_repo)
+    rate_limits = {
+        'search': (args.search_limit, args.search_window),
+        'core': (args.core_limit, args.core_window),
+        'graphql': (args.core_limit, args.core_window),
+    }
+    recorded = load_recorded(args.recorded) if args.recorded else None
+    simulator = Simulator((args.host, args.port), dataset, rate_limits, recorded)
+    # The benchmark runner reads the url from the first line
+    print(simulator.base_url, flush=True)
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(simulator.requests), file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    main()
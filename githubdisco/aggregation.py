@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# Repository level records of the toggled_repos search hits
+#
+# A search hit is a file: a repository comes up once per matching file and
+# the output grows with the hits. A RepoAggregator keeps a single record per
+# library and repository instead, with the number of hits, the names of the
+# matched files and the fork flag, so the output grows with the repositories.
+#
+# Records are only complete once every query of their library is crawled,
+# the spider emits them when it is done (see ToggledReposSpider.spider_idle).
+#
+# A run with a checkpoint or incremental state never counts a hit it marked
+# as seen or known again, the records of an interrupted run must outlive it.
+# Given the SQLite connection of that state, the aggregator keeps its records
+# in it, committed along with the marks of the hits, and the run that finally
+# gets to the end emits them.
+
+import json
+
+# Columns of the records (see githubdisco/pipelines.py)
+RECORD_SCHEMA = [('library', 'string'), ('repo_name', 'string'), ('forked', 'bool'), ('hits', 'int'),
+                 ('names', 'strings')]
+
+
+class RepoAggregator(object):
+
+    def __init__(self, db=None):
+        # (library, repo_name) -> [forked, hits, file names], in memory
+        self.repositories = {}
+        self.db = db
+        if db is not None:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS aggregated (
+                    library TEXT NOT NULL,
+                    repo_name TEXT NOT NULL,
+                    forked INTEGER NOT NULL,
+                    hits INTEGER NOT NULL,
+                    names TEXT NOT NULL,
+                    PRIMARY KEY (library, repo_name)
+                )
+            ''')
+
+    def add(self, item):
+        """Count a hit item of the spider, committed by the owner of db if any"""
+        key = (item['library'], item['repo_name'])
+        if self.db is None:
+            record = self.repositories.get(key)
+            if record is None:
+                self.repositories[key] = [item['forked'], 1, {item['name']}]
+                return
+            record[1] += 1
+            record[2].add(item['name'])
+            return
+
+        row = self.db.execute('SELECT hits, names FROM aggregated WHERE library = ? AND repo_name = ?', key).fetchone()
+        hits, names = (row[0], set(json.loads(row[1]))) if row else (0, set())
+        names.add(item['name'])
+        self.db.execute('INSERT OR REPLACE INTO aggregated (library, repo_name, forked, hits, names) VALUES (?, ?, ?, ?, ?)',
+                        key + (bool(item['forked']), hits + 1, json.dumps(sorted(names))))
+
+    def records(self):
+        """The records aggregated so far, forgotten once returned"""
+        if self.db is not None:
+            rows = self.db.execute('SELECT library, repo_name, forked, hits, names FROM aggregated').fetchall()
+            self.db.execute('DELETE FROM aggregated')
+            self.db.commit()
+            self.repositories = {(library, repo_name): [bool(forked), hits, set(json.loads(names))]
+                                 for library, repo_name, forked, hits, names in rows}
+        records = [{
+            'library':      library,
+            'repo_name':    repo_name,
+            'forked':       forked,
+            'hits':         hits,
+            'names':        sorted(names),
+        } for (library, repo_name), (forked, hits, names) in self.repositories.items()]
+        self.repositories = {}
+        return records
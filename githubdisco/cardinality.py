@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+# Upper bounds of query splitter probes
+#
+# A splitter probe searches a library's string plus a term (e.g. "paypal.com"
+# a) in a single size. The same term searched on its own, with the same
+# qualifiers and size, can't have fewer results: its total_count bounds the
+# probe of every library sharing those qualifiers (e.g. all the markdown
+# ones). Terms with a bound of 0 are never probed, the others are ordered
+# by their bound.
+#
+# A per_page=1 search costs a request of the search quota like any other,
+# so the bounds are only worth it shared: a TermCounts keeps them across
+# libraries and, in its SQLite file, across runs until they are max_age
+# seconds old.
+
+import re
+import sqlite3
+import time
+
+
+def bound_url(probe_url):
+    """Search for the splitter term of probe_url alone, a single result per page"""
+    url = re.sub(r'q=%22.*%22\+', 'q=', probe_url)
+    return re.sub(r'([?&])per_page=\d+', r'\1per_page=1', url)
+
+
+class TermCounts(object):
+
+    def __init__(self, path, max_age=30 * 24 * 3600):
+        self.max_age = max_age
+        self.db = sqlite3.connect(path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS term_counts (
+                url TEXT PRIMARY KEY,
+                total_count INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def get(self, url):
+        """total_count of the bound search url, None if unknown or too old"""
+        row = self.db.execute('SELECT total_count FROM term_counts WHERE url = ? AND updated_at >= ?',
+                              (url, time.time() - self.max_age)).fetchone()
+        return row[0] if row else None
+
+    def put(self, url, total_count):
+        self.db.execute('INSERT OR REPLACE INTO term_counts (url, total_count, updated_at) VALUES (?, ?, ?)',
+                        (url, total_count, time.time()))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# On-disk crawl state for the toggled_repos split tree
+#
+# Every search request yielded by the spider is a node of the split tree
+# (library, size range, order, splitter, page) identified by its library and
+# url, libraries sharing a search string search the same url. Nodes
+# are stored as pending when yielded and marked done once their response
+# has been parsed, together with the seen result keys and excluded splitter
+# patterns the parse produced. A restarted crawl re-issues only the nodes
+# that are still pending.
+
+import json
+import sqlite3
+
+
+class CrawlCheckpoint(object):
+
+    # Request meta needed to rebuild a node, 'library' is kept by name in a
+    # column of its own and restored by the spider. Content requests are
+    # rebuilt from their repo_name and remaining files
+    meta_keys = ('page', 'from', 'to', 'per_page', 'splitter', 'stop', 'strategy', 'incremental', 'repo_name', 'files')
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(frontier)')]
+        if columns and 'library' not in columns:
+            # Frontier of a checkpoint keyed by url alone
+            self.db.executescript('''
+                DROP INDEX IF EXISTS frontier_pending;
+                ALTER TABLE frontier RENAME TO frontier_by_url;
+            ''')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS frontier (
+                library TEXT NOT NULL,
+                url TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                meta TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (library, url)
+            );
+            CREATE INDEX IF NOT EXISTS frontier_pending ON frontier (scope, done);
+            CREATE TABLE IF NOT EXISTS seen (
+                scope TEXT NOT NULL,
+                key INTEGER NOT NULL,
+                markers TEXT NOT NULL,
+                PRIMARY KEY (scope, key)
+            );
+            CREATE TABLE IF NOT EXISTS excluded (
+                scope TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                splitter TEXT NOT NULL,
+                PRIMARY KEY (scope, size, splitter)
+            );
+        ''')
+        if columns and 'library' not in columns:
+            self.db.executescript('''
+                INSERT OR IGNORE INTO frontier (library, url, scope, meta, done)
+                    SELECT COALESCE(json_extract(meta, '$.library'), scope), url, scope, json_remove(meta, '$.library'), done
+                    FROM frontier_by_url;
+                DROP TABLE frontier_by_url;
+            ''')
+
+    def has_state(self, scope):
+        row = self.db.execute('SELECT 1 FROM frontier WHERE scope = ? LIMIT 1', (scope,)).fetchone()
+        return row is not None
+
+    def add_pending(self, scope, url, meta):
+        node = {key: meta[key] for key in self.meta_keys if key in meta}
+        # Not always the scope, e.g. the unpacked searches of a shared query
+        library = meta['library']['library'] if 'library' in meta else scope
+        # Never reopen a node that was already completed
+        self.db.execute('INSERT OR IGNORE INTO frontier (library, url, scope, meta) VALUES (?, ?, ?, ?)',
+                        (library, url, scope, json.dumps(node)))
+
+    def mark_done(self, library, url):
+        self.db.execute('UPDATE frontier SET done = 1 WHERE library = ? AND url = ?', (library, url))
+
+    def pending(self, scope):
+        """[(url, meta)] of the nodes of scope not done yet, meta['library'] is the name of the library"""
+        rows = self.db.execute('SELECT library, url, meta FROM frontier WHERE scope = ? AND done = 0', (scope,))
+        return [(url, dict(json.loads(meta), library=library)) for library, url, meta in rows]
+
+    def save_markers(self, scope, key, markers):
+        self.db.execute('INSERT OR REPLACE INTO seen (scope, key, markers) VALUES (?, ?, ?)',
+                        (scope, key, json.dumps(sorted(markers))))
+
+    def load_seen(self, scope, seen):
+        for key, markers in self.db.execute('SELECT key, markers FROM seen WHERE scope = ?', (scope,)):
+            for marker in json.loads(markers):
+                seen.add(key, marker)
+        return seen
+
+    def save_excluded(self, scope, size, splitter):
+        self.db.execute('INSERT OR IGNORE INTO excluded (scope, size, splitter) VALUES (?, ?, ?)',
+                        (scope, size, splitter))
+
+    def load_excluded(self, scope):
+        exclude_pattern = {}
+        for size, splitter in self.db.execute('SELECT size, splitter FROM excluded WHERE scope = ?', (scope,)):
+            exclude_pattern.setdefault(size, {})[splitter] = 'excluded'
+        return exclude_pattern
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
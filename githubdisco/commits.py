@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# Commit statistics of a repository's default branch
+#
+# Listing the commits one per page makes the rel="last" page number of the
+# Link header the number of commits, and that last page holds the first
+# commit. Page 1 alone answers both for repositories with a single commit
+# (no Link header at all), longer histories need the last page too.
+#
+# A first commit only changes when the history is rewritten, so a
+# CommitStatsCache keeps the first commit and count of every repository
+# across runs: as long as the history didn't shrink the cached first commit
+# is reused and page 1 is the only request.
+
+import re
+import sqlite3
+
+
+def last_page(link_header):
+    """Page number of the rel="last" link, None without one"""
+    if not link_header:
+        return None
+    if isinstance(link_header, bytes):
+        link_header = link_header.decode('utf-8')
+    for rel_link in link_header.split(', '):
+        link, rel = rel_link.split('; ')
+        if rel == 'rel="last"':
+            return int(re.search(r'[?&]page=(\d+)', link).group(1))
+    return None
+
+
+def first_page_stats(link_header, commits):
+    """(number of commits, first commit sha or None if it's on another page) from page 1"""
+    total = last_page(link_header)
+    if total is None:
+        # Everything is on this page, at most one commit
+        total = len(commits)
+    if total <= 1:
+        return total, commits[0]['sha'] if commits else None
+    return total, None
+
+
+class CommitStatsCache(object):
+
+    # Commits between two flushes to disk
+    batch = 100
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS commit_stats (
+                repo_name TEXT PRIMARY KEY,
+                first_commit_sha TEXT NOT NULL,
+                number_of_commits INTEGER NOT NULL
+            )
+        ''')
+        self.unsaved = 0
+
+    def first_commit(self, repo_name, number_of_commits):
+        """Cached first commit of repo_name, None if unknown or the history shrank since"""
+        row = self.db.execute('SELECT first_commit_sha, number_of_commits FROM commit_stats WHERE repo_name = ?',
+                              (repo_name,)).fetchone()
+        if row is None or row[1] > number_of_commits:
+            return None
+        return row[0]
+
+    def put(self, repo_name, first_commit_sha, number_of_commits):
+        self.db.execute('INSERT OR REPLACE INTO commit_stats VALUES (?, ?, ?)',
+                        (repo_name, first_commit_sha, number_of_commits))
+        self.unsaved += 1
+        if self.unsaved >= self.batch:
+            self.db.commit()
+            self.unsaved = 0
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
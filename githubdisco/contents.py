@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Fetching the contents of search hits for verification
+#
+# Search results carry the blob sha and the commit (ref) of every file, so
+# no tree listing is needed to locate them. Depending on the mode a file is
+# downloaded through:
+#
+# * 'api': the contents API, one core request per file, base64 in JSON
+# * 'blob': the git blobs API with the raw media type, one core request per
+#   file but the bytes come as they are
+# * 'raw': raw.githubusercontent.com (GITHUB_RAW_URL), raw bytes and no API
+#   quota at all
+
+import os
+import re
+
+from urllib.parse import quote
+
+from githubdisco import github
+
+RAW_URL = os.environ.get('GITHUB_RAW_URL', 'https://raw.githubusercontent.com').rstrip('/')
+RAW_MEDIA_TYPE = 'application/vnd.github.v3.raw'
+
+MODES = ('api', 'blob', 'raw')
+
+
+def content_hit(match):
+    """The fields of a search result needed to fetch its contents"""
+    ref = re.search(r'[?&]ref=([0-9a-f]+)', match.get('url') or '')
+    return {
+        'path': match['path'],
+        'sha': match['sha'],
+        'ref': ref.group(1) if ref else None,
+        'url': match.get('url'),
+    }
+
+
+class ContentFetcher(object):
+
+    def __init__(self, mode):
+        if mode not in MODES:
+            raise ValueError('Unknown contents mode %r, expected one of %s' % (mode, ', '.join(MODES)))
+        self.mode = mode
+
+    @property
+    def content_format(self):
+        """How the verification decodes the body, see verification.content_text"""
+        return 'contents' if self.mode == 'api' else 'raw'
+
+    def url(self, repo_name, hit):
+        if self.mode == 'raw' and hit['ref']:
+            return '%s/%s/%s/%s' % (RAW_URL, repo_name, hit['ref'], quote(hit['path']))
+        if self.mode == 'api' and hit['url']:
+            return hit['url']
+        return '%s/repos/%s/git/blobs/%s' % (github.API_URL, repo_name, hit['sha'])
+
+    def headers(self, url):
+        if self.mode == 'api' or not github.is_api_url(url):
+            return {}
+        return {'Accept': RAW_MEDIA_TYPE}
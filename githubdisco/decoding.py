@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Decoding of GitHub API response bodies
+#
+# Bodies are parsed straight from the response bytes, without the str copy
+# of response.text, by a backend:
+#
+# * 'orjson' or 'ujson' if installed, several times faster than the json
+#   module on 100 item search pages
+# * 'json': the json module
+#
+# None picks the fastest one installed.
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+LOADERS = {
+    'orjson': orjson.loads if orjson else None,
+    'ujson': ujson.loads if ujson else None,
+    'json': json.loads,
+}
+
+# In order of preference
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+def available_backends():
+    return [backend for backend in BACKENDS if LOADERS[backend]]
+
+
+def loader(backend=None):
+    """loads function of backend, the fastest one installed for None"""
+    if backend is None:
+        backend = available_backends()[0]
+    if backend not in LOADERS:
+        raise ValueError('Unknown JSON backend %r, expected one of %s' % (backend, ', '.join(BACKENDS)))
+    if LOADERS[backend] is None:
+        raise ValueError('JSON backend %r is not installed' % backend)
+    return LOADERS[backend]
+
+
+loads = loader()
+
+
+class ResponseDecoder(object):
+
+    def __init__(self, backend=None):
+        self.loads = loader(backend)
+
+    def json(self, response):
+        """Decoded body of response, None if it is empty (e.g. 204 No Content)"""
+        if not response.body:
+            return None
+        return self.loads(response.body)
+
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# Lazy input for the spiders that work through a CSV of repositories
+#
+# An InputFeeder pulls rows from an iterator (e.g. a csv.DictReader) only
+# when fewer than max_in_flight of them are being crawled, and turns them
+# into requests with the spider supplied requests_for(rows). Spiders report
+# every finished row with done() and yield the requests it returns, so the
+# crawl moves through the input at a constant memory footprint.
+#
+# A row whose requests fail is never reported done. Once the spider is idle
+# nothing can be in flight anymore, so idle() forgets those and feeds on.
+#
+# Duplicate rows are dropped by unique() against the last RECENT_KEYS keys
+# only, the hits of a repository come close together in a toggled_repos
+# feed. Duplicates further apart come through again, a sorted input (e.g.
+# sort -u) has none at all.
+
+import csv
+
+from collections import OrderedDict
+
+# Keys unique() remembers, the in flight rows among them
+RECENT_KEYS = 100000
+
+
+def read_csv(filename):
+    """Rows of a CSV file with a header, read one by one"""
+    with open(filename, 'r') as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield row
+
+
+def unique(rows, key, recent=RECENT_KEYS):
+    """rows without the ones whose key is one of the recent keys before"""
+    keys = OrderedDict()
+    for row in rows:
+        row_key = key(row)
+        if row_key in keys:
+            keys.move_to_end(row_key)
+            continue
+        keys[row_key] = None
+        if len(keys) > recent:
+            keys.popitem(last=False)
+        yield row
+
+
+class InputFeeder(object):
+
+    def __init__(self, rows, requests_for, max_in_flight, batch_size=1):
+        self.rows = iter(rows)
+        self.requests_for = requests_for
+        # Rows are handed over in multiples of batch_size
+        self.batch_size = batch_size
+        self.max_in_flight = max(max_in_flight, batch_size)
+        self.in_flight = 0
+        self.exhausted = False
+
+    def feed(self):
+        free = (self.max_in_flight - self.in_flight) // self.batch_size * self.batch_size
+        rows = []
+        while len(rows) < free and not self.exhausted:
+            row = next(self.rows, None)
+            if row is None:
+                self.exhausted = True
+            else:
+                rows.append(row)
+        if not rows:
+            return []
+        self.in_flight += len(rows)
+        return self.requests_for(rows)
+
+    def done(self, count=1):
+        self.in_flight -= count
+        return self.feed()
+
+    def idle(self):
+        """Requests to go on with when the spider is idle, count of the rows given up on"""
+        lost = self.in_flight
+        self.in_flight = 0
+        return self.feed(), lost
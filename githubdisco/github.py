@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# GitHub API helpers shared by the spiders and middlewares
+#
+# Tokens are read from the Github_1, Github_2, ... environment variables and
+# handed out by a TokenPool that tracks the rate limit of every token.
+#
+# GITHUB_API_URL points the spiders to another API server, e.g. the
+# simulator of the benchmarks.
+
+import os
+import time
+
+API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+
+# Requests allowed per reset window when GitHub didn't tell us yet
+# (see https://developer.github.com/v3/#rate-limiting)
+DEFAULT_LIMITS = {
+    'search': 30,
+    'core': 5000,
+    'graphql': 5000,
+}
+
+# Length in seconds of the rate limit window for each bucket
+RESET_WINDOWS = {
+    'search': 60,
+    'core': 3600,
+    'graphql': 3600,
+}
+
+
+def load_tokens(environ=os.environ):
+    """Return the Github_N tokens in order, stopping at the first missing one"""
+    tokens = []
+    while environ.get('Github_%d' % (len(tokens) + 1)):
+        tokens.append(environ['Github_%d' % (len(tokens) + 1)])
+    return tokens
+
+
+def is_api_url(url):
+    return url.startswith(API_URL)
+
+
+def bucket_for(url):
+    """Rate limit bucket (X-RateLimit-Resource) a request to url is charged to"""
+    if url.startswith(API_URL + '/search/'):
+        return 'search'
+    if url == API_URL + '/graphql':
+        return 'graphql'
+    return 'core'
+
+
+class TokenQuota(object):
+
+    def __init__(self, bucket, now):
+        self.limit = DEFAULT_LIMITS[bucket]
+        self.window = RESET_WINDOWS[bucket]
+        self.remaining = self.limit
+        self.reset = now + self.window
+
+    def refresh(self, now):
+        # GitHub restores the whole quota once the reset time is reached
+        if now >= self.reset:
+            self.remaining = self.limit
+            self.reset = now + self.window
+
+
+class TokenPool(object):
+    """Hand out the token with the most headroom for a given bucket
+
+    The remaining quota is decremented optimistically on every acquire() so
+    concurrent requests don't pile up on the same token, and corrected with
+    the X-RateLimit-* headers of every response through update().
+    """
+
+    def __init__(self, tokens, clock=time.time):
+        self.tokens = list(tokens)
+        self.clock = clock
+        self.quotas = {}
+
+    def quota(self, token_id, bucket):
+        key = (token_id, bucket)
+        if key not in self.quotas:
+            self.quotas[key] = TokenQuota(bucket, self.clock())
+        return self.quotas[key]
+
+    def acquire(self, bucket):
+        """Return (token_id, 0) or (None, seconds to wait) if every token is exhausted"""
+        now = self.clock()
+        best_id, best = None, None
+        for token_id in range(len(self.tokens)):
+            quota = self.quota(token_id, bucket)
+            quota.refresh(now)
+            if best is None or quota.remaining > best.remaining:
+                best_id, best = token_id, quota
+
+        if best is None:
+            return None, RESET_WINDOWS[bucket]
+
+        if best.remaining <= 0:
+            soonest = min(self.quota(token_id, bucket).reset for token_id in range(len(self.tokens)))
+            return None, max(soonest - now, 1)
+
+        best.remaining -= 1
+        return best_id, 0
+
+    def update(self, token_id, bucket, remaining, reset, limit=None):
+        quota = self.quota(token_id, bucket)
+        if limit is not None:
+            quota.limit = limit
+        if reset is not None and reset != quota.reset:
+            quota.reset = reset
+            quota.remaining = remaining
+        else:
+            # Responses arrive out of order, never trust a stale higher count
+            quota.remaining = min(quota.remaining, remaining)
+
+    def exhaust(self, token_id, bucket, reset):
+        quota = self.quota(token_id, bucket)
+        quota.remaining = 0
+        quota.reset = reset
+
+    def header(self, token_id):
+        return 'Bearer ' + self.tokens[token_id]
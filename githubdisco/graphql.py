@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# Batched GitHub GraphQL (v4) queries for repository metadata
+#
+# A single query asks for many repositories at once, every one under its own
+# alias (r0, r1, ...). A repository that doesn't exist comes back as null
+# next to a NOT_FOUND error while the others are still answered.
+#
+# The first commit is found with the history cursor trick: cursors of the
+# history connection are '<head oid> <offset>', so the commit after offset
+# totalCount - 2 is the last one of the history, i.e. the first commit.
+#
+# The authors of the latest commits of many repositories, with their emails
+# and GitHub logins, come from a single query as well (author_histories_query).
+
+import json
+
+from githubdisco import github
+
+# Repositories per query, GitHub starts timing out well before its node limit
+BATCH_SIZE = 50
+
+REPOSITORY_FIELDS = '''
+    nameWithOwner
+    diskUsage
+    pushedAt
+    createdAt
+    primaryLanguage { name }
+    parent { nameWithOwner isFork }
+    defaultBranchRef {
+      target {
+        ... on Commit {
+          oid
+          history { totalCount }
+        }
+      }
+    }
+'''
+
+FIRST_COMMIT_FIELDS = '''
+    object(oid: %s) {
+      ... on Commit {
+        history(first: 1, after: %s) { nodes { oid } }
+      }
+    }
+'''
+
+
+def graphql_url():
+    return github.API_URL + '/graphql'
+
+AUTHOR_HISTORY_FIELDS = '''
+    defaultBranchRef {
+      target {
+        ... on Commit {
+          history(first: %d) {
+            nodes {
+              author { name email user { login } }
+              committer { name email user { login } }
+            }
+          }
+        }
+      }
+    }
+'''
+
+
+def alias(index):
+    return 'r%d' % index
+
+
+def repository(index, repo_name, fields):
+    owner, name = repo_name.split('/', 1)
+    return '  %s: repository(owner: %s, name: %s) {%s  }\n' % (alias(index), json.dumps(owner), json.dumps(name), fields)
+
+
+def repositories_query(repo_names):
+    """Query for the metadata of every repository in repo_names, aliased by position"""
+    return 'query {\n%s}' % ''.join(repository(index, repo_name, REPOSITORY_FIELDS)
+                                    for index, repo_name in enumerate(repo_names))
+
+
+def first_commits_query(heads):
+    """heads is a list of (repo_name, head oid, history totalCount), totalCount > 1"""
+    return 'query {\n%s}' % ''.join(
+        repository(index, repo_name, FIRST_COMMIT_FIELDS % (json.dumps(oid), json.dumps('%s %d' % (oid, total - 2))))
+        for index, (repo_name, oid, total) in enumerate(heads))
+
+
+def author_histories_query(repo_names, commits=100):
+    """Query for the authors of the latest commits of every repository in repo_names"""
+    return 'query {\n%s}' % ''.join(repository(index, repo_name, AUTHOR_HISTORY_FIELDS % commits)
+                                    for index, repo_name in enumerate(repo_names))
+
+
+def request_body(query):
+    return json.dumps({'query': query})
+
+
+def results(response_json, count):
+    """[(alias data or None)] in query order and the errors not about a missing repository"""
+    data = response_json.get('data') or {}
+    errors = [error for error in response_json.get('errors', []) if error.get('type') != 'NOT_FOUND']
+    return [data.get(alias(index)) for index in range(count)], errors
+
+
+def not_found(response_json):
+    """Aliases of the repositories that don't exist, the others may be None for any error"""
+    return set(error['path'][0] for error in response_json.get('errors', [])
+               if error.get('type') == 'NOT_FOUND' and error.get('path'))
+
+
+def head_commit(repository):
+    """(oid, history totalCount) of the default branch, (None, 0) for an empty repository"""
+    ref = repository.get('defaultBranchRef')
+    target = ref.get('target') if ref else None
+    if not target or 'oid' not in target:
+        return None, 0
+    return target['oid'], target['history']['totalCount']
+
+
+def person(actor):
+    """name and email of a commit author or committer"""
+    return {'name': actor.get('name'), 'email': actor.get('email')} if actor else None
+
+
+def history_commits(repository):
+    """Commits of an author_histories_query result in the shape of the REST commits list"""
+    ref = repository.get('defaultBranchRef') if repository else None
+    target = ref.get('target') if ref else None
+    if not target or 'history' not in target:
+        return []
+    return [{
+        'author': {'login': node['author']['user']['login']} if node.get('author') and node['author'].get('user') else None,
+        'commit': {'author': person(node.get('author')), 'committer': person(node.get('committer'))},
+    } for node in target['history']['nodes']]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# Conditional request cache for the GitHub API
+#
+# GitHub answers a request carrying the ETag (If-None-Match) or Last-Modified
+# (If-Modified-Since) of a previous response with an empty 304 when nothing
+# changed, and 304s don't count against the rate limit. The storage keeps
+# the last 200 response of every url so a 304 can be replayed from disk.
+
+import json
+import sqlite3
+import time
+
+
+class ConditionalCacheStorage(object):
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL
+            )
+        ''')
+
+    def key(self, request):
+        # The media type changes the representation (and the ETag)
+        accept = request.headers.get('Accept', b'').decode('latin-1')
+        return '%s %s %s' % (request.method, request.url, accept)
+
+    def validators(self, request):
+        """(etag, last_modified) of the stored response for request, None if there is none"""
+        return self.db.execute('SELECT etag, last_modified FROM responses WHERE key = ?',
+                               (self.key(request),)).fetchone()
+
+    def retrieve(self, request):
+        """(url, status, headers, body) of the stored response for request"""
+        row = self.db.execute('SELECT url, status, headers, body FROM responses WHERE key = ?',
+                              (self.key(request),)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body = row
+        return url, status, json.loads(headers), bytes(body)
+
+    def store(self, request, response, etag, last_modified):
+        headers = {name.decode('latin-1'): [value.decode('latin-1') for value in values]
+                   for name, values in response.headers.items()}
+        self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (self.key(request), response.url, response.status, json.dumps(headers),
+                         sqlite3.Binary(response.body), etag, last_modified, time.time()))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# State of incremental toggled_repos crawls
+#
+# Search queries are sorted by s=indexed&o=desc, files (re)indexed since the
+# last run come first. An IncrementalState keeps from one run to the next:
+#
+# * the result key (repo, file, sha) of every result found so far, so only
+#   new files or files with a new sha, i.e. changed ones, are emitted
+# * per query the result keys of its first page, the high-water mark: the
+#   next run pages through the query only until it reaches one of them
+#
+# Marks are only advanced by a run that finished, an interrupted one would
+# otherwise hide the results it didn't get to.
+
+import json
+import sqlite3
+import time
+
+
+class IncrementalState(object):
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS results (
+                scope TEXT NOT NULL,
+                key INTEGER NOT NULL,
+                PRIMARY KEY (scope, key)
+            );
+            CREATE TABLE IF NOT EXISTS marks (
+                query TEXT PRIMARY KEY,
+                keys TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        ''')
+        self.marks = {row[0]: set(json.loads(row[1])) for row in self.db.execute('SELECT query, keys FROM marks')}
+        self.new_marks = {}
+
+    def known(self, scope, key):
+        row = self.db.execute('SELECT 1 FROM results WHERE scope = ? AND key = ?', (scope, key)).fetchone()
+        return row is not None
+
+    def add(self, scope, key):
+        self.db.execute('INSERT OR IGNORE INTO results (scope, key) VALUES (?, ?)', (scope, key))
+
+    def mark(self, query):
+        """Result keys of the first page of query in the previous run, None for a new query"""
+        return self.marks.get(query)
+
+    def set_mark(self, query, keys):
+        if keys:
+            self.new_marks[query] = keys
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self, finished):
+        if finished:
+            now = time.time()
+            self.db.executemany('INSERT OR REPLACE INTO marks (query, keys, updated_at) VALUES (?, ?, ?)',
+                                [(query, json.dumps(keys), now) for query, keys in self.new_marks.items()])
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+# Content matching of downloaded files against a library's regexp templates
+#
+# A LibraryMatcher substitutes every (artifact, import_or_usage) placeholder
+# pair into the templates of the library languages once, compiles the
+# resulting regular expressions and indexes them by the path regexp they are
+# restricted to. Matching a file is then a single pass over the patterns
+# that apply to its path.
+#
+# Templates like 'dependencies":[\S\W]*"${artifact_name}"' backtrack badly on
+# big manifests with the re module, so patterns are compiled by a backend:
+#
+# * 're': the re module as is
+# * 'segmented': the pattern is cut at every [\S\W]* gap and the segments are
+#   searched one after the other, each from the earliest end of a match of the
+#   previous one. That is exact as long as every segment but the last has a
+#   bounded width and no assertion that looks past its end; patterns where
+#   that doesn't hold fall back to 're'
+# * 're2': the linear time RE2 engine, if the re2 module is installed
+#
+# A search may also be given a deadline. It is only checked between patterns
+# and segments, a single search of the 're' backend can backtrack far past
+# it: the deadline bounds the well behaved files, the timeout of the
+# verification pool the rest (see githubdisco/verification.py).
+
+import re
+import time
+from string import Template
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+GAP = r'[\S\W]*'
+
+
+class MatchBudgetExceeded(Exception):
+    pass
+
+
+class RePattern(object):
+
+    def __init__(self, regexp, flags):
+        self.pattern = regexp
+        self.compiled = re.compile(regexp, flags)
+
+    def search(self, text, deadline=None):
+        return self.compiled.search(text)
+
+
+class SegmentedPattern(object):
+
+    def __init__(self, regexp, flags):
+        self.pattern = regexp
+        self.segments = [re.compile(segment, flags) for segment in regexp.split(GAP)]
+
+    # Assertions that would see the end of the string set by endpos
+    end_assertions = re.compile(r'\(\?=|\(\?!|\$|\\[bBZ]')
+
+    @classmethod
+    def supports(cls, regexp, flags):
+        segments = regexp.split(GAP)
+        if len(segments) < 2:
+            return False
+        try:
+            # A gap inside a group leaves unbalanced segments behind and one
+            # next to a top level alternation only belongs to one branch
+            for segment in segments:
+                re.compile(segment, flags)
+                if cls.has_top_level_alternation(segment):
+                    return False
+            for segment in segments[:-1]:
+                low, high = sre_parse.parse(segment, flags).getwidth()
+                if high >= sre_parse.MAXREPEAT or cls.end_assertions.search(segment):
+                    return False
+        except re.error:
+            return False
+        return True
+
+    @staticmethod
+    def has_top_level_alternation(segment):
+        depth = 0
+        in_class = False
+        escaped = False
+        for char in segment:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif in_class:
+                in_class = char != ']'
+            elif char == '[':
+                in_class = True
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char == '|' and depth == 0:
+                return True
+        return False
+
+    def earliest_end(self, segment, text, position):
+        match = segment.search(text, position)
+        if not match:
+            return None
+
+        # No match starts before the leftmost one, but a later one may end
+        # first: bisect the smallest endpos still holding a match
+        start, low, high = match.start(), match.start(), match.end()
+        while low < high:
+            middle = (low + high) // 2
+            if segment.search(text, start, middle):
+                high = middle
+            else:
+                low = middle + 1
+        return high
+
+    def search(self, text, deadline=None):
+        position = 0
+        for segment in self.segments[:-1]:
+            if deadline is not None and time.monotonic() > deadline:
+                raise MatchBudgetExceeded(self.pattern)
+            position = self.earliest_end(segment, text, position)
+            if position is None:
+                return None
+        return self.segments[-1].search(text, position)
+
+
+class Re2Pattern(object):
+
+    inline_flags = [(re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's')]
+
+    def __init__(self, regexp, flags):
+        self.pattern = regexp
+        inline = ''.join(letter for flag, letter in self.inline_flags if flags & flag)
+        self.compiled = re2.compile('(?%s)%s' % (inline, regexp) if inline else regexp)
+
+    def search(self, text, deadline=None):
+        return self.compiled.search(text)
+
+
+def compile_pattern(regexp, flags, backend='re'):
+    if backend == 're2' and re2 is not None:
+        try:
+            return Re2Pattern(regexp, flags)
+        except Exception:
+            # Not in the RE2 syntax (e.g. backreferences)
+            pass
+    if backend in ('segmented', 're2') and SegmentedPattern.supports(regexp, flags):
+        return SegmentedPattern(regexp, flags)
+    return RePattern(regexp, flags)
+
+
+def decode_content(content):
+    # Some files will arrive as non utf-8 (specially txt files), lets ignore,
+    # the output seems to be ok for our purposes
+    if isinstance(content, bytes):
+        return str(content, encoding='utf-8', errors='ignore')
+    return content
+
+
+def parse_template(template):
+    """Return (content_template_regexp, flags, path_regexp, augment_placeholders_fn)"""
+    if type(template) is not list:
+        return template, 0, '', None
+
+    length = len(template)
+    flags = template[1] if length > 1 and template[1] else 0
+    path_regexp = template[2] if length > 2 else ''
+    augment_placeholders_fn = template[3] if length > 3 else None
+    return template[0], flags, path_regexp, augment_placeholders_fn
+
+
+def unescape(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def template_identifiers(template):
+    identifiers = []
+    for match in Template.pattern.finditer(template):
+        identifier = match.group('named') or match.group('braced')
+        if identifier:
+            identifiers.append(identifier)
+    return identifiers
+
+
+def placeholders_for(library):
+    artifacts = [artifact.split(',')[0] for artifact in library['artifacts']]
+    # import_or_usage fallbacks into artifact_names
+    imports = library['imports_usages'] if len(library['imports_usages']) > 0 else artifacts
+    return [{
+        'artifact_name': re.escape(artifact),
+        'import_or_usage': re.escape(import_usage),
+    } for artifact in artifacts for import_usage in imports]
+
+
+class LibraryMatcher(object):
+
+    def __init__(self, library, templates, backend='re'):
+        self.library = library
+        # path regexp -> [compiled content regexp], in template order
+        self.patterns_by_path = {}
+        self.path_regexps = {}
+        # Literal strings at least one of which is in any file the library matches
+        self.literals = set()
+
+        seen = set()
+        for placeholders in placeholders_for(library):
+            for template in templates:
+                content_template_regexp, flags, path_regexp, augment_placeholders_fn = parse_template(template)
+                template_placeholders = placeholders
+                if augment_placeholders_fn:
+                    try:
+                        template_placeholders = augment_placeholders_fn(placeholders)
+                    except ValueError:
+                        # e.g. a java artifact without group id
+                        continue
+
+                regexp = r'' + Template(content_template_regexp).substitute(template_placeholders)
+                if (path_regexp, regexp, flags) in seen:
+                    continue
+                seen.add((path_regexp, regexp, flags))
+
+                # Every placeholder of a matching regexp is in the content, the longest one is the best filter
+                values = [unescape(template_placeholders[identifier]) for identifier in template_identifiers(content_template_regexp)]
+                if values:
+                    self.literals.add(max(values, key=len))
+
+                if path_regexp not in self.patterns_by_path:
+                    self.patterns_by_path[path_regexp] = []
+                    self.path_regexps[path_regexp] = re.compile(path_regexp, re.MULTILINE) if path_regexp else None
+                self.patterns_by_path[path_regexp].append(compile_pattern(regexp, flags, backend))
+
+    def applicable(self, path):
+        """Compiled content regexps whose path regexp matches path"""
+        patterns = []
+        for path_regexp, compiled_path in self.path_regexps.items():
+            if compiled_path is None or compiled_path.search(path):
+                patterns.extend(self.patterns_by_path[path_regexp])
+        return patterns
+
+    def search(self, path, content, deadline=None):
+        """First content pattern of the library matching the file at path, None otherwise
+
+        Raises MatchBudgetExceeded once time.monotonic() is past deadline,
+        checked before every pattern.
+        """
+        patterns = self.applicable(path)
+        if not patterns:
+            return None
+
+        text = decode_content(content)
+        for pattern in patterns:
+            if deadline is not None and time.monotonic() > deadline:
+                raise MatchBudgetExceeded(pattern.pattern)
+            if pattern.search(text, deadline):
+                return pattern
+        return None
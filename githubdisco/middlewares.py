@@ -5,8 +5,20 @@
 # See documentation in:
 # https://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
+import os
+import time
+
 from scrapy import signals
-from scrapy.exceptions import IgnoreRequest
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+
+from githubdisco.github import TokenPool, load_tokens, is_api_url, bucket_for
+from githubdisco.verification import VerificationPool
+from githubdisco.httpcache import ConditionalCacheStorage
 
 class GithubdiscoSpiderMiddleware(object):
     # Not all methods need to be defined. If a method is not defined,
@@ -109,3 +121,223 @@ class GithubdiscoDownloaderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class GithubTokenPoolMiddleware(object):
+    # Assigns every GitHub API request the Github_N token with the most
+    # remaining quota in its rate limit bucket (search, core or graphql). When all
+    # tokens of a bucket are exhausted the request is parked until the
+    # earliest reset instead of burning a 403.
+
+    def __init__(self, pool, stats):
+        self.pool = pool
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        tokens = load_tokens()
+        if not tokens:
+            raise NotConfigured('No Github_N tokens in the environment')
+        s = cls(TokenPool(tokens), crawler.stats)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_request(self, request, spider):
+        if not is_api_url(request.url):
+            return None
+
+        bucket = bucket_for(request.url)
+        token_id, wait = self.pool.acquire(bucket)
+        if token_id is None:
+            self.stats.inc_value('token_pool/parked/%s' % bucket)
+            request.meta['token_wait'] = request.meta.get('token_wait', 0) + wait
+            spider.logger.debug('All tokens exhausted for %s, parking %s for %ds', bucket, request.url, wait)
+            return deferLater(reactor, wait, self.process_request, request, spider)
+
+        request.meta['token_id'] = token_id
+        request.headers['Authorization'] = self.pool.header(token_id)
+        return None
+
+    def process_response(self, request, response, spider):
+        token_id = request.meta.get('token_id')
+        if token_id is None:
+            return response
+
+        headers = response.headers
+        bucket = self.header_value(headers, 'X-RateLimit-Resource') or bucket_for(request.url)
+        remaining = self.header_int(headers, 'X-RateLimit-Remaining')
+        if remaining is not None:
+            self.pool.update(token_id, bucket, remaining,
+                             self.header_int(headers, 'X-RateLimit-Reset'),
+                             self.header_int(headers, 'X-RateLimit-Limit'))
+
+        retry_after = self.header_int(headers, 'Retry-After')
+        # GraphQL reports an exhausted quota in the errors of a 200
+        graphql_limited = bucket == 'graphql' and remaining == 0 and b'RATE_LIMITED' in response.body
+        if graphql_limited or response.status in (403, 429) and (remaining == 0 or retry_after is not None):
+            # Primary (quota) or secondary (abuse) rate limit, not a real error
+            reset = self.header_int(headers, 'X-RateLimit-Reset') if retry_after is None else time.time() + retry_after
+            self.pool.exhaust(token_id, bucket, reset or time.time() + 60)
+            self.stats.inc_value('token_pool/rate_limited/%s' % bucket)
+            retry = request.copy()
+            retry.dont_filter = True
+            retry.meta['rate_limit_retries'] = retry.meta.get('rate_limit_retries', 0) + 1
+            del retry.meta['token_id']
+            return retry
+
+        return response
+
+    def header_value(self, headers, name):
+        value = headers.get(name)
+        return value.decode('utf-8') if value else None
+
+    def header_int(self, headers, name):
+        value = self.header_value(headers, name)
+        return int(value) if value and value.isdigit() else None
+
+    def spider_opened(self, spider):
+        spider.logger.info('Token pool with %d tokens' % len(self.pool.tokens))
+
+
+class ContentVerificationMiddleware(object):
+    # Verifies the contents of requests flagged with meta['verify'] (the
+    # content format, e.g. 'contents') in a process pool instead of the
+    # reactor thread, and stores the matches in meta['verification'] for
+    # the spider callback. New content requests wait while the pool is full
+    # so the downloader slows down to the pace of the workers. A file not
+    # verified within CONTENT_VERIFICATION_TIMEOUT seconds counts as over the
+    # match budget, its worker is replaced.
+
+    def __init__(self, processes, max_pending, stats, timeout=None):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.stats = stats
+        self.pool = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        processes = crawler.settings.getint('CONTENT_VERIFICATION_PROCESSES')
+        if not processes:
+            raise NotConfigured
+        s = cls(processes, crawler.settings.getint('CONTENT_VERIFICATION_MAX_PENDING'), crawler.stats,
+                crawler.settings.getfloat('CONTENT_VERIFICATION_TIMEOUT'))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        if self.pool is None or 'verify' not in request.meta or request.meta.get('verification_slot'):
+            return None
+
+        d = self.pool.acquire()
+        if d is None:
+            request.meta['verification_slot'] = True
+            return None
+
+        self.stats.inc_value('verification/parked')
+
+        def acquired(_):
+            request.meta['verification_slot'] = True
+        return d.addCallback(acquired)
+
+    def process_response(self, request, response, spider):
+        if not request.meta.pop('verification_slot', False):
+            return response
+
+        if response.status != 200:
+            self.pool.release()
+            return response
+
+        self.stats.inc_value('verification/submitted')
+
+        def verified(result):
+            request.meta['verification'] = result
+            return response
+
+        def failed(failure):
+            # parse_contents verifies it in process instead
+            spider.logger.error('Verification of %s failed: %s', request.url, failure.getErrorMessage())
+            self.stats.inc_value('verification/failed')
+            return response
+
+        d = self.pool.submit(request.meta.get('path', ''), response.body, request.meta['verify'])
+        return d.addCallbacks(verified, failed)
+
+    def process_exception(self, request, exception, spider):
+        if request.meta.pop('verification_slot', False):
+            self.pool.release()
+
+    def spider_opened(self, spider):
+        if hasattr(spider, 'verification_libraries'):
+            self.pool = VerificationPool(spider.verification_libraries(), self.processes, self.max_pending,
+                                         spider.regex_backend, spider.match_budget, self.timeout)
+            spider.logger.info('Verifying contents in %d processes' % self.processes)
+
+    def spider_closed(self, spider):
+        if self.pool is not None:
+            self.pool.close()
+            self.stats.set_value('verification/timeouts', self.pool.timeouts)
+
+
+class GithubConditionalCacheMiddleware(object):
+    # Sends GitHub API GETs with the ETag / Last-Modified of the previous run
+    # and replays the stored response when GitHub answers 304 Not Modified,
+    # which doesn't count against the rate limit. Requests with
+    # meta['dont_cache'] are left alone.
+
+    def __init__(self, storage, stats):
+        self.storage = storage
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('GITHUB_HTTPCACHE_ENABLED'):
+            raise NotConfigured
+        cache_dir = data_path(crawler.settings['GITHUB_HTTPCACHE_DIR'], createdir=True)
+        storage = ConditionalCacheStorage(os.path.join(cache_dir, 'responses.sqlite'))
+        s = cls(storage, crawler.stats)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def cacheable(self, request):
+        return request.method == 'GET' and is_api_url(request.url) and not request.meta.get('dont_cache')
+
+    def process_request(self, request, spider):
+        if not self.cacheable(request):
+            return None
+
+        validators = self.storage.validators(request)
+        if validators:
+            etag, last_modified = validators
+            if etag:
+                request.headers['If-None-Match'] = etag
+            if last_modified:
+                request.headers['If-Modified-Since'] = last_modified
+        return None
+
+    def process_response(self, request, response, spider):
+        if not self.cacheable(request):
+            return response
+
+        if response.status == 304:
+            cached = self.storage.retrieve(request)
+            if cached is None:
+                return response
+            self.stats.inc_value('github_httpcache/revalidated')
+            url, status, headers, body = cached
+            headers = Headers(headers)
+            respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+            return respcls(url=url, status=status, headers=headers, body=body, request=request, flags=['cached'])
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status == 200 and (etag or last_modified):
+            self.stats.inc_value('github_httpcache/stored')
+            self.storage.store(request, response,
+                               etag.decode('latin-1') if etag else None,
+                               last_modified.decode('latin-1') if last_modified else None)
+        return response
+
+    def spider_closed(self, spider):
+        self.storage.close()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Adaptive size:from..to partitioning for GitHub code search
+#
+# The search API returns at most 1000 results per query, so bigger result
+# sets are enumerated by narrowing the size qualifier. Instead of blindly
+# halving the range, the total_count of every probe is fed into a piecewise
+# uniform size histogram per query, and ranges are cut at the quantiles of
+# that histogram so each sub-range gets close to the target number of results.
+
+import bisect
+import math
+
+
+class SizeHistogram(object):
+    """Estimated number of results per file size
+
+    The density is stored as sorted segment start offsets with the estimated
+    count of every segment, assumed uniform across its sizes. Before any
+    observation the counts follow a log-uniform prior (as many files between
+    1 and 2 KB as between 100 and 200 KB), which fits file sizes far better
+    than the uniform prior implied by halving.
+    """
+
+    def __init__(self, size_to, growth=1.5):
+        self.starts = [0, 1]
+        while self.starts[-1] * growth < size_to:
+            self.starts.append(int(math.ceil(self.starts[-1] * growth)))
+        self.end = size_to + 1
+        self.counts = [1.0] * len(self.starts)
+
+    def segment_end(self, i):
+        return self.starts[i + 1] if i + 1 < len(self.starts) else self.end
+
+    def cut(self, offset):
+        """Make offset the start of a segment"""
+        if offset <= 0 or offset >= self.end:
+            return
+        i = bisect.bisect_right(self.starts, offset) - 1
+        if self.starts[i] == offset:
+            return
+        start, end = self.starts[i], self.segment_end(i)
+        head = self.counts[i] * (offset - start) / float(end - start)
+        self.starts.insert(i + 1, offset)
+        self.counts.insert(i + 1, self.counts[i] - head)
+        self.counts[i] = head
+
+    def segments(self, size_from, size_to):
+        """Indexes of the segments covering size_from..size_to, cutting as needed"""
+        self.cut(size_from)
+        self.cut(size_to + 1)
+        first = bisect.bisect_right(self.starts, size_from) - 1
+        last = bisect.bisect_right(self.starts, size_to) - 1
+        return range(first, last + 1)
+
+    def observe(self, size_from, size_to, total_count):
+        indexes = self.segments(size_from, size_to)
+        estimated = sum(self.counts[i] for i in indexes)
+        for i in indexes:
+            if estimated > 0:
+                self.counts[i] *= total_count / estimated
+            else:
+                self.counts[i] = total_count * (self.segment_end(i) - self.starts[i]) / float(size_to - size_from + 1)
+
+    def estimate(self, size_from, size_to):
+        """Estimated number of results in size_from..size_to"""
+        return sum(self.counts[i] for i in self.segments(size_from, size_to))
+
+    def quantiles(self, size_from, size_to, parts):
+        """Sizes splitting size_from..size_to in parts of (estimated) equal count"""
+        indexes = list(self.segments(size_from, size_to))
+        total = sum(self.counts[i] for i in indexes)
+        if total <= 0:
+            step = (size_to - size_from + 1) / float(parts)
+            return [int(size_from + step * j) - 1 for j in range(1, parts)]
+
+        points = []
+        seen = 0.0
+        j = 1
+        for i in indexes:
+            start, end, count = self.starts[i], self.segment_end(i), self.counts[i]
+            while j < parts and count > 0 and seen + count >= total * j / parts:
+                fraction = (total * j / parts - seen) / count
+                points.append(int(start + fraction * (end - start)))
+                j += 1
+            seen += count
+        return points
+
+
+class SizePartitioner(object):
+
+    def __init__(self, size_to, max_results=1000, fill=0.8, max_fanout=8):
+        self.size_to = size_to
+        # Aim below max_results, the estimate is only as good as the histogram
+        self.target = max_results * fill
+        self.max_fanout = max_fanout
+        self.histograms = {}
+
+    def histogram(self, key):
+        if key not in self.histograms:
+            self.histograms[key] = SizeHistogram(self.size_to)
+        return self.histograms[key]
+
+    def observe(self, key, size_from, size_to, total_count):
+        self.histogram(key).observe(size_from, size_to, total_count)
+
+    def estimate(self, key, size_from, size_to):
+        return self.histogram(key).estimate(size_from, size_to)
+
+    def split(self, key, size_from, size_to, total_count):
+        """Return the (from, to) ranges to search instead of size_from..size_to"""
+        width = size_to - size_from + 1
+        parts = int(math.ceil(total_count / self.target))
+        parts = max(2, min(parts, self.max_fanout, width))
+
+        histogram = self.histogram(key)
+        histogram.observe(size_from, size_to, total_count)
+        points = histogram.quantiles(size_from, size_to, parts)
+
+        ranges = []
+        start = size_from
+        for point in points:
+            # Every range must be non empty and strictly after the previous one
+            point = max(point, start)
+            if point >= size_to:
+                break
+            ranges.append((start, point))
+            start = point + 1
+        ranges.append((start, size_to))
+
+        if len(ranges) < 2:
+            middle = int(size_from + (size_to - size_from) / 2)
+            ranges = [(size_from, middle), (middle + 1, size_to)]
+        return ranges
@@ -5,7 +5,118 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import time
+
+from scrapy.exceptions import NotConfigured
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 
 class GithubdiscoPipeline(object):
     def process_item(self, item, spider):
         return item
+
+
+# Columnar output of the items, next to (or instead of) the csv feed
+#
+# Items are buffered per column and written every COLUMNAR_BATCH_ROWS items
+# as a row group of a Parquet file (COLUMNAR_FORMAT = 'parquet') or a record
+# batch of an Arrow IPC file ('arrow'), compressed with COLUMNAR_COMPRESSION.
+# The columns and their types are the item_schema of the spider, a list of
+# (field, type) pairs with type one of COLUMN_TYPES. Fields an item lacks are
+# null, fields not in the schema are left out.
+#
+# The file is COLUMNAR_OUTPUT, %(name)s is the spider name and %(time)s the
+# UTC start time, e.g.
+#
+# $ scrapy crawl toggled_repos -s COLUMNAR_OUTPUT=toggled-%(time)s.parquet
+#
+# Requires pyarrow, without it or a COLUMNAR_OUTPUT the pipeline is disabled.
+
+FORMATS = ('parquet', 'arrow')
+
+if pyarrow:
+    COLUMN_TYPES = {
+        'string': pyarrow.string(),
+        'int': pyarrow.int64(),
+        'bool': pyarrow.bool_(),
+        'strings': pyarrow.list_(pyarrow.string()),
+    }
+
+
+def arrow_schema(item_schema):
+    return pyarrow.schema([(field, COLUMN_TYPES[column_type]) for field, column_type in item_schema])
+
+
+class ColumnarExportPipeline(object):
+
+    def __init__(self, stats, output, file_format='parquet', compression='zstd', batch_rows=50000):
+        if file_format not in FORMATS:
+            raise ValueError('Unknown COLUMNAR_FORMAT %r, expected parquet or arrow' % file_format)
+        self.stats = stats
+        self.output = output
+        self.file_format = file_format
+        self.compression = compression
+        self.batch_rows = batch_rows
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        output = settings.get('COLUMNAR_OUTPUT')
+        if not output:
+            raise NotConfigured
+        if pyarrow is None:
+            raise NotConfigured('COLUMNAR_OUTPUT requires pyarrow')
+        return cls(crawler.stats, output, settings.get('COLUMNAR_FORMAT'), settings.get('COLUMNAR_COMPRESSION'),
+                   settings.getint('COLUMNAR_BATCH_ROWS'))
+
+    def open_spider(self, spider):
+        item_schema = getattr(spider, 'item_schema', None)
+        if not item_schema:
+            spider.logger.warning('%s has no item_schema, no columnar output', spider.name)
+            return
+        self.schema = arrow_schema(item_schema)
+        self.columns = {field: [] for field in self.schema.names}
+        self.rows = 0
+        self.path = self.output % {'name': spider.name, 'time': time.strftime('%Y%m%d%H%M%S', time.gmtime())}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.file_format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+            self.writer = pyarrow.ipc.new_file(self.path, self.schema, options=options)
+
+    def process_item(self, item, spider):
+        if self.writer:
+            for field, values in self.columns.items():
+                values.append(item.get(field))
+            self.rows += 1
+            if self.rows >= self.batch_rows:
+                self.flush()
+        return item
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns, rows = self.columns, self.rows
+        self.columns = {field: [] for field in self.schema.names}
+        self.rows = 0
+        # A write_table of a single chunk is a single row group / record batch
+        self.writer.write_table(pyarrow.Table.from_pydict(columns, schema=self.schema), rows)
+        self.stats.inc_value('columnar/rows', rows)
+        self.stats.inc_value('columnar/batches')
+
+    def close_spider(self, spider):
+        if self.writer:
+            self.flush()
+            self.writer.close()
+            spider.logger.info('Wrote %d items to %s', self.stats.get_value('columnar/rows', 0), self.path)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Packing the search strings of several libraries into shared queries
+#
+# Libraries searched with the same qualifiers (e.g. every markdown library
+# with filename:readme.md) can share a query: "a" OR "b" OR "c". GitHub
+# allows at most five operators per query and 256 characters, so a QueryPlan
+# packs up to batch terms per query within both limits. The results of a
+# shared query are attributed back to their libraries by the search
+# strings found in their text matches, word by word: code search ignores
+# punctuation, "paypal.com" also finds paypal-com. A result none of the
+# search strings is found for (the fragments may be cut short) counts for
+# every library of the query, as a search of its own would have found it.
+
+import re
+
+from string import Template
+
+# https://docs.github.com/en/rest/search#limitations-on-query-length
+MAX_OPERATORS = 5
+MAX_QUERY_LENGTH = 256
+
+# Media type adding the matched fragments (text_matches) to search results
+TEXT_MATCH_MEDIA_TYPE = 'application/vnd.github.v3.text-match+json'
+
+
+def or_query(search_strings):
+    return '+OR+'.join('%22' + search_string + '%22' for search_string in search_strings)
+
+
+def query_length(search_strings):
+    # Quotes and the spaces around every OR count too, to be on the safe side
+    return sum(len(search_string) + 2 for search_string in search_strings) + 4 * (len(search_strings) - 1)
+
+
+def pack(search_strings, batch):
+    """Split search_strings into lists of at most batch that fit in a single query"""
+    batch = min(batch, MAX_OPERATORS + 1)
+    packed = []
+    current = []
+    for search_string in search_strings:
+        if current and (len(current) == batch or query_length(current + [search_string]) > MAX_QUERY_LENGTH):
+            packed.append(current)
+            current = []
+        current.append(search_string)
+    if current:
+        packed.append(current)
+    return packed
+
+
+class QueryPlan(object):
+    """Shared search scopes for libraries, see ToggledReposSpider.search_scopes"""
+
+    def __init__(self, batch):
+        self.batch = batch
+        # qualifiers -> [(library, search string)] in library order
+        self.terms = {}
+
+    def add(self, library, search_string, qualifiers):
+        self.terms.setdefault(qualifiers, []).append((library, search_string))
+
+    def groups(self):
+        """[(qualifiers, [(library, search string)])], one per shared query"""
+        groups = []
+        for qualifiers, terms in self.terms.items():
+            search_strings = []
+            for library, search_string in terms:
+                if search_string not in search_strings:
+                    search_strings.append(search_string)
+            for packed in pack(search_strings, self.batch):
+                groups.append((qualifiers, [(library, search_string) for library, search_string in terms
+                                            if search_string in packed]))
+        return groups
+
+
+def words(text):
+    """Lower case words of text, the punctuation between them left out"""
+    return re.findall(r'[a-z0-9_]+', text.lower())
+
+
+def attribute(terms, fragments):
+    """Libraries of terms, [(library name, search string)], whose search string is in one of the fragments"""
+    texts = [' %s ' % ' '.join(words(fragment)) for fragment in fragments]
+    names = []
+    for name, search_string in terms:
+        needle = ' %s ' % ' '.join(words(search_string))
+        if name not in names and needle.strip() and any(needle in text for text in texts):
+            names.append(name)
+    return names
+
+
+def group_scope(libraries):
+    """Pseudo library searched by a shared query, 'members' are the names of the libraries in it"""
+    members = []
+    for library in libraries:
+        if library['library'] not in members:
+            members.append(library['library'])
+    return {
+        'library': '+'.join(members),
+        'languages': libraries[0]['languages'],
+        'members': members,
+        'matched': {},
+    }
+
+
+def shared_url(search_template, search_strings, qualifiers, size_from, size_to, page=1):
+    return Template(search_template).substitute({
+        'params': 'q=' + or_query(search_strings) + '+' + qualifiers,
+        'page': page,
+        'from': int(size_from),
+        'to': int(size_to),
+    })
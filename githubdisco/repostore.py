@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# Repository metadata shared by the spiders and across runs
+#
+# A RepoStore is an SQLite file of JSON records per repository and kind:
+#
+# * 'augmented': the item augment_toggled_repos emitted for it
+# * 'contributors': the rows top_contributors emitted for it, without library
+#
+# Only these two spiders use a store, toggled_repos doesn't: a search result
+# tells no more of a repository than its name and fork flag, none of the API
+# calls of the later stages could be skipped with it. What is shared is the
+# output of a spider with its later runs, and one store file for both.
+#
+# Records older than max_age seconds are stale and ignored. A spider given
+# the same store as an earlier run skips the API calls for every repository
+# it finds a fresh record of. Several spiders may use the same file at once,
+# writes go through a write-ahead log.
+#
+# Stored records are handed to the spider in a single request to a data:
+# URL per batch of repositories, start_requests can't yield items.
+
+import json
+import sqlite3
+import time
+
+from scrapy import Request
+
+MAX_AGE = 7 * 24 * 3600
+
+# Request answered locally, by the data URI download handler
+LOCAL_URL = 'data:,'
+
+
+class RepoStore(object):
+
+    # Records between two flushes to disk
+    batch = 100
+
+    def __init__(self, path, max_age=MAX_AGE):
+        self.max_age = max_age
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS repositories (
+                repo_name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (repo_name, kind)
+            )
+        ''')
+        self.unsaved = 0
+
+    def get(self, repo_name, kind):
+        """Fresh record of kind for repo_name, None if there is none"""
+        row = self.db.execute('SELECT data FROM repositories WHERE repo_name = ? AND kind = ? AND updated_at >= ?',
+                              (repo_name.lower(), kind, time.time() - self.max_age)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, repo_name, kind, data):
+        self.db.execute('INSERT OR REPLACE INTO repositories (repo_name, kind, data, updated_at) VALUES (?, ?, ?, ?)',
+                        (repo_name.lower(), kind, json.dumps(data), time.time()))
+        self.unsaved += 1
+        if self.unsaved >= self.batch:
+            self.db.commit()
+            self.unsaved = 0
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def stored_request(callback, meta):
+    """Local request whose callback gets the stored records in meta"""
+    return Request(LOCAL_URL, callback=callback, meta=meta, dont_filter=True)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# Single pass prefilter over the contents of a downloaded file
+#
+# Every regexp of a library template embeds at least one of the library's
+# artifact / import literals, so a file can only match the libraries whose
+# literals it contains. A LibraryScanner looks for the literals of all
+# libraries at once with one case insensitive alternation, and the full
+# LibraryMatcher regexps are run only for the candidates it returns.
+
+import re
+
+
+class LibraryScanner(object):
+
+    def __init__(self, matchers):
+        libraries_by_literal = {}
+        for name, matcher in matchers.items():
+            for literal in matcher.literals:
+                libraries_by_literal.setdefault(literal.lower(), set()).add(name)
+
+        # The alternation reports the longest literal starting at a position,
+        # so a hit also counts for the literals it contains
+        self.libraries_by_literal = {}
+        for literal in libraries_by_literal:
+            self.libraries_by_literal[literal] = set().union(*[
+                names for other, names in libraries_by_literal.items() if other in literal])
+
+        self.pattern = None
+        if libraries_by_literal:
+            literals = sorted(libraries_by_literal, key=len, reverse=True)
+            # Lookahead so overlapping literals are found at every position
+            self.pattern = re.compile('(?=(%s))' % '|'.join(re.escape(literal) for literal in literals), re.IGNORECASE)
+        self.all_libraries = set(matchers)
+
+    def candidates(self, text):
+        """Names of the libraries that may match text"""
+        found = set()
+        if self.pattern is None:
+            return found
+
+        hits = set()
+        for match in self.pattern.finditer(text):
+            literal = match.group(1).lower()
+            if literal in hits:
+                continue
+            hits.add(literal)
+            found |= self.libraries_by_literal[literal]
+            if found == self.all_libraries:
+                break
+        return found
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Priorities of the toggled_repos search requests
+#
+# Under a fixed quota the requests expected to return the most new (not yet
+# seen) results should go first. A SearchScheduler rates every request from
+# parse as
+#
+#   results expected on its page x share of new results
+#
+# where the share of new results is the one of the page the request came
+# from (duplicates mean its range is mostly covered already) and the results
+# expected are:
+#
+# * next page: the results left in the query, at most a page
+# * size split: the estimate of the size histogram (see partition.py)
+# * order flip: the results beyond the first max_results
+# * query splitter: the count of the parent query times the share of
+#   results the splitter character kept in the probes so far
+#
+# Next pages get a bonus on top: their yield is the surest and finishing a
+# query before opening new ones keeps the crawl state small. Content
+# requests go before any search, the hits they verify are held in memory.
+#
+# Query splitter probes come up to 36 at a time per level, at most
+# max_splitters of them are in flight at once. The others wait in a heap,
+# best first, and are skipped if an exclusion learned meanwhile covers them.
+
+import heapq
+import itertools
+
+# Share of results a splitter character keeps before any probe with it
+SPLITTER_PRIOR = 0.5
+
+
+class SearchScheduler(object):
+
+    def __init__(self, per_page, max_results, max_splitters, skip=None):
+        self.per_page = per_page
+        self.max_results = max_results
+        self.max_splitters = max_splitters
+        # Called with a waiting probe before it is sent, True drops it
+        self.skip = skip
+        self.next_page_bonus = per_page
+        self.content_priority = 2 * per_page + 1
+        # splitter character -> [results kept, results of the parent queries]
+        self.splitter_counts = {}
+        self.in_flight = 0
+        self.waiting = []
+        self.order = itertools.count()
+
+    def new_share(self, new, items):
+        return float(new) / items if items else 1.0
+
+    def priority(self, expected, share):
+        return int(round(min(expected, self.per_page) * share))
+
+    def next_page_priority(self, total_count, page, share):
+        left = min(total_count, self.max_results) - page * self.per_page
+        return self.priority(left, share) + self.next_page_bonus
+
+    def size_split_priority(self, estimate, share):
+        return self.priority(estimate, share)
+
+    def order_flip_priority(self, total_count, share):
+        return self.priority(total_count - self.max_results, share)
+
+    def splitter_rate(self, char):
+        kept, total = self.splitter_counts.get(char, (0, 0))
+        return float(kept) / total if total else SPLITTER_PRIOR
+
+    def splitter_priority(self, char, parent_total, share):
+        return self.priority(parent_total * self.splitter_rate(char), share)
+
+    def observe_splitter(self, char, parent_total, total_count):
+        counts = self.splitter_counts.setdefault(char, [0, 0])
+        counts[0] += min(total_count, parent_total)
+        counts[1] += parent_total
+
+    def submit(self, requests):
+        """Splitter probes to send now, the rest wait for done()"""
+        for request in requests:
+            heapq.heappush(self.waiting, (-request.priority, next(self.order), request))
+        return self.release()
+
+    def release(self):
+        ready = []
+        while self.waiting and self.in_flight < self.max_splitters:
+            request = heapq.heappop(self.waiting)[2]
+            if self.skip and self.skip(request):
+                continue
+            self.in_flight += 1
+            ready.append(request)
+        return ready
+
+    def done(self):
+        """A probe was parsed, the probes to send in its place"""
+        self.in_flight = max(self.in_flight - 1, 0)
+        return self.release()
+
+    def idle(self):
+        """Probes to go on with when the spider is idle, failed ones never report done()"""
+        self.in_flight = 0
+        return self.release()
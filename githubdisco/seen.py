@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Compact set of the search results already seen by toggled_repos
+#
+# Results are keyed by a 64 bit hash of (repo, file, sha) instead of the
+# concatenated string, and the 'from..to' range markers are interned so an
+# entry costs an int key and a small int (or a tuple of them for the rare
+# result found in several ranges). Optionally, entries are spilled to a
+# SQLite file once there are more than max_entries of them in memory, with a
+# Bloom filter in front so that new results never touch the disk.
+
+import hashlib
+import math
+import os
+import sqlite3
+import sys
+import tempfile
+
+
+def result_key(repo_name, file_name, sha):
+    digest = hashlib.blake2b(('%s\0%s\0%s' % (repo_name, file_name, sha)).encode('utf-8'), digest_size=8).digest()
+    # Signed so it fits a SQLite INTEGER
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        # Double hashing on the two halves of the (already uniform) key
+        key &= 0xFFFFFFFFFFFFFFFF
+        h1, h2 = key & 0xFFFFFFFF, key >> 32 | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class SeenSet(object):
+
+    def __init__(self, spill_dir=None, max_entries=1000000, expected_entries=None):
+        self.entries = {}
+        self.marker_ids = {}
+        self.marker_names = []
+        self.max_entries = max_entries
+        self.count = 0
+        self.db = None
+        self.bloom = None
+        if spill_dir is not None:
+            fd, self.spill_path = tempfile.mkstemp(suffix='.sqlite', prefix='seen-', dir=spill_dir)
+            os.close(fd)
+            self.db = sqlite3.connect(self.spill_path)
+            self.db.execute('CREATE TABLE seen (key INTEGER PRIMARY KEY, markers TEXT NOT NULL)')
+            self.bloom = BloomFilter(expected_entries or 10 * max_entries)
+
+    def marker_id(self, marker):
+        if marker not in self.marker_ids:
+            self.marker_ids[marker] = len(self.marker_names)
+            self.marker_names.append(marker)
+        return self.marker_ids[marker]
+
+    def stored(self, key):
+        """Interned marker ids of key, None if it was never seen"""
+        if self.bloom is not None and key not in self.bloom:
+            return None
+        value = self.entries.get(key)
+        if value is None and self.db is not None:
+            row = self.db.execute('SELECT markers FROM seen WHERE key = ?', (key,)).fetchone()
+            if row:
+                value = tuple(int(marker_id) for marker_id in row[0].split(','))
+        return value
+
+    def markers(self, key):
+        """Range markers of key, None if it was never seen"""
+        value = self.stored(key)
+        if value is None:
+            return None
+        if isinstance(value, int):
+            return {self.marker_names[value]}
+        return {self.marker_names[marker_id] for marker_id in value}
+
+    def __contains__(self, key):
+        return self.stored(key) is not None
+
+    def add(self, key, marker):
+        marker_id = self.marker_id(marker)
+        value = self.stored(key)
+        if value is None:
+            value = marker_id
+            self.count += 1
+        elif isinstance(value, int):
+            value = (value, marker_id) if value != marker_id else value
+        elif marker_id not in value:
+            value = value + (marker_id,)
+
+        self.entries[key] = value
+        if self.bloom is not None:
+            self.bloom.add(key)
+            if len(self.entries) > self.max_entries:
+                self.spill()
+
+    def spill(self):
+        rows = [(key, str(value) if isinstance(value, int) else ','.join(str(marker_id) for marker_id in value))
+                for key, value in self.entries.items()]
+        self.db.executemany('INSERT OR REPLACE INTO seen (key, markers) VALUES (?, ?)', rows)
+        self.db.commit()
+        self.entries = {}
+
+    def __len__(self):
+        return self.count
+
+    def memory_bytes(self):
+        """Approximate memory held by the set (keys, values and bookkeeping)"""
+        # A 64 bit int key takes 36 bytes, marker ids are mostly cached small ints
+        size = sys.getsizeof(self.entries) + 36 * len(self.entries)
+        size += sys.getsizeof(self.marker_ids) + sys.getsizeof(self.marker_names)
+        size += sum(sys.getsizeof(marker) for marker in self.marker_names)
+        if self.bloom is not None:
+            size += sys.getsizeof(self.bloom.bits)
+        return size
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.spill_path)
+            self.db = None
@@ -23,18 +23,16 @@ USER_AGENT = 'githubdisco-UNALConcordiaResearch (+http://das.encs.concordia.ca)'
 ROBOTSTXT_OBEY = False
 
 FEED_FORMAT = 'csv'
-# Want this specific order in the csv columns
-# FEED_EXPORT_FIELDS = ['repo_name', 'path', 'language', 'size_bytes', 'library', 'library_language', 'last_commit_ts', 'forked_from'] # toggled_repos
-# FEED_EXPORT_FIELDS = ['repo_name', 'language', 'size_bytes', 'number_of_commits', 'last_commit_ts', 'forked_from', 'number_of_contributors', 'repo_not_found', 'first_commit_sha', 'created_at'] # augmented_toggled_repos
-FEED_EXPORT_FIELDS = ['library', 'repo_name', 'forked', 'name']
+# The csv columns of every spider, in order, are set in its custom_settings
 
-# In some unfrequent situations a 403 is returned due to
-# throttling, a couple of retries will be just fine
+# Rate limit 403s are handled by GithubTokenPoolMiddleware, the remaining
+# ones (e.g. abuse detection without Retry-After) get a couple of retries
 RETRY_HTTP_CODES = [500, 502, 503, 504, 408, 403]
-RETRY_TIMES = 10000000
+RETRY_TIMES = 10
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-CONCURRENT_REQUESTS = 2
+# Requests are parked by the token pool while every token is exhausted
+CONCURRENT_REQUESTS = 16
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://doc.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -66,19 +64,52 @@ DOWNLOAD_DELAY = 0.25
 # See https://doc.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
    'githubdisco.middlewares.GithubdiscoDownloaderMiddleware': 543,
+   # Must see responses before RetryMiddleware (550) to catch rate limit 403s
+   'githubdisco.middlewares.GithubTokenPoolMiddleware': 560,
+   # Between the token pool (which must see 304s) and RetryMiddleware (550)
+   'githubdisco.middlewares.GithubConditionalCacheMiddleware': 555,
+   # Must see responses before the token pool, which may turn them into retries
+   'githubdisco.middlewares.ContentVerificationMiddleware': 580,
 }
 
+# Number of worker processes verifying downloaded contents, 0 verifies them
+# in the spider callback on the reactor thread
+CONTENT_VERIFICATION_PROCESSES = 0
+# Content requests downloading or being verified at once, the rest wait
+CONTENT_VERIFICATION_MAX_PENDING = 64
+# Seconds a worker may take to verify a file before it is killed and replaced,
+# 0 waits for ever
+CONTENT_VERIFICATION_TIMEOUT = 60
+
 # Enable or disable extensions
 # See https://doc.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+    'githubdisco.telemetry.CrawlTelemetry': 500,
+}
+
+# Per library and split strategy request metrics (see githubdisco/telemetry.py),
+# served on 127.0.0.1:TELEMETRY_PORT/metrics (0 to disable) and written to
+# TELEMETRY_SUMMARY (%(name)s is the spider name) at the end of the crawl
+TELEMETRY_ENABLED = False
+TELEMETRY_PORT = 9410
+TELEMETRY_SUMMARY = 'telemetry-%(name)s.json'
 
 # Configure item pipelines
 # See https://doc.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
+ITEM_PIPELINES = {
 #    'githubdisco.pipelines.GithubdiscoPipeline': 300,
-#};P
+    'githubdisco.pipelines.ColumnarExportPipeline': 800,
+}
+
+# Items as typed columns (see githubdisco/pipelines.py), written to
+# COLUMNAR_OUTPUT (%(name)s is the spider name, %(time)s the start time),
+# None to disable. parquet or arrow files, a row group of COLUMNAR_BATCH_ROWS
+# items at a time
+COLUMNAR_OUTPUT = None
+COLUMNAR_FORMAT = 'parquet'
+COLUMNAR_COMPRESSION = 'zstd'
+COLUMNAR_BATCH_ROWS = 50000
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/autothrottle.html
@@ -95,6 +126,11 @@ DOWNLOADER_MIDDLEWARES = {
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+# Conditional requests (ETag / Last-Modified) for the GitHub API, 304s are
+# served from GITHUB_HTTPCACHE_DIR (relative to the project .scrapy dir)
+GITHUB_HTTPCACHE_ENABLED = False
+GITHUB_HTTPCACHE_DIR = 'github-httpcache'
+
 #HTTPCACHE_ENABLED = True
 #HTTPCACHE_EXPIRATION_SECS = 0
 #HTTPCACHE_DIR = 'httpcache'
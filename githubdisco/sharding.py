@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# Sharded toggled_repos crawls
+#
+# The libraries (round robin into --library-shards groups) and the size range
+# (cut at --size-splits) are partitioned into shards, every shard is a
+# toggled_repos crawl of its own (-a libraries=... -a size_from=... -a
+# size_to=...). A file has a single size, so shards never share a search
+# result. --workers shards are crawled at a time, each worker with a disjoint
+# subset of the Github_N tokens, and the feeds of the shards are merged into a
+# single deduplicated csv once they are all done:
+#
+# $ Github_1=... Github_4=... python -m githubdisco.sharding --workers 4 --library-shards 8 \
+#       --size-splits 2000,20000 --outdir shards -o toggled.csv -a query_batch=6
+#
+# %(shard)s in -a and -s values is the shard number, e.g. for the state files
+# of every shard: -a checkpoint=shards/%(shard)s.sqlite
+#
+# On several machines, every machine crawls some of the shards with its own
+# tokens (--shards, listed by --list) and the feeds are merged at the end:
+#
+# $ python -m githubdisco.sharding --list --library-shards 8 --size-splits 2000,20000
+# $ Github_1=... python -m githubdisco.sharding --library-shards 8 --size-splits 2000,20000 --shards 0,1,2 --outdir shards
+# $ python -m githubdisco.sharding --merge shards/*.csv -o toggled.csv
+#
+# Records of -a aggregate=repos are merged per library and repository.
+
+import argparse
+import csv
+import os
+import queue
+import subprocess
+import sys
+import threading
+
+from githubdisco import github
+from githubdisco.spiders.toggled_repos_spider import ToggledReposSpider
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def library_groups(names, groups):
+    """names in at most groups non empty lists, round robin"""
+    return [group for group in (names[start::groups] for start in range(groups)) if group]
+
+
+def size_ranges(size_from, size_to, splits):
+    """size_from..size_to cut before every size of splits"""
+    bounds = [size_from] + sorted(set(split for split in splits if size_from < split <= size_to)) + [size_to + 1]
+    return [(start, end - 1) for start, end in zip(bounds, bounds[1:])]
+
+
+def plan(names, library_shards, size_from, size_to, splits):
+    shards = []
+    for group in library_groups(names, library_shards):
+        for start, end in size_ranges(size_from, size_to, splits):
+            shards.append({'shard': len(shards), 'libraries': group, 'from': start, 'to': end})
+    return shards
+
+
+def token_subsets(tokens, workers):
+    """Disjoint subsets of tokens, one per worker, as many as there are tokens at most"""
+    if not tokens:
+        raise ValueError('No Github_N tokens in the environment')
+    workers = min(workers, len(tokens))
+    return [tokens[start::workers] for start in range(workers)]
+
+
+def worker_env(tokens):
+    env = {name: value for name, value in os.environ.items() if not name.startswith('Github_')}
+    env.update(('Github_%d' % (index + 1), token) for index, token in enumerate(tokens))
+    return env
+
+
+def shard_command(shard, feed, spider_args, settings):
+    number = str(shard['shard'])
+    command = [sys.executable, '-m', 'scrapy', 'crawl', ToggledReposSpider.name, '-O', feed,
+               '-a', 'libraries=%s' % ','.join(shard['libraries']),
+               '-a', 'size_from=%d' % shard['from'], '-a', 'size_to=%d' % shard['to']]
+    for arg in spider_args:
+        command += ['-a', arg.replace('%(shard)s', number)]
+    for setting in settings:
+        command += ['-s', setting.replace('%(shard)s', number)]
+    return command
+
+
+def crawl(shards, workers, outdir, spider_args, settings):
+    """Crawl the shards, returns the feed of every shard and the shards that failed"""
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    pending = queue.Queue()
+    for shard in shards:
+        pending.put(shard)
+    feeds = {shard['shard']: os.path.join(outdir, 'shard-%d.csv' % shard['shard']) for shard in shards}
+    failed = []
+
+    def work(tokens):
+        while True:
+            try:
+                shard = pending.get_nowait()
+            except queue.Empty:
+                return
+            log = os.path.join(outdir, 'shard-%d.log' % shard['shard'])
+            command = shard_command(shard, feeds[shard['shard']], spider_args, list(settings) + ['LOG_FILE=%s' % log])
+            print('shard %d: %s %d..%d with %d tokens' % (shard['shard'], ','.join(shard['libraries']), shard['from'],
+                                                          shard['to'], len(tokens)))
+            if subprocess.call(command, cwd=ROOT, env=worker_env(tokens)):
+                print('shard %d failed, see %s' % (shard['shard'], log))
+                failed.append(shard['shard'])
+
+    threads = [threading.Thread(target=work, args=(tokens,)) for tokens in token_subsets(github.load_tokens(), workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [feeds[shard['shard']] for shard in shards], sorted(failed)
+
+
+def merge(feeds, output):
+    """Deduplicated rows of the feeds in output, the number of rows"""
+    fieldnames = None
+    rows = {}
+    for feed in feeds:
+        if not os.path.exists(feed):
+            continue
+        with open(feed) as csv_file:
+            reader = csv.DictReader(csv_file)
+            if not reader.fieldnames:
+                continue
+            fieldnames = fieldnames or reader.fieldnames
+            aggregated = 'hits' in fieldnames
+            for row in reader:
+                if not aggregated:
+                    rows.setdefault(tuple(row.get(field) for field in fieldnames), row)
+                    continue
+                # The hits of a repository may be spread over several size ranges
+                key = (row['library'], row['repo_name'])
+                if key not in rows:
+                    rows[key] = dict(row, names=set(row['names'].split(',')) if row['names'] else set())
+                    continue
+                rows[key]['hits'] = int(rows[key]['hits']) + int(row['hits'])
+                rows[key]['names'].update(row['names'].split(',') if row['names'] else [])
+
+    with open(output, 'w') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=fieldnames or ['library', 'repo_name'])
+        writer.writeheader()
+        for row in rows.values():
+            if isinstance(row.get('names'), set):
+                row['names'] = ','.join(sorted(row['names']))
+            writer.writerow(row)
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sharded toggled_repos crawl')
+    parser.add_argument('--workers', type=int, default=1, help='shards crawled at a time, each with its own tokens')
+    parser.add_argument('--library-shards', type=int, default=1, help='groups of libraries')
+    parser.add_argument('--size-splits', default='', help='comma separated sizes the size range is cut before')
+    parser.add_argument('--shards', help='comma separated shards to crawl, all by default')
+    parser.add_argument('--list', action='store_true', help='list the shards and exit')
+    parser.add_argument('--merge', nargs='+', metavar='FEED', help='only merge these feeds into --output')
+    parser.add_argument('--outdir', default='shards', help='directory of the feeds and logs of the shards')
+    parser.add_argument('-o', '--output', help='merged feed')
+    parser.add_argument('-a', dest='spider_args', action='append', default=[], help='spider argument NAME=VALUE')
+    parser.add_argument('-s', dest='settings', action='append', default=[], help='setting NAME=VALUE')
+    args = parser.parse_args(argv)
+
+    if args.merge:
+        if not args.output:
+            parser.error('--merge needs --output')
+        print('%d rows in %s' % (merge(args.merge, args.output), args.output))
+        return
+
+    names = [library['library'] for library in ToggledReposSpider.libraries]
+    splits = [int(split) for split in args.size_splits.split(',') if split]
+    shards = plan(names, args.library_shards, ToggledReposSpider.size_from, ToggledReposSpider.size_to, splits)
+
+    if args.list:
+        for shard in shards:
+            print('%d\t%d..%d\t%s' % (shard['shard'], shard['from'], shard['to'], ','.join(shard['libraries'])))
+        return
+    if args.shards:
+        selected = set(int(shard) for shard in args.shards.split(','))
+        shards = [shard for shard in shards if shard['shard'] in selected]
+
+    feeds, failed = crawl(shards, args.workers, args.outdir, args.spider_args, args.settings)
+    if failed:
+        raise SystemExit('Shards %s failed, not merging' % ','.join(str(shard) for shard in failed))
+    if args.output:
+        print('%d rows in %s' % (merge(feeds, args.output), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,68 +1,210 @@
 import scrapy
-import os
-import json
-import csv
 import time
-import re
 from calendar import timegm
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+from githubdisco import commits, github, graphql
+from githubdisco.commits import CommitStatsCache
+from githubdisco.decoding import ResponseDecoder
+from githubdisco.feeder import InputFeeder, read_csv, unique
+from githubdisco.repostore import RepoStore, stored_request
 
 # Extract agumented info for toggled repositories via GitHub v3 API
 #
 # Usage:
-# $ AUTH_TOKEN=... scrapy crawl augment_toggled_repos -a repos_filename=repositories.csv -o ../results/raw/results-augmented-data-`date -u "+%Y%m%d%H%M%S"`.csv
+# $ Github_1=... scrapy crawl augment_toggled_repos -a repos_filename=repositories.csv -o ../results/raw/results-augmented-data-`date -u "+%Y%m%d%H%M%S"`.csv
+#
+# With -a api=graphql repository info and first commits are fetched through
+# the GraphQL v4 API for batch_size (default 50) repositories per query, and
+# the number of contributors with a single per_page=1 REST call per repo
+# (-a contributors=none skips it). number_of_commits is then the size of the
+# default branch history instead of the sum of the contributions. Forks of
+# forks are augmented through the REST API, forked_from is the root of the
+# fork network either way.
+#
+# The input is read as the crawl goes, with at most max_in_flight (-a
+# max_in_flight=...) repositories being augmented at any time.
+#
+# number_of_commits and first_commit_sha come from listing the commits one
+# per page (see githubdisco/commits.py), -a commit_stats=contributors sums
+# the contributions of the paginated contributors instead. With -a
+# commits_cache=commits.sqlite known first commits are reused across runs.
+#
+# With -a repo_store=repos.sqlite repositories augmented in the last week,
+# with the same options, are emitted from the store without any API call
+# (see githubdisco/repostore.py).
 
 class AugmentToggledReposSpider(scrapy.Spider):
 
     name = "augment_toggled_repos"
-    handle_httpstatus_list = [404]
-    headers = {
-        'Authorization': 'Bearer ' + os.environ['Github_1'],
-    }
-    augmented = {}
+    # 409 is a commits list of an empty repository
+    handle_httpstatus_list = [404, 409]
     max_items_per_page = 100
+    max_in_flight = 500
+
+    # Columns of the items, in csv order (see githubdisco/pipelines.py)
+    item_schema = [('repo_name', 'string'), ('language', 'string'), ('size_bytes', 'int'), ('number_of_commits', 'int'),
+                   ('last_commit_ts', 'int'), ('forked_from', 'string'), ('number_of_contributors', 'int'),
+                   ('repo_not_found', 'bool'), ('first_commit_sha', 'string'), ('created_at', 'int')]
+    custom_settings = {'FEED_EXPORT_FIELDS': [field for field, _ in item_schema]}
+
+    # JSON decoding backend, None for the fastest installed (see githubdisco/decoding.py)
+    json_backend = None
+
+    def __init__(self, api='rest', contributors='rest', batch_size=graphql.BATCH_SIZE, max_in_flight=None,
+                 commit_stats='commits', commits_cache=None, json_backend=None, repo_store=None, *args, **kwargs):
+        super(AugmentToggledReposSpider, self).__init__(*args, **kwargs)
+        self.decoder = ResponseDecoder(json_backend or self.json_backend)
+        # repo_name -> augmented data of the repositories in flight
+        self.augmented = {}
+        if max_in_flight:
+            self.max_in_flight = int(max_in_flight)
+        if api not in ('rest', 'graphql'):
+            raise ValueError('Unknown api %r, expected rest or graphql' % api)
+        self.api = api
+        if commit_stats not in ('commits', 'contributors'):
+            raise ValueError('Unknown commit_stats %r, expected commits or contributors' % commit_stats)
+        self.sum_contributions = api == 'rest' and commit_stats == 'contributors'
+        self.count_contributors = contributors != 'none' or self.sum_contributions
+        self.batch_size = min(int(batch_size), 100)
+        self.commits_cache = CommitStatsCache(commits_cache) if commits_cache else None
+        self.repo_store = RepoStore(repo_store) if repo_store else None
+        # Stored items are only reused if augmented the same way
+        self.store_options = {'api': api, 'commit_stats': commit_stats, 'contributors': self.count_contributors}
+        # Responses each repository waits for before it is complete: info,
+        # first commit and contributors
+        self.stages = 2 + self.count_contributors
 
     def get_contributors_url(self, meta):
-        return ('https://api.github.com/repos/{repo_name}/contributors?anon=1&page={page}&per_page=' + str(self.max_items_per_page)).format_map(meta)
+        return (github.API_URL + '/repos/{repo_name}/contributors?anon=1&page={page}&per_page=' + str(self.max_items_per_page)).format_map(meta)
 
     def get_commits_list_url(self, meta):
-        return ('https://api.github.com/repos/{repo_name}/commits?page={page}&per_page=1').format_map(meta)
+        return (github.API_URL + '/repos/{repo_name}/commits?page={page}&per_page=1').format_map(meta)
+
+    def get_contributors_count_url(self, repo_name):
+        return '%s/repos/%s/contributors?anon=1&per_page=1' % (github.API_URL, repo_name)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(AugmentToggledReposSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def closed(self, reason):
+        if self.commits_cache:
+            self.commits_cache.close()
+        if self.repo_store:
+            self.repo_store.close()
 
     def start_requests(self):
-        toggled_repos = self.load_toggled_repos()
+        batch_size = self.batch_size if self.api == 'graphql' else 1
+        self.feeder = InputFeeder(self.load_toggled_repos(), self.augment_requests, self.max_in_flight, batch_size)
+        yield from self.feeder.feed()
+
+    def augment_requests(self, toggled_repos):
+        """API requests for the repositories not in the store, a local one for the others"""
+        stored = []
+        missing = []
+        for repo in toggled_repos:
+            record = self.repo_store.get(repo['repo_name'], 'augmented') if self.repo_store else None
+            if record is not None and record['options'] == self.store_options:
+                stored.append(record['item'])
+            else:
+                missing.append(repo)
+        requests = self.graphql_requests(missing) if self.api == 'graphql' else self.rest_requests(missing)
+        if stored:
+            self.crawler.stats.inc_value('repo_store/hits', len(stored))
+            self.crawler.stats.inc_value('repo_store/local_requests')
+            requests.append(stored_request(self.parse_stored, {'items': stored}))
+        return requests
+
+    def parse_stored(self, response):
+        items = response.meta['items']
+        yield from items
+        yield from self.feeder.done(len(items))
+
+    def spider_idle(self):
+        # Whatever is still in self.augmented lost a request on the way
+        if self.augmented:
+            self.logger.warning('Giving up on %d incomplete repositories', len(self.augmented))
+            self.augmented.clear()
+        requests, lost = self.feeder.idle()
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests:
+            raise DontCloseSpider
+
+    def start_augmenting(self, repo_name):
+        self.augmented[repo_name] = {
+            'repo_name': repo_name,
+            '___stage___': 0
+        }
+
+    def rest_requests(self, toggled_repos):
+        requests = []
         for repo in toggled_repos:
             repo_name = repo['repo_name']
-            self.augmented[repo_name] = {
-                'repo_name': repo_name,
-                '___stage___': 0
-            }
+            self.start_augmenting(repo_name)
             meta = { 'repo_name': repo_name, 'page': 1 }
-            repo_info_url = 'https://api.github.com/repos/{0}'.format(repo_name)
-            yield scrapy.Request(url=repo_info_url, headers=self.headers, callback=self.parse_repo_info, meta=meta)
-            yield scrapy.Request(self.get_contributors_url(meta), headers=self.headers, callback=self.parse_contributors, meta=meta)
-            yield scrapy.Request(self.get_commits_list_url(meta), headers=self.headers, callback=self.parse_first_commit, meta=meta)
+            requests.append(self.repo_info_request(meta))
+            if self.sum_contributions:
+                requests.append(scrapy.Request(self.get_contributors_url(meta), callback=self.parse_contributors,
+                                               errback=self.request_failed, meta=meta))
+                requests.append(scrapy.Request(self.get_commits_list_url(meta), callback=self.parse_first_commit,
+                                               errback=self.request_failed, meta=meta))
+                continue
+            if self.count_contributors:
+                requests.append(self.contributors_count_request(repo_name))
+            requests.append(self.commit_stats_request(meta))
+        return requests
 
-    def load_toggled_repos(self):
-        csv_filename = self.repos_filename
-        toggled_repos = []
-        with open(csv_filename, 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                toggled_repos.append(row)
+    def repo_info_request(self, meta):
+        return scrapy.Request(github.API_URL + '/repos/{0}'.format(meta['repo_name']), callback=self.parse_repo_info,
+                              errback=self.request_failed, meta=meta)
+
+    def commit_stats_request(self, meta):
+        return scrapy.Request(self.get_commits_list_url(meta), callback=self.parse_commit_stats,
+                              errback=self.request_failed, meta=meta)
+
+    def rest_fallback(self, repo_name):
+        """Info and first commit of repo_name through the REST API, GraphQL failed to tell"""
+        self.crawler.stats.inc_value('augment/graphql_fallbacks')
+        meta = {'repo_name': repo_name, 'page': 1}
+        return [self.repo_info_request(meta), self.commit_stats_request(meta)]
+
+    def contributors_count_request(self, repo_name):
+        return scrapy.Request(self.get_contributors_count_url(repo_name), callback=self.parse_contributors_count,
+                              errback=self.request_failed, meta={'repo_name': repo_name})
 
-        return toggled_repos
+    def request_failed(self, failure):
+        """Give up on the repository of a failed request, the next rows take its place"""
+        repo_name = failure.request.meta['repo_name']
+        if self.augmented.pop(repo_name, None) is None:
+            return []
+        self.logger.warning('Giving up on %s: %s', repo_name, failure.getErrorMessage())
+        self.crawler.stats.inc_value('augment/failed')
+        return self.feeder.done()
+
+    def load_toggled_repos(self):
+        # toggled_repos has a row per hit, a repository is augmented once (see githubdisco/feeder.py)
+        return unique(read_csv(self.repos_filename), lambda row: row['repo_name'])
 
     def as_epoch(self, json_timestamp):
         return timegm(time.strptime(json_timestamp, "%Y-%m-%dT%H:%M:%SZ"))
 
     def parse_repo_info(self, response):
         repo_name = response.meta['repo_name']
-        augmented_data = self.augmented[repo_name]
+        augmented_data = self.augmented.get(repo_name)
+        if augmented_data is None:
+            # Given up on after a failed request
+            return
 
         if response.status == 404:
-            yield self.handle_404(augmented_data)
+            yield from self.handle_404(augmented_data)
             return
 
-        json_response = json.loads(response.text)
+        json_response = self.decoder.json(response)
 
         augmented_data['size_bytes'] = json_response['size'] * 1024
         augmented_data['forked_from'] = json_response['source']['full_name'] if json_response.get('source') else None
@@ -71,18 +213,22 @@ class AugmentToggledReposSpider(scrapy.Spider):
         augmented_data['language'] = json_response['language']
         augmented_data['___stage___'] += 1
 
-        yield self.augmented_complete(augmented_data)
+        yield from self.augmented_complete(augmented_data)
 
     def parse_contributors(self, response):
         meta = response.meta
         repo_name = meta['repo_name']
-        augmented_data = self.augmented[repo_name]
+        augmented_data = self.augmented.get(repo_name)
+        if augmented_data is None:
+            # Given up on after a failed request
+            return
 
         if response.status == 404:
-            yield self.handle_404(augmented_data)
+            yield from self.handle_404(augmented_data)
             return
 
-        json_response = json.loads(response.text)
+        # 204 without a body for an empty repository
+        json_response = self.decoder.json(response) or []
 
         if meta['page'] == 1:
             augmented_data['number_of_contributors'] = 0
@@ -95,38 +241,225 @@ class AugmentToggledReposSpider(scrapy.Spider):
 
         if contributors == self.max_items_per_page:
             meta['page'] += 1
-            yield scrapy.Request(self.get_contributors_url(meta), headers=self.headers, callback=self.parse_contributors, meta=meta)
+            yield scrapy.Request(self.get_contributors_url(meta), callback=self.parse_contributors, errback=self.request_failed,
+                                 meta=meta)
 
         if contributors == 0 or contributors < self.max_items_per_page:
             augmented_data['___stage___'] += 1
-            yield self.augmented_complete(augmented_data)
+            yield from self.augmented_complete(augmented_data)
 
     def get_last_page_from_header(self, response):
-        link_header = response.headers.get('Link')
-        rel_links = link_header.decode('utf-8').split(', ')
-        for link, rel in [rel_link.split('; ') for rel_link in rel_links]:
-            if rel == 'rel="last"':
-                last_page = int(re.search(r'page=(\d+)', link).group(1))
-                return last_page
+        return commits.last_page(response.headers.get('Link'))
 
     def parse_first_commit(self, response):
         meta = response.meta
         repo_name = meta['repo_name']
-        augmented_data = self.augmented[repo_name]
+        augmented_data = self.augmented.get(repo_name)
+        if augmented_data is None:
+            # Given up on after a failed request
+            return
 
         if response.status == 404:
-            yield self.handle_404(augmented_data)
+            yield from self.handle_404(augmented_data)
+            return
+
+        if response.status == 409:
+            augmented_data['first_commit_sha'] = None
+            augmented_data['___stage___'] += 1
+            yield from self.augmented_complete(augmented_data)
             return
 
-        last_page = self.get_last_page_from_header(response)
+        # No Link header when everything fits on page 1
+        last_page = self.get_last_page_from_header(response) or 1
         if meta['page'] == last_page:
-            json_response = json.loads(response.text)
+            json_response = self.decoder.json(response)
             augmented_data['first_commit_sha'] = json_response[0]['sha']
             augmented_data['___stage___'] += 1
-            yield self.augmented_complete(augmented_data)
+            yield from self.augmented_complete(augmented_data)
         elif meta['page'] == 1:
             meta['page'] = last_page
-            yield scrapy.Request(self.get_commits_list_url(meta), headers=self.headers, callback=self.parse_first_commit, meta=meta)
+            yield scrapy.Request(self.get_commits_list_url(meta), callback=self.parse_first_commit, errback=self.request_failed,
+                                 meta=meta)
+
+    def cached_first_commit(self, repo_name, number_of_commits):
+        return self.commits_cache.first_commit(repo_name, number_of_commits) if self.commits_cache else None
+
+    def parse_commit_stats(self, response):
+        meta = response.meta
+        repo_name = meta['repo_name']
+        augmented_data = self.augmented.get(repo_name)
+        if augmented_data is None:
+            # Given up on after a failed request
+            return
+
+        if response.status == 404:
+            yield from self.handle_404(augmented_data)
+            return
+
+        if response.status == 409:
+            # Empty repository
+            augmented_data['number_of_commits'] = 0
+            augmented_data['first_commit_sha'] = None
+        elif meta['page'] == 1:
+            total, first_commit_sha = commits.first_page_stats(response.headers.get('Link'), self.decoder.json(response))
+            augmented_data['number_of_commits'] = total
+            first_commit_sha = first_commit_sha or self.cached_first_commit(repo_name, total)
+            if first_commit_sha is None:
+                # The last page holds the first commit
+                meta['page'] = total
+                yield scrapy.Request(self.get_commits_list_url(meta), callback=self.parse_commit_stats,
+                                     errback=self.request_failed, meta=meta)
+                return
+            augmented_data['first_commit_sha'] = first_commit_sha
+        else:
+            last_page = self.decoder.json(response)
+            augmented_data['first_commit_sha'] = last_page[0]['sha'] if last_page else None
+
+        augmented_data['___stage___'] += 1
+        yield from self.augmented_complete(augmented_data)
+
+    def graphql_request(self, query, callback, errback, meta):
+        return scrapy.Request(graphql.graphql_url(), method='POST', body=graphql.request_body(query),
+                              headers={'Content-Type': 'application/json'}, callback=callback, errback=errback, meta=meta)
+
+    def repositories_request(self, repo_names):
+        return self.graphql_request(graphql.repositories_query(repo_names), self.parse_repositories,
+                                    self.repositories_failed, {'repo_names': repo_names})
+
+    def repositories_failed(self, failure):
+        self.logger.warning('GraphQL request failed: %s', failure.getErrorMessage())
+        requests = []
+        for repo_name in failure.request.meta['repo_names']:
+            if repo_name in self.augmented:
+                requests.extend(self.rest_fallback(repo_name))
+        return requests
+
+    def graphql_requests(self, toggled_repos):
+        repo_names = [repo['repo_name'] for repo in toggled_repos]
+        requests = []
+        for start in range(0, len(repo_names), self.batch_size):
+            batch = repo_names[start:start + self.batch_size]
+            for repo_name in batch:
+                self.start_augmenting(repo_name)
+            requests.append(self.repositories_request(batch))
+            if self.count_contributors:
+                for repo_name in batch:
+                    requests.append(self.contributors_count_request(repo_name))
+        return requests
+
+    def graphql_results(self, response, count):
+        """Alias data in query order (None if the query failed as a whole) and the aliases not found"""
+        response_json = self.decoder.json(response)
+        repositories, errors = graphql.results(response_json, count)
+        for error in errors:
+            self.logger.warning('GraphQL error: %s', error.get('message'))
+        if errors and not any(repositories):
+            return None, set()
+        return repositories, graphql.not_found(response_json)
+
+    def parse_repositories(self, response):
+        repo_names = response.meta['repo_names']
+        repositories, not_found = self.graphql_results(response, len(repo_names))
+        if repositories is None:
+            if len(repo_names) > 1:
+                # Typically a timeout on big histories, ask for halves
+                middle = len(repo_names) // 2
+                yield self.repositories_request(repo_names[:middle])
+                yield self.repositories_request(repo_names[middle:])
+            elif repo_names[0] in self.augmented:
+                self.logger.warning('No GraphQL data for %s, asking the REST API', repo_names[0])
+                yield from self.rest_fallback(repo_names[0])
+            return
+
+        heads = []
+        for index, (repo_name, repository) in enumerate(zip(repo_names, repositories)):
+            augmented_data = self.augmented.get(repo_name)
+            if augmented_data is None:
+                continue
+            if repository is None and graphql.alias(index) in not_found:
+                # Neither info nor first commit will come
+                augmented_data['___stage___'] += 1
+                yield from self.handle_404(augmented_data)
+                continue
+            if repository is None:
+                # Forbidden, timed out...: it may well exist
+                yield from self.rest_fallback(repo_name)
+                continue
+            if repository['parent'] and repository['parent']['isFork']:
+                # forked_from is the root of the fork network, the source of the REST API, GraphQL only has the parent
+                yield from self.rest_fallback(repo_name)
+                continue
+
+            augmented_data['size_bytes'] = repository['diskUsage'] * 1024 if repository['diskUsage'] is not None else None
+            augmented_data['forked_from'] = repository['parent']['nameWithOwner'] if repository['parent'] else None
+            augmented_data['last_commit_ts'] = self.as_epoch(repository['pushedAt']) if repository['pushedAt'] else None
+            augmented_data['created_at'] = self.as_epoch(repository['createdAt'])
+            augmented_data['language'] = repository['primaryLanguage']['name'] if repository['primaryLanguage'] else None
+            if not self.count_contributors:
+                augmented_data['number_of_contributors'] = None
+
+            oid, total = graphql.head_commit(repository)
+            augmented_data['number_of_commits'] = total
+            augmented_data['___stage___'] += 1
+            first_commit_sha = oid if total <= 1 else self.cached_first_commit(repo_name, total)
+            if total > 1 and first_commit_sha is None:
+                heads.append((repo_name, oid, total))
+            else:
+                # The head is the first commit, there are none at all or it is known
+                augmented_data['first_commit_sha'] = first_commit_sha
+                augmented_data['___stage___'] += 1
+            yield from self.augmented_complete(augmented_data)
+
+        if heads:
+            yield self.graphql_request(graphql.first_commits_query(heads), self.parse_first_commits, self.first_commits_failed,
+                                       {'heads': heads})
+
+    def first_commit_request(self, repo_name):
+        """Last page of the REST commits list, GraphQL failed to tell the first commit"""
+        return scrapy.Request(self.get_commits_list_url({'repo_name': repo_name, 'page': 1}), callback=self.parse_first_commit,
+                              errback=self.request_failed, meta={'repo_name': repo_name, 'page': 1})
+
+    def first_commits_failed(self, failure):
+        self.logger.warning('GraphQL request failed: %s', failure.getErrorMessage())
+        return [self.first_commit_request(repo_name) for repo_name, oid, total in failure.request.meta['heads']
+                if repo_name in self.augmented]
+
+    def parse_first_commits(self, response):
+        heads = response.meta['heads']
+        repositories, not_found = self.graphql_results(response, len(heads))
+        if repositories is None:
+            repositories = [None] * len(heads)
+
+        for (repo_name, oid, total), repository in zip(heads, repositories):
+            augmented_data = self.augmented.get(repo_name)
+            if augmented_data is None:
+                continue
+            if repository is None:
+                yield self.first_commit_request(repo_name)
+                continue
+            commit = repository.get('object')
+            nodes = commit['history']['nodes'] if commit else []
+            augmented_data['first_commit_sha'] = nodes[0]['oid'] if nodes else None
+            augmented_data['___stage___'] += 1
+            yield from self.augmented_complete(augmented_data)
+
+    def parse_contributors_count(self, response):
+        augmented_data = self.augmented.get(response.meta['repo_name'])
+        if augmented_data is None:
+            return
+
+        if response.status == 404:
+            yield from self.handle_404(augmented_data)
+            return
+
+        if response.headers.get('Link'):
+            # One contributor per page, the last page is the count
+            augmented_data['number_of_contributors'] = self.get_last_page_from_header(response)
+        else:
+            # 204 for an empty repository
+            augmented_data['number_of_contributors'] = len(self.decoder.json(response) or [])
+        augmented_data['___stage___'] += 1
+        yield from self.augmented_complete(augmented_data)
 
     def handle_404(self, augmented_data):
         augmented_data['___stage___'] += 1
@@ -134,6 +467,13 @@ class AugmentToggledReposSpider(scrapy.Spider):
         return self.augmented_complete(augmented_data)
 
     def augmented_complete(self, augmented_data):
-        if augmented_data['___stage___'] == 3:
+        if augmented_data['___stage___'] == self.stages:
             del augmented_data['___stage___']
-            return augmented_data
\ No newline at end of file
+            del self.augmented[augmented_data['repo_name']]
+            if self.commits_cache and augmented_data.get('first_commit_sha'):
+                self.commits_cache.put(augmented_data['repo_name'], augmented_data['first_commit_sha'],
+                                       augmented_data['number_of_commits'])
+            if self.repo_store:
+                self.repo_store.put(augmented_data['repo_name'], 'augmented', {'options': self.store_options, 'item': augmented_data})
+            yield augmented_data
+            yield from self.feeder.done()
\ No newline at end of file
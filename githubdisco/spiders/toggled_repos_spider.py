@@ -1,22 +1,76 @@
+import itertools
 import logging
 
 import re
 import string
-import os
 import scrapy
-import json
 import re
 import base64
 from string import Template
 from libraries import LIBRARIES
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.shell import inspect_response
+from githubdisco import github
+from githubdisco.aggregation import RECORD_SCHEMA, RepoAggregator
+from githubdisco.cardinality import TermCounts, bound_url
+from githubdisco.checkpoint import CrawlCheckpoint
+from githubdisco.partition import SizePartitioner
+from githubdisco.seen import SeenSet, result_key
+from githubdisco.verification import build_matchers, content_text, match_libraries
+from githubdisco.contents import ContentFetcher, content_hit
+from githubdisco.decoding import ResponseDecoder
+from githubdisco.incremental import IncrementalState
+from githubdisco.repostore import stored_request
+from githubdisco.planner import QueryPlan, TEXT_MATCH_MEDIA_TYPE, attribute, group_scope, shared_url
+from githubdisco.scheduling import SearchScheduler
+from githubdisco.telemetry import search_page_parsed
 
 # Find toggled repositories via GitHub v3 API
 #
 # Usage:
-# $ AUTH_TOKEN=... scrapy crawl toggled_repos -o ../results/normalized/results-github-scraper-`date -u "+%Y%m%d%H%M%S"`.csv
+# $ Github_1=... Github_2=... scrapy crawl toggled_repos -o ../results/normalized/results-github-scraper-`date -u "+%Y%m%d%H%M%S"`.csv
 
 # scrapy crawl toggled_repos -o ../results/results-github-patreon.csv
+#
+# Resumable crawl, pending split tree nodes and seen files are kept in the given SQLite file:
+# $ scrapy crawl toggled_repos -a checkpoint=toggled_repos.sqlite -o ...
+#
+# Keep at most N seen results in memory, spilling the rest to a temporary SQLite file in the given directory:
+# $ scrapy crawl toggled_repos -a seen_spill=/tmp -a seen_max_entries=N -o ...
+#
+# Verify the contents of the search hits, repository by repository, instead of emitting the hits
+# (contents=api|blob|raw, see githubdisco/contents.py):
+# $ scrapy crawl toggled_repos -a contents=raw -o ...
+#
+# Emit only files that are new or changed since the previous run with the same state file, queries
+# crawled before are only paged through down to the newest results of the previous run. With contents a file
+# is only known once it is verified, a file that failed to download comes up again:
+# $ scrapy crawl toggled_repos -a incremental=toggled_repos_incremental.sqlite -o ...
+#
+# Search up to N strings of libraries with the same qualifiers in one query ("a" OR "b" ...), results
+# are attributed to the libraries by their text matches (see githubdisco/planner.py):
+# $ scrapy crawl toggled_repos -a query_batch=6 -o ...
+#
+# Responses are decoded with orjson or ujson when installed, -a json_backend=json forces the json module.
+#
+# Searches are prioritised by the new results they are expected to return (see githubdisco/scheduling.py),
+# with at most N query splitter probes in flight:
+# $ scrapy crawl toggled_repos -a max_splitters=8 -o ...
+#
+# Splitter terms are searched on their own first, their counts bound the probes of every library with the
+# same qualifiers and are kept in the given SQLite file; terms without results are never probed (see
+# githubdisco/cardinality.py):
+# $ scrapy crawl toggled_repos -a term_counts=splitter_terms.sqlite -o ...
+#
+# Emit a record per library and repository (hits, matched file names, fork flag) at the end of the crawl
+# instead of an item per hit (see githubdisco/aggregation.py), content verified items are per repository
+# already. With a checkpoint or incremental state the records are kept in its file until the run that gets to
+# the end emits them; an incremental run only counts the hits that are new since the previous one:
+# $ scrapy crawl toggled_repos -a aggregate=repos -o ...
+#
+# Crawl some of the libraries only, in a part of the size range (a shard, see githubdisco/sharding.py):
+# $ scrapy crawl toggled_repos -a libraries=paypal,patreon -a size_from=0 -a size_to=9999 -o ...
 
 def java_placeholders(_placeholders):
     placeholders = dict(_placeholders)
@@ -31,21 +85,12 @@ class ToggledReposSpider(scrapy.Spider):
 
     csv_fieldnames = ['repo_name', 'path', 'language', 'size_bytes', 'library', 'library_language', 'last_commit_ts', 'forked_from']
 
-    token_ID = 0
-
-    tokens = [os.environ['Github_1'], os.environ['Github_2'], os.environ['Github_3'], os.environ['Github_4'],
-              os.environ['Github_5'], os.environ['Github_6'], os.environ['Github_7'], os.environ['Github_8'],
-              os.environ['Github_9'], os.environ['Github_10']]
-
-    def get_headers(self, new_token):
-        if new_token:
-            self.token_ID += 1
-        return {
-            'Authorization': 'Bearer ' + self.get_GH_TOKEN(),
-        }
-
-    def get_GH_TOKEN(self):
-        return self.tokens[self.token_ID % len(self.tokens)]
+    # Columns of the items (see githubdisco/pipelines.py): the search hits,
+    # then the rest of csv_fieldnames for the content verified ones
+    item_schema = [('library', 'string'), ('repo_name', 'string'), ('forked', 'bool'), ('name', 'string'),
+                   ('path', 'string'), ('language', 'string'), ('size_bytes', 'int'), ('library_language', 'string'),
+                   ('last_commit_ts', 'int'), ('forked_from', 'string')]
+    custom_settings = {'FEED_EXPORT_FIELDS': ['library', 'repo_name', 'forked', 'name']}
 
     size_from = 0
     # Only files smaller than 384 KB are searchable.
@@ -123,18 +168,50 @@ class ToggledReposSpider(scrapy.Spider):
             ['${import_or_usage}', re.IGNORECASE, r'go$'],
         ],
         'markdown': [
-            ['{artifact_name}', re.IGNORECASE, r'readme.md$'],
+            ['${artifact_name}', re.IGNORECASE, r'(?i)readme.md$'],
         ],
 
     }
 
+    # Regexp engine for the templates ('re', 'segmented' or 're2', see githubdisco/matcher.py)
+    # and seconds matching a single file may take before it is flagged as pathological
+    regex_backend = 'segmented'
+    match_budget = 5
+
+    # JSON decoding backend, None for the fastest installed (see githubdisco/decoding.py)
+    json_backend = None
+
     per_page = 100
-    search_template = 'https://api.github.com/search/code?${params}+size:${from}..${to}+path%3A%2F+in%3Afile+extension%3Amd&page=${page}&s=indexed&o=desc&per_page=' + str(per_page)
+    search_template = github.API_URL + '/search/code?${params}+size:${from}..${to}+path%3A%2F+in%3Afile+extension%3Amd&page=${page}&s=indexed&o=desc&per_page=' + str(per_page)
 
     max_results = 1000
 
+    # Maximum number of size ranges a range with too many results is split into
+    max_size_splits = 16
+
+    # Maximum number of query splitter probes in flight, the others wait by priority
+    # (see githubdisco/scheduling.py)
+    max_splitters = 12
+
+    # Search strings per query, more than one packs libraries into shared queries
+    query_batch = 1
+
     number_duplicates = 0
 
+    def templates_for(self, library):
+        languages = [lang.lower() for lang in library['languages'].split(',')]
+        return [templates for lang, templates in self.regexp_templates_by_lang.items() if lang in languages][0]
+
+    def verification_libraries(self):
+        """(library, templates) pairs to build the content matchers from"""
+        keys = ('library', 'artifacts', 'languages', 'imports_usages')
+        return [({key: library[key] for key in keys}, self.templates_for(library)) for library in self.libraries]
+
+    def qualifiers_for(self, languages):
+        filenames = [filenames for lang, filenames in self.filenames_by_lang.items() if lang in languages][0]
+        if len(filenames) > 0:
+            yield '+'.join(['filename:' + filename for filename in filenames])
+
     def as_params(self, search_string, languages):
         params_template = Template("q=%22${search_string}%22+${extensions_or_filenames}")
 
@@ -145,19 +222,16 @@ class ToggledReposSpider(scrapy.Spider):
         #         'extensions_or_filenames': '+'.join(['extension:' + ext for ext in extensions])
         #     })
 
-        filenames = [filenames for lang, filenames in self.filenames_by_lang.items() if lang in languages][0]
-        if len(filenames) > 0:
+        for qualifiers in self.qualifiers_for(languages):
             yield params_template.substitute({
                 'search_string': search_string,
-                'extensions_or_filenames': '+'.join(['filename:' + filename for filename in filenames])
+                'extensions_or_filenames': qualifiers
             })
 
     def search_urls(self, library, page=1):
         languages = [lang.lower() for lang in library['languages'].split(',')]
-        artifacts_names = [artifact.split(',')[0] for artifact in library['artifacts']]
-        imports_usages = library['imports_usages']
 
-        for search_string in artifacts_names + imports_usages:
+        for search_string in self.search_strings(library):
             url_template = Template(self.search_template)
             for params in self.as_params(search_string, languages):
                 yield url_template.substitute({
@@ -167,25 +241,463 @@ class ToggledReposSpider(scrapy.Spider):
                     'to': int(self.size_to)
                 })
 
-    def start_requests(self):
+    def search_strings(self, library):
+        return [artifact.split(',')[0] for artifact in library['artifacts']] + library['imports_usages']
+
+    def search_scopes(self):
+        """(library, root search urls) pairs, the library is a group_scope for shared queries"""
+        if self.query_batch <= 1:
+            for library in self.libraries:
+                yield library, list(self.search_urls(library))
+            return
+
+        plan = QueryPlan(self.query_batch)
+        for library in self.libraries:
+            languages = [lang.lower() for lang in library['languages'].split(',')]
+            for search_string in self.search_strings(library):
+                for qualifiers in self.qualifiers_for(languages):
+                    plan.add(library, search_string, qualifiers)
+
+        for qualifiers, terms in plan.groups():
+            search_strings = []
+            for library, search_string in terms:
+                if search_string not in search_strings:
+                    search_strings.append(search_string)
+            url = shared_url(self.search_template, search_strings, qualifiers, self.size_from, self.size_to)
+            if len(terms) == 1:
+                yield terms[0][0], [url]
+                continue
+            group = group_scope([library for library, search_string in terms])
+            group['terms'] = [(library['library'], search_string) for library, search_string in terms]
+            group['qualifiers'] = qualifiers
+            yield group, [url]
+
+    def search_headers(self, library):
+        # Shared query results are attributed by their text matches
+        if 'members' in library and not self.fetcher:
+            return {'Accept': TEXT_MATCH_MEDIA_TYPE}
+        return {}
+
+    def __init__(self, checkpoint=None, seen_spill=None, seen_max_entries=1000000, contents=None, incremental=None,
+                 query_batch=None, json_backend=None, max_splitters=None, term_counts=None, aggregate=None,
+                 libraries=None, *args, **kwargs):
+        super(ToggledReposSpider, self).__init__(*args, **kwargs)
+        if libraries:
+            names = libraries.split(',')
+            unknown = set(names) - set(library['library'] for library in self.libraries)
+            if unknown:
+                raise ValueError('Unknown libraries %s' % ', '.join(sorted(unknown)))
+            self.libraries = [library for library in self.libraries if library['library'] in names]
+        # -a size_from=... -a size_to=... come as strings
+        self.size_from = int(self.size_from)
+        self.size_to = int(self.size_to)
+        self.decoder = ResponseDecoder(json_backend or self.json_backend)
+        if query_batch:
+            self.query_batch = int(query_batch)
+        if max_splitters:
+            self.max_splitters = int(max_splitters)
+        self.scheduler = SearchScheduler(self.per_page, self.max_results, self.max_splitters, skip=self.splitter_covered)
+        self.match_budget = float(self.match_budget)
+        self.checkpoint = CrawlCheckpoint(checkpoint) if checkpoint else None
+        self.fetcher = ContentFetcher(contents) if contents else None
+        self.incremental = IncrementalState(incremental) if incremental else None
+        self.term_counts = TermCounts(term_counts) if term_counts else None
+        if aggregate not in (None, 'repos'):
+            raise ValueError('Unknown aggregate %r, expected repos' % aggregate)
+        if aggregate and not self.fetcher:
+            # Records are kept with the marks of the hits they count (see githubdisco/aggregation.py)
+            state = self.incremental or self.checkpoint
+            self.aggregator = RepoAggregator(state.db if state else None)
+        else:
+            self.aggregator = None
+        if self.aggregator:
+            self.item_schema = RECORD_SCHEMA
+        # Bound search url -> splitter probes waiting for it
+        self.bound_waiters = {}
+        self.seen_spill = seen_spill
+        self.seen_max_entries = int(seen_max_entries)
+        self.matchers, self.scanner = build_matchers(self.verification_libraries(), self.regex_backend)
+        self.libraries_by_name = {library['library']: library for library in self.libraries}
         for library in self.libraries:
-            self.repositories = {}
-            self.exclude_pattern = {}
             library['matched'] = {} # Track to avoid unnecessary requests
-            for url in self.search_urls(library):
-                yield scrapy.Request(url=url, headers=self.get_headers(True), callback=self.parse,
-                                     meta={'library': library, 'page': 1, 'from': self.size_from, 'to': self.size_to, 'per_page': self.per_page})
+        self.partitioner = SizePartitioner(int(self.size_to), self.max_results, max_fanout=self.max_size_splits)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(ToggledReposSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        if spider.aggregator:
+            crawler.settings.set('FEED_EXPORT_FIELDS', [field for field, _ in spider.item_schema], priority='spider')
+        return spider
+
+    def spider_idle(self):
+        requests = self.scheduler.idle()
+        if not requests and self.aggregator:
+            records = self.aggregator.records()
+            if records:
+                self.crawler.stats.set_value('aggregate/records', len(records))
+                requests = [stored_request(self.parse_records, {'items': records})]
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests:
+            raise DontCloseSpider
+
+    def parse_records(self, response):
+        return response.meta['items']
+
+    def closed(self, reason):
+        self.record_seen_stats()
+        self.repositories.close()
+        if self.checkpoint:
+            self.checkpoint.close()
+        if self.incremental:
+            self.incremental.close(reason == 'finished')
+        if self.term_counts:
+            self.term_counts.close()
+
+    def new_seen_set(self):
+        if isinstance(self.repositories, SeenSet):
+            self.repositories.close()
+        return SeenSet(self.seen_spill, self.seen_max_entries)
+
+    def record_seen_stats(self):
+        if hasattr(self, 'crawler'):
+            self.crawler.stats.set_value('seen_set/entries', len(self.repositories))
+            self.crawler.stats.max_value('seen_set/memory_bytes', self.repositories.memory_bytes())
+
+    def start_requests(self):
+        resumed = set()
+        for library, urls in self.search_scopes():
+            scope = library['library']
+            self.repositories = self.new_seen_set()
+            self.exclude_pattern = {}
 
-    repositories = {}
+            if self.checkpoint and self.checkpoint.has_state(scope):
+                resumed.add(scope)
+                for request in self.resume(library):
+                    yield request
+                continue
+
+            for url in urls:
+                meta = {'library': library, 'page': 1, 'from': self.size_from, 'to': self.size_to, 'per_page': self.per_page}
+                if self.incremental and self.incremental.mark(self.query_key(scope, url)) is not None:
+                    meta['incremental'] = True
+                request = scrapy.Request(url=url, headers=self.search_headers(library), callback=self.parse, meta=meta)
+                if self.checkpoint:
+                    self.checkpoint.add_pending(scope, request.url, request.meta)
+                    self.checkpoint.commit()
+                yield request
+
+        if self.checkpoint and self.query_batch > 1:
+            # Libraries unpacked from shared queries before the restart
+            for library in self.libraries:
+                if library['library'] not in resumed and self.checkpoint.has_state(library['library']):
+                    self.repositories = self.new_seen_set()
+                    self.exclude_pattern = {}
+                    for request in self.resume(library):
+                        yield request
+
+    def resume(self, library):
+        scope = library['library']
+        self.checkpoint.load_seen(scope, self.repositories)
+        self.exclude_pattern = self.checkpoint.load_excluded(scope)
+        pending = self.checkpoint.pending(scope)
+        self.logger.info("Resuming %s: %d pending searches, %d seen" % (scope, len(pending), len(self.repositories)))
+        for url, meta in pending:
+            # A library of its own for the unpacked searches of a shared query
+            own = self.libraries_by_name.get(meta.pop('library'), library)
+            if 'files' in meta:
+                yield self.content_request(own, meta['repo_name'], meta['files'])
+                continue
+            meta['library'] = own
+            yield scrapy.Request(url=url, headers=self.search_headers(own), callback=self.parse, meta=meta,
+                                 dont_filter=meta.get('strategy') == 'unpacked')
+
+    repositories = SeenSet()
 
     exclude_pattern = {}
 
+    def mark_seen(self, response, identifier):
+        self.repositories.add(identifier, '%d..%d' % (response.meta['from'], response.meta['to']))
+        if self.checkpoint:
+            self.checkpoint.save_markers(response.meta['library']['library'], identifier, self.repositories.markers(identifier))
+
+    def is_excluded(self, size, splitter):
+        for e in self.exclude_pattern.get(size, {}):
+            if e in splitter:
+                self.logger.info("IGNORE " + splitter + " - " + e)
+                return True
+        return False
+
+    def splitter_covered(self, request):
+        """A waiting splitter probe made unnecessary by an exclusion learned since"""
+        if not self.is_excluded(request.meta['from'], request.meta['splitter']):
+            return False
+        if self.checkpoint:
+            self.checkpoint.mark_done(request.meta['library']['library'], request.url)
+        return True
+
+    def splitter_requests(self, requests):
+        """Probes to send now, the others wait in the scheduler (and are pending in the checkpoint)"""
+        ready = self.scheduler.submit(requests)
+        if self.checkpoint:
+            for request in requests:
+                self.checkpoint.add_pending(request.meta['library']['library'], request.url, request.meta)
+        held = len(requests) - len(ready)
+        if held:
+            self.crawler.stats.inc_value('search_scheduler/splitters_held', held)
+        return ready
+
+    def bounded_splitters(self, probes):
+        """Probes whose term may have results, bound searches for the terms not counted yet"""
+        if not self.term_counts:
+            for request in self.splitter_requests(probes):
+                yield request
+            return
+
+        ready = []
+        for probe in probes:
+            url = bound_url(probe.url)
+            bound = self.term_counts.get(url)
+            if bound is None:
+                if url not in self.bound_waiters:
+                    self.bound_waiters[url] = []
+                    self.crawler.stats.inc_value('splitter_bounds/searched')
+                    yield scrapy.Request(url, callback=self.parse_bound, errback=self.bound_failed,
+                                         priority=probe.priority, meta={'library': probe.meta['library'], 'strategy': 'bound'})
+                self.bound_waiters[url].append(probe)
+                if self.checkpoint:
+                    # Resumed as a plain probe if the crawl stops before the bound is known
+                    self.checkpoint.add_pending(probe.meta['library']['library'], probe.url, probe.meta)
+            elif bound == 0:
+                self.skip_probe(probe)
+            else:
+                self.crawler.stats.inc_value('splitter_bounds/reused')
+                ready.append(probe.replace(priority=min(probe.priority, bound)))
+        for request in self.splitter_requests(ready):
+            yield request
+
+    def skip_probe(self, probe):
+        self.crawler.stats.inc_value('splitter_bounds/skipped')
+        if self.checkpoint:
+            self.checkpoint.mark_done(probe.meta['library']['library'], probe.url)
+
+    def parse_bound(self, response):
+        bound = self.decoder.json(response)['total_count']
+        self.term_counts.put(response.url, bound)
+        ready = []
+        for probe in self.bound_waiters.pop(response.url, []):
+            if bound == 0:
+                self.skip_probe(probe)
+            else:
+                ready.append(probe.replace(priority=min(probe.priority, bound)))
+        for request in self.splitter_requests(ready):
+            yield request
+        if self.checkpoint:
+            self.checkpoint.commit()
+
+    def bound_failed(self, failure):
+        # Probe without a bound then
+        self.logger.warning('Bound search %s failed: %s', failure.request.url, failure.getErrorMessage())
+        return self.splitter_requests(self.bound_waiters.pop(failure.request.url, []))
+
+    def released_splitters(self, is_probe):
+        if is_probe:
+            for request in self.scheduler.done():
+                yield request
+
+    def exclude(self, response, splitter):
+        excluded = self.exclude_pattern.get(response.meta['from'], {})
+        excluded[splitter] = 'excluded'
+        self.exclude_pattern[response.meta['from']] = excluded
+        if self.checkpoint:
+            self.checkpoint.save_excluded(response.meta['library']['library'], response.meta['from'], splitter)
+
+    def histogram_key(self, response):
+        # Size distributions are learned per library and search string
+        return response.meta['library']['library'], re.search('q=%22.*?%22', response.url).group(0)
+
+    def query_key(self, scope, url):
+        return '%s %s' % (scope, re.search('q=%22.*?%22[^&]*', url).group(0))
+
+    def is_root_page(self, response):
+        """First page of a query as yielded by start_requests"""
+        meta = response.meta
+        return meta['page'] == 1 and 'splitter' not in meta and '&o=desc' in response.url and \
+            meta['from'] == self.size_from and meta['to'] == self.size_to
+
+    def collect(self, response, match, hits):
+        """Items for a search result not seen in this run yet, none if there is nothing to emit (yet)"""
+        library = response.meta['library']
+        repo_name = match['repository']['full_name']
+        identifier = None
+        if self.incremental:
+            identifier = result_key(repo_name, match['name'], match['sha'])
+            if self.incremental.known(library['library'], identifier):
+                return []
+
+        if self.fetcher:
+            # Known once its contents are verified (see verified)
+            hits.setdefault(repo_name, []).append(dict(content_hit(match), key=identifier))
+            return []
+
+        names = self.attribute(library, match) if 'members' in library else [library['library']]
+        items = [{
+            'library':      name,
+            'repo_name':    repo_name,
+            'forked':       match['repository']['fork'],
+            'name':         match['name']
+        } for name in names]
+        if self.incremental:
+            self.incremental.add(library['library'], identifier)
+        if self.aggregator:
+            for item in items:
+                self.aggregator.add(item)
+            return []
+        return items
+
+    def attribute(self, group, match):
+        """Libraries of a shared query whose search strings are in the text matches of a result, all if none is"""
+        names = attribute(group['terms'], [text_match.get('fragment', '') for text_match in match.get('text_matches', [])])
+        if not names:
+            self.logger.debug('No search string of %s in the text matches of %s', group['library'], match['path'])
+            self.crawler.stats.inc_value('planner/unattributed')
+            return list(group['members'])
+        return names
+
+    def is_matched(self, library, repo_name):
+        if 'members' in library:
+            return all(self.libraries_by_name[name]['matched'].get(repo_name) for name in library['members'])
+        return library['matched'].get(repo_name)
+
+    def unpacked_requests(self, response):
+        """Searches of the libraries of a shared query on their own"""
+        group = response.meta['library']
+        for name, search_string in group['terms']:
+            library = self.libraries_by_name[name]
+            url = shared_url(self.search_template, [search_string], group['qualifiers'], response.meta['from'], response.meta['to'])
+            meta = {'library': library, 'page': 1, 'from': response.meta['from'], 'to': response.meta['to'], 'per_page': self.per_page,
+                    'strategy': 'unpacked'}
+            # The same string may be searched for another library
+            yield scrapy.Request(url=url, callback=self.parse, meta=meta, dont_filter=True)
+
+    def content_requests(self, library, hits):
+        for repo_name, files in hits.items():
+            if not self.is_matched(library, repo_name):
+                yield self.content_request(library, repo_name, files)
+
+    def page_parsed(self, response, new, duplicates):
+        if hasattr(self, 'crawler'):
+            self.crawler.signals.send_catch_log(signal=search_page_parsed, response=response, new=new, duplicates=duplicates)
+
     def parse(self, response):
+        if response.meta.get('incremental'):
+            return self.checkpointed(response, self.parse_incremental(response))
+        # parse_search moves meta['page'] on before the chain gets to the released probes
+        is_probe = response.meta.get('strategy') == 'query' and response.meta['page'] == 1
+        return self.checkpointed(response, itertools.chain(self.parse_search(response), self.released_splitters(is_probe)))
+
+    def parse_incremental(self, response):
+        """Page through a query crawled before until the high-water mark of the previous run"""
+        page = response.meta['page']
+        library = response.meta['library']
+        query = self.query_key(library['library'], response.url)
+        mark = self.incremental.mark(query)
+        json_response = self.decoder.json(response)
+
+        keys = []
+        hits = {}
+        reached = False
+        new = 0
+        for match in json_response['items']:
+            identifier = result_key(match['repository']['full_name'], match['name'], match['sha'])
+            keys.append(identifier)
+            reached = reached or identifier in mark
+            if self.repositories.markers(identifier) is not None:
+                continue
+            new += 1
+            self.mark_seen(response, identifier)
+            for item in self.collect(response, match, hits):
+                yield item
+        for request in self.content_requests(library, hits):
+            yield request
+        self.page_parsed(response, new, len(keys) - new)
+
+        if page == 1:
+            self.incremental.set_mark(query, keys)
+        self.incremental.commit()
+        self.logger.info("Incremental page %d of %s, high-water mark %s" % (page, query, 'reached' if reached else 'not reached'))
+        if reached or not keys:
+            return
+
+        if page * response.meta['per_page'] < min(json_response['total_count'], self.max_results):
+            meta = dict(response.meta, page=page + 1)
+            yield response.follow(response.url.replace('&page=%d' % page, '&page=%d' % (page + 1)), callback=self.parse, meta=meta,
+                                  headers=self.search_headers(library))
+        else:
+            # More new results than a query returns, crawl it in full
+            self.logger.info("High-water mark of %s beyond the result limit, crawling it in full" % query)
+            meta = dict(response.meta, page=1)
+            del meta['incremental']
+            yield response.follow(response.url.replace('&page=%d' % page, '&page=1'), callback=self.parse, meta=meta, dont_filter=True,
+                                  headers=self.search_headers(library))
+
+    def checkpointed(self, response, results):
+        if not self.checkpoint:
+            for result in results:
+                yield result
+            return
+
+        # Children are pending and this node is done in the same transaction,
+        # so a crash re-parses at most the current page
+        scope = response.meta['library']['library']
+        for result in results:
+            # Bound searches are shared by libraries, their probes are pending instead
+            if isinstance(result, scrapy.Request) and result.meta.get('strategy') != 'bound':
+                self.checkpoint.add_pending(scope, result.url, result.meta)
+            yield result
+        self.checkpoint.mark_done(scope, response.url)
+        self.checkpoint.commit()
+
+    def content_request(self, library, repo_name, files):
+        """Request for the first of the files of a repository, the rest are fetched while nothing matches"""
+        url = self.fetcher.url(repo_name, files[0])
+        return scrapy.Request(url=url, headers=self.fetcher.headers(url), callback=self.parse_contents, errback=self.contents_failed,
+                              priority=self.scheduler.content_priority,
+                              meta={'library': library, 'repo_name': repo_name, 'path': files[0]['path'],
+                                    'verify': self.fetcher.content_format, 'files': files})
+
+    def next_content_request(self, meta):
+        library = meta['library']
+        files = meta['files'][1:]
+        if files and not self.is_matched(library, meta['repo_name']):
+            yield self.content_request(library, meta['repo_name'], files)
+        else:
+            # Matched, the rest of the files need no verification
+            self.verified(meta, files)
+
+    def verified(self, meta, files):
+        """Files of a repository done with, known to the next incremental run"""
+        if not self.incremental:
+            return
+        for hit in files:
+            # Files of checkpoints from before the keys were kept have none
+            if hit.get('key') is not None:
+                self.incremental.add(meta['library']['library'], hit['key'])
+        self.incremental.commit()
+
+    def contents_failed(self, failure):
+        request = failure.request
+        self.logger.warning('Fetching %s failed: %s', request.url, failure.getErrorMessage())
+        response = getattr(failure.value, 'response', None) or scrapy.http.Response(request.url, request=request)
+        return self.checkpointed(response, self.next_content_request(request.meta))
+
+    def parse_search(self, response):
         page = response.meta['page']
         per_page = response.meta['per_page']
         max_pages = int(self.max_results / per_page)
 
-        json_response = json.loads(response.text)
+        json_response = self.decoder.json(response)
 
         # TODO (potentially) incomplete results are ignored for now
         # incomplete = False
@@ -198,6 +710,24 @@ class ToggledReposSpider(scrapy.Spider):
         item_count = 0
         new_repos = 0
 
+        if response.meta.get('strategy') == 'query' and page == 1 and 'parent_total' in response.meta:
+            self.scheduler.observe_splitter(response.meta['splitter'][-1], response.meta['parent_total'], total_count)
+
+        if self.incremental and self.is_root_page(response):
+            self.incremental.set_mark(self.query_key(response.meta['library']['library'], response.url),
+                                      [result_key(match['repository']['full_name'], match['name'], match['sha'])
+                                       for match in json_response['items']])
+
+        if 'members' in response.meta['library'] and page == 1 and total_count > self.max_results:
+            # Too many results to share a query
+            self.logger.info("UNPACK %s: total %d" % (response.meta['library']['library'], total_count))
+            for request in self.unpacked_requests(response):
+                yield request
+            return
+
+        if page == 1 and 'splitter' not in response.meta:
+            self.partitioner.observe(self.histogram_key(response), response.meta['from'], response.meta['to'], total_count)
+
         if response.meta['from'] == response.meta['to'] and page == 1:
             # prevent from running excluded pattern
             for e in self.exclude_pattern.get(response.meta['from'], {}):
@@ -206,15 +736,15 @@ class ToggledReposSpider(scrapy.Spider):
                     return
 
             if total_count <= self.max_results:
-                excluded = self.exclude_pattern.get(response.meta['from'], {})
-                excluded[response.meta.get("splitter", ' ')] = 'excluded'
-                self.exclude_pattern[response.meta['from']] = excluded
+                self.exclude(response, response.meta.get("splitter", ' '))
 
             if total_count == 0:
                 return
 
         if len(json_response['items']) > 0:
             found_duplicate = False
+            # repo_name -> new hits to verify, in search order
+            hits = {}
 
             if total_count <= self.max_results or response.meta['from'] == response.meta['to']:
                 # TODO extract to method
@@ -223,9 +753,9 @@ class ToggledReposSpider(scrapy.Spider):
                     repo_name = match['repository']['full_name']
                     file_name = match['name']
                     sha = match['sha']
-                    identifier = repo_name + '_' + file_name + '_' + sha
-                    marker = self.repositories.get(identifier, {})
-                    if identifier in self.repositories:
+                    identifier = result_key(repo_name, file_name, sha)
+                    marker = self.repositories.markers(identifier)
+                    if marker is not None:
                         if response.meta['from'] < response.meta['to'] and per_page == self.per_page:
                             if ('%d..%d' % (response.meta['from'], response.meta['to'])) in marker:
                                 self.number_duplicates += 1
@@ -239,7 +769,7 @@ class ToggledReposSpider(scrapy.Spider):
                             # new_per_page = 66 # random number
                             # copy['per_page'] = new_per_page
                             # next_page_url = next_page_url.replace('&per_page=%d' % per_page, '&per_page=%d' % new_per_page)
-                            # yield response.follow(next_page_url, headers=self.get_headers(True), callback=self.parse, meta=copy)
+                            # yield response.follow(next_page_url, callback=self.parse, meta=copy)
                             #
                             # copy2 = response.meta.copy()
                             # copy2['page'] += 1
@@ -247,39 +777,43 @@ class ToggledReposSpider(scrapy.Spider):
                             # new_per_page2 = 75  # random number
                             # copy2['per_page'] = new_per_page2
                             # next_page_url2 = next_page_url2.replace('&per_page=%d' % per_page, '&per_page=%d' % new_per_page2)
-                            # yield response.follow(next_page_url2, headers=self.get_headers(True), callback=self.parse, meta=copy2)
+                            # yield response.follow(next_page_url2, callback=self.parse, meta=copy2)
                         continue
 
                     new_repos += 1
                     # if per_page != self.per_page:
                     #     self.logger.info("found new repo %d" % per_page)
 
-                    marker['%d..%d' % (response.meta['from'], response.meta['to'])] = "FOUND"
-                    self.repositories[identifier] = marker
+                    self.mark_seen(response, identifier)
 
-                    response.meta['repo_name'] = repo_name
-                    response.meta['path'] = match['path']
+                    for item in self.collect(response, match, hits):
+                        yield item
 
-                    yield {
-                        'library':      response.meta['library']['library'],
-                        'repo_name':    repo_name,
-                        'forked':       match['repository']['fork'],
-                        'name':         file_name
-                    }
-                    # yield response.follow(url, headers=self.headers, callback=self.parse_contents, meta=response.meta)
+                for request in self.content_requests(response.meta['library'], hits):
+                    yield request
+                if self.incremental:
+                    self.incremental.commit()
 
                 self.logger.info("%d / %d (%d) new repos found on page %d for range %d..%d, collected: %d" % (new_repos, item_count, total_count, page,
                                                                                                     response.meta['from'], response.meta['to'], len(self.repositories)))
+                self.record_seen_stats()
+                self.page_parsed(response, new_repos, item_count - new_repos)
+                share = self.scheduler.new_share(new_repos, item_count)
 
                 # Next page
                 response.meta['page'] += 1
                 if response.meta['page'] <= max_pages and (total_count <= self.max_results or response.meta['from'] == response.meta['to']):
                     next_page_url = response.url.replace('&page=' + str(page), '&page=' + str(response.meta['page']))
-                    yield response.follow(next_page_url, headers=self.get_headers(False), callback=self.parse, meta=response.meta)
+                    yield response.follow(next_page_url, callback=self.parse, meta=response.meta,
+                                          headers=self.search_headers(response.meta['library']),
+                                          priority=self.scheduler.next_page_priority(total_count, page, share))
 
-            if per_page != self.per_page:
+            if per_page != self.per_page or 'members' in response.meta['library']:
                 return
 
+            # Share of new results on this page, what the requests from it can hope for
+            share = self.scheduler.new_share(new_repos, item_count)
+
             if 'stop' not in response.meta and (total_count > self.max_results or found_duplicate):
                 if item_count == 0 and response.meta['page'] == 1 and total_count < self.max_results:
                     return
@@ -295,18 +829,16 @@ class ToggledReposSpider(scrapy.Spider):
                         old_from = response.meta['from']
                         old_to = response.meta['to']
 
-                        size_to = int(old_from + (old_to - old_from) / 2)
-                        next_page_url = response.url.replace('&page=' + str(page), '&page=1')
-                        next_page_url = next_page_url.replace('+size:' + str(old_from) + ".." + str(old_to), '+size:' + str(old_from) + ".." + str(size_to))
-                        copy1 = response.meta.copy()
-                        copy1['to'] = size_to
-                        yield response.follow(next_page_url, headers=self.get_headers(True), callback=self.parse, meta=copy1)
-
-                        next_page_url2 = response.url.replace('&page=' + str(page), '&page=1')
-                        next_page_url2 = next_page_url2.replace('+size:' + str(old_from) + ".." + str(old_to), '+size:' + str(size_to + 1) + ".." + str(old_to))
-                        copy2 = response.meta.copy()
-                        copy2['from'] = size_to + 1
-                        yield response.follow(next_page_url2, headers=self.get_headers(True), callback=self.parse, meta=copy2)
+                        page_url = response.url.replace('&page=' + str(page), '&page=1')
+                        for size_from, size_to in self.partitioner.split(self.histogram_key(response), old_from, old_to, total_count):
+                            next_page_url = page_url.replace('+size:' + str(old_from) + ".." + str(old_to), '+size:' + str(size_from) + ".." + str(size_to))
+                            copy = response.meta.copy()
+                            copy['from'] = size_from
+                            copy['to'] = size_to
+                            copy['strategy'] = 'size'
+                            estimate = self.partitioner.estimate(self.histogram_key(response), size_from, size_to)
+                            yield response.follow(next_page_url, callback=self.parse, meta=copy,
+                                                  priority=self.scheduler.size_split_priority(estimate, share))
                 else:
                     # split even further if the files are of the same size
                     if page > 1:
@@ -318,27 +850,23 @@ class ToggledReposSpider(scrapy.Spider):
                         copy = response.meta.copy()
                         copy['stop'] = 'stop'
                         copy['page'] = 1
+                        copy['strategy'] = 'order'
                         new_page_url = page_url.replace("&s=indexed&o=desc", "&s=indexed&o=asc")
-                        yield response.follow(new_page_url, headers=self.get_headers(True), callback=self.parse, meta=copy)
-                        # yield response.follow(page_url + new_page_url, headers=self.get_headers(True), callback=self.parse, meta=copy.copy())
+                        yield response.follow(new_page_url, callback=self.parse, meta=copy,
+                                              priority=self.scheduler.order_flip_priority(total_count, share))
+                        # yield response.follow(page_url + new_page_url, callback=self.parse, meta=copy.copy())
                     else:
                         self.logger.info("SPLIT (query): total %d" % total_count)
 
                         splitter = response.meta.get("splitter", '')
-                        excluded = self.exclude_pattern.get(response.meta['from'], {})
                         if len(splitter) <= 3:
+                            probes = []
                             for char in string.ascii_lowercase + string.digits:
                                 match = re.search('q=%22.*%22', page_url)
                                 found_str = match.group(0)
                                 new_splitter = splitter + str(char)
 
-                                exclude_new_splitter = False
-                                for e in excluded:
-                                    if e in new_splitter:
-                                        self.logger.info("IGNORE " + new_splitter + " - " + e)
-                                        exclude_new_splitter = True
-                                        break
-                                if exclude_new_splitter:
+                                if self.is_excluded(response.meta['from'], new_splitter):
                                     continue
 
                                 old_query = found_str
@@ -350,77 +878,51 @@ class ToggledReposSpider(scrapy.Spider):
                                 copy = response.meta.copy()
                                 copy["splitter"] = new_splitter
                                 copy['page'] = 1
+                                copy['strategy'] = 'query'
+                                copy['parent_total'] = total_count
                                 self.logger.info(next_page_url)
-                                yield response.follow(next_page_url, headers=self.get_headers(True), callback=self.parse, meta=copy)
+                                probes.append(response.follow(next_page_url, callback=self.parse, meta=copy,
+                                                              priority=self.scheduler.splitter_priority(char, total_count, share)))
+                            for request in self.bounded_splitters(probes):
+                                yield request
 
     def parse_contents(self, response):
-        matched = response.meta['library']['matched']
+        return self.checkpointed(response, self.verify_contents(response))
+
+    def verify_contents(self, response):
         repo_name = response.meta['repo_name']
-        if matched.get(repo_name):
+        if self.is_matched(response.meta['library'], repo_name):
+            self.verified(response.meta, response.meta['files'])
             return
 
-        library = response.meta['library']
         path = response.meta['path']
-        json_response = json.loads(response.text)
-        content = base64.b64decode(json_response['content'])
-        languages = [lang.lower() for lang in library['languages'].split(',')]
-
-        artifacts = [artifact.split(',')[0] for artifact in library['artifacts']]
-        # import_or_usage fallbacks into artifact_names
-        imports = library['imports_usages'] if len(library['imports_usages']) > 0 else artifacts
-        placeholders_pairs = [(artifact, import_usage) for artifact in artifacts for import_usage in imports]
-        placeholders_set = [{
-            'artifact_name': re.escape(artifact),
-            'import_or_usage': re.escape(import_usage),
-        } for artifact, import_usage in placeholders_pairs]
-
-        templates = [templates for lang, templates in self.regexp_templates_by_lang.items() if lang in languages][0]
-        searches_memo = dict()
-
-        self.logger.debug('Placeholders %s', str(placeholders_set))
-        for placeholders in placeholders_set:
-            if matched.get(repo_name):
-                break
-
-            for template in templates:
-                if matched.get(repo_name):
-                    break
-
-                content_template_regexp = template
-                flags = 0
-                path_regexp = ''
-                augment_placeholders_fn = None
-
-                if type(template) is list:
-                    length = len(template)
-                    content_template_regexp = template[0]
-                    flags = template[1] if length > 1 and template[1] else 0
-                    path_regexp = template[2] if length > 2 else ''
-                    augment_placeholders_fn = template[3] if length > 3 else None
-
-                    if path_regexp and not re.search(path_regexp, path, re.MULTILINE):
-                        continue
-
-                    if augment_placeholders_fn:
-                        placeholders = augment_placeholders_fn(placeholders)
-
-                template = Template(content_template_regexp)
-                regexp = r'' + template.substitute(placeholders)
-
-                if searches_memo.get(regexp):
-                    continue
-
-                searches_memo[regexp] = True
-
-                self.logger.debug('RE Searching %s in %s', regexp, path)
-                # Some files will arrive as non utf-8 (specially txt files), lets ignore,
-                # the output seems to be ok for our purposes
-                if re.search(regexp, str(content, encoding='utf-8', errors='ignore'), flags):
-                    matched[repo_name] = True
-                    self.logger.info('Matched %s in %s', library['library'], repo_name)
-                    toggled_repo = { key: None for key in self.csv_fieldnames }
-                    toggled_repo['repo_name'] = repo_name
-                    toggled_repo['path'] = path
-                    toggled_repo['library'] = library['library']
-                    toggled_repo['library_language'] = library['languages']
-                    yield toggled_repo
+        # Already verified in the process pool by ContentVerificationMiddleware
+        verification = response.meta.get('verification')
+        if verification is None:
+            # The file is scanned once for all libraries, not only the one searched for
+            text = content_text(response.body, response.meta.get('verify', 'contents'))
+            verification = match_libraries(self.matchers, self.scanner, path, text, budget=self.match_budget)
+
+        matches, budget_exceeded = verification
+        if budget_exceeded:
+            self.logger.warning('Matching %s in %s exceeded %ss, skipped the remaining patterns', path, repo_name, self.match_budget)
+            self.crawler.stats.inc_value('matcher/budget_exceeded')
+
+        for name, pattern in matches:
+            library = self.libraries_by_name[name]
+            if library['matched'].get(repo_name):
+                continue
+
+            self.logger.debug('RE Matched %s in %s', pattern, path)
+            library['matched'][repo_name] = True
+            self.logger.info('Matched %s in %s', library['library'], repo_name)
+            toggled_repo = { key: None for key in self.csv_fieldnames }
+            toggled_repo['repo_name'] = repo_name
+            toggled_repo['path'] = path
+            toggled_repo['library'] = library['library']
+            toggled_repo['library_language'] = library['languages']
+            yield toggled_repo
+
+        self.verified(response.meta, response.meta['files'][:1])
+        for request in self.next_content_request(response.meta):
+            yield request
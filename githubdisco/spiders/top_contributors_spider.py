@@ -1,9 +1,12 @@
 import scrapy
-import os
-import json
-import csv
 import re
-from copy import copy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+from githubdisco import github, graphql
+from githubdisco.decoding import ResponseDecoder
+from githubdisco.feeder import InputFeeder, read_csv, unique
+from githubdisco.repostore import RepoStore, stored_request
 
 # Extract contributors data via GitHub v3 API from a given list of libraries
 #
@@ -11,46 +14,96 @@ from copy import copy
 # it is used instead and 'repo_name' is computed from every newline in the entry as a GitHub repository url.
 #
 # Usage:
-# $ AUTH_TOKEN=... scrapy crawl top_contributors -a repos_filename=libraries.csv -o contributors.csv
+# $ Github_1=... scrapy crawl top_contributors -a repos_filename=libraries.csv -o contributors.csv
+#
+# The libraries csv is read as the crawl goes, with at most max_in_flight (-a
+# max_in_flight=...) repositories being looked at any time.
+#
+# The email of every top contributor comes from the latest commit of that
+# login. By default (-a emails=author) that is one commits?author=login
+# request per contributor. With -a emails=scan the latest 100 commits of the
+# repository are listed in one request instead, and with -a emails=graphql
+# they come from a GraphQL query for batch_size (default 50) repositories.
+# Commits are matched to logins locally, only contributors without a commit
+# among them are still looked up by author.
+#
+# With -a repo_store=repos.sqlite the contributors of repositories looked at
+# in the last week, for any library, come from the store (see
+# githubdisco/repostore.py).
 
 class TopContributorsSpider(scrapy.Spider):
     name = "top_contributors"
-    headers = {
-        'Authorization': 'Bearer ' + os.environ['Github_1'],
-    }
 
     TOP_CONTRIBUTORS = 5
+    max_in_flight = 500
+
+    # Columns of the items, in csv order (see githubdisco/pipelines.py)
+    item_schema = [('library', 'string'), ('repo_name', 'string'), ('login', 'string'), ('name', 'string'), ('email', 'string')]
+    custom_settings = {'FEED_EXPORT_FIELDS': [field for field, _ in item_schema]}
+
+    # Commits scanned for the emails of the top contributors with emails=scan or graphql
+    scanned_commits = 100
+
+    # JSON decoding backend, None for the fastest installed (see githubdisco/decoding.py)
+    json_backend = None
+
+    def __init__(self, max_in_flight=None, json_backend=None, emails='author', batch_size=graphql.BATCH_SIZE, repo_store=None,
+                 *args, **kwargs):
+        super(TopContributorsSpider, self).__init__(*args, **kwargs)
+        self.decoder = ResponseDecoder(json_backend or self.json_backend)
+        if max_in_flight:
+            self.max_in_flight = int(max_in_flight)
+        if emails not in ('author', 'scan', 'graphql'):
+            raise ValueError('Unknown emails %r, expected author, scan or graphql' % emails)
+        self.emails = emails
+        self.batch_size = min(int(batch_size), 100)
+        self.repo_store = RepoStore(repo_store) if repo_store else None
+        # Row id -> state of the repository: its library and repo_name, the
+        # responses it still waits for, its top contributors and scanned
+        # commits once known, the items emitted and whether any request
+        # failed. Requests only carry the row id (and login).
+        self.rows = {}
+        self.row_ids = 0
+
+    def closed(self, reason):
+        if self.repo_store:
+            self.repo_store.close()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(TopContributorsSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
 
     def load_libraries(self):
-        csv_filename = self.repos_filename
-        with open(csv_filename, 'r') as csv_file:
-            reader = csv.DictReader(csv_file)
-            libraries = []
-            for row in reader:
-                library_name = row['library']
-                repositories = row.get('Repositories')
-
-                if repositories:
-                    for repository_urls in repositories.strip().splitlines():
-                        libraries.append({
-                            'library': library_name,
-                            'repo_name': repository_urls.replace('https://github.com/', '').lower(),
-                        })
-                else:
-                    libraries.append({
-                        'library': library_name,
-                        'repo_name': row['repo_name']
-                    })
+        # toggled_repos has a row per hit, a library and repository is looked at once (see githubdisco/feeder.py)
+        return unique(self.read_libraries(), lambda library: (library['library'], library['repo_name']))
 
-        return libraries
+    def read_libraries(self):
+        for row in read_csv(self.repos_filename):
+            library_name = row['library']
+            repositories = row.get('Repositories')
+
+            if repositories:
+                for repository_urls in repositories.strip().splitlines():
+                    yield {
+                        'library': library_name,
+                        'repo_name': repository_urls.replace('https://github.com/', '').lower(),
+                    }
+            else:
+                yield {
+                    'library': library_name,
+                    'repo_name': row['repo_name']
+                }
 
     def get_contributors_url(self, meta):
-        return ('https://api.github.com/repos/{repo_name}/contributors?page=1&per_page=' + str(self.TOP_CONTRIBUTORS)).format_map(meta)
+        return (github.API_URL + '/repos/{repo_name}/contributors?page=1&per_page=' + str(self.TOP_CONTRIBUTORS)).format_map(meta)
 
     def get_commits_list_url(self, meta):
-        new_meta = copy(meta)
-        new_meta['author'] = meta['login']
-        return ('https://api.github.com/repos/{repo_name}/commits?author={author}&page=1&per_page=1').format_map(new_meta)
+        return (github.API_URL + '/repos/{repo_name}/commits?author={login}&page=1&per_page=1').format_map(meta)
+
+    def get_commits_scan_url(self, meta):
+        return (github.API_URL + '/repos/{repo_name}/commits?per_page=' + str(self.scanned_commits)).format_map(meta)
 
     # Contributors we don't care to get emails from:
     # * username@users.noreply.github.com (https://help.github.com/articles/about-commit-email-addresses/)
@@ -62,20 +115,188 @@ class TopContributorsSpider(scrapy.Spider):
                 contributor['email'] != 'noreply@github.com'
 
     def start_requests(self):
-        libraries = self.load_libraries()
+        batch_size = self.batch_size if self.emails == 'graphql' else 1
+        self.feeder = InputFeeder(self.load_libraries(), self.contributors_requests, self.max_in_flight, batch_size)
+        yield from self.feeder.feed()
+
+    def spider_idle(self):
+        self.rows.clear()
+        requests, lost = self.feeder.idle()
+        if lost:
+            self.logger.warning('Giving up on %d incomplete repositories', lost)
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests:
+            raise DontCloseSpider
+
+    def contributors_requests(self, libraries):
+        requests = []
+        rows = []
+        # Contributors of the rows found in the store and their number
+        stored = []
+        stored_rows = 0
         for library in libraries:
-            yield scrapy.Request(self.get_contributors_url(library), headers=self.headers, callback=self.parse_contributors, meta=library)
+            record = self.repo_store.get(library['repo_name'], 'contributors') if self.repo_store else None
+            if record is not None:
+                stored.extend(dict({'library': library['library']}, **contributor) for contributor in record)
+                stored_rows += 1
+                continue
+            self.row_ids += 1
+            row = self.row_ids
+            rows.append(row)
+            self.rows[row] = {
+                'library': library['library'],
+                'repo_name': library['repo_name'],
+                # The contributors, and the commits scan unless looked up by author
+                'pending': 1 if self.emails == 'author' else 2,
+                'contributors': None,
+                'commits': None,
+                'items': [],
+                'failed': False,
+            }
+            # The same repository may come again for another library, a filtered
+            # duplicate would never answer and leave its row waiting
+            requests.append(scrapy.Request(self.get_contributors_url(library), callback=self.parse_contributors,
+                                           errback=self.contributors_failed, meta={'row': row}, dont_filter=True))
+            if self.emails == 'scan':
+                requests.append(scrapy.Request(self.get_commits_scan_url(library), callback=self.parse_scan,
+                                               errback=self.scan_failed, meta={'row': row}, dont_filter=True))
+        if self.emails == 'graphql':
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                query = graphql.author_histories_query([self.rows[row]['repo_name'] for row in batch], self.scanned_commits)
+                requests.append(scrapy.Request(graphql.graphql_url(), method='POST', body=graphql.request_body(query),
+                                               headers={'Content-Type': 'application/json'}, callback=self.parse_histories,
+                                               errback=self.histories_failed, meta={'rows': batch}))
+        if stored_rows:
+            self.crawler.stats.inc_value('repo_store/hits', stored_rows)
+            self.crawler.stats.inc_value('repo_store/local_requests')
+            requests.append(stored_request(self.parse_stored, {'items': stored, 'count': stored_rows}))
+        return requests
+
+    def parse_stored(self, response):
+        yield from response.meta['items']
+        yield from self.feeder.done(response.meta['count'])
+
+    def response_done(self, row):
+        """One response less to wait for, the next rows once the repository is complete"""
+        state = self.rows.get(row)
+        if state is None:
+            return []
+        state['pending'] -= 1
+        if state['pending'] > 0:
+            return []
+        del self.rows[row]
+        if self.repo_store and not state['failed']:
+            self.repo_store.put(state['repo_name'], 'contributors',
+                                [{key: value for key, value in item.items() if key != 'library'} for item in state['items']])
+        return self.feeder.done()
+
+    def contributors_failed(self, failure):
+        row = failure.request.meta['row']
+        if row in self.rows:
+            self.rows[row]['contributors'] = []
+            # A repository that's gone has no contributors, anything else may have some
+            response = getattr(failure.value, 'response', None)
+            self.rows[row]['failed'] = response is None or response.status != 404
+        return self.response_done(row)
+
+    def commits_failed(self, failure):
+        row = failure.request.meta['row']
+        if row in self.rows:
+            self.rows[row]['failed'] = True
+        return self.response_done(row)
+
+    def emit(self, state, login, commits):
+        items = self.contributors_of(dict(state, login=login), commits)
+        state['items'].extend(items)
+        return items
 
     def parse_contributors(self, response):
-        meta = response.meta
-        contributors = json.loads(response.text)
-        for contributor in contributors:
-            meta['login'] = contributor['login']
-            yield scrapy.Request(self.get_commits_list_url(meta), headers=self.headers, callback=self.parse_commits, meta=meta)
+        row = response.meta['row']
+        state = self.rows.get(row)
+        if state is None:
+            return
+        # None for the 204 of an empty repository
+        contributors = self.decoder.json(response) or []
+        state['contributors'] = [contributor['login'] for contributor in contributors if contributor.get('login')]
+        if self.emails == 'author':
+            yield from self.author_requests(row, state['contributors'])
+        else:
+            yield from self.resolve(row)
+        yield from self.response_done(row)
+
+    def parse_scan(self, response):
+        row = response.meta['row']
+        if row in self.rows:
+            self.rows[row]['commits'] = self.decoder.json(response) or []
+            yield from self.resolve(row)
+        yield from self.response_done(row)
+
+    def scan_failed(self, failure):
+        # e.g. 409 for an empty repository, every contributor is looked up by author
+        row = failure.request.meta['row']
+        if row in self.rows:
+            self.rows[row]['commits'] = []
+        return list(self.resolve(row)) + self.response_done(row)
+
+    def parse_histories(self, response):
+        rows = response.meta['rows']
+        repositories, errors = graphql.results(self.decoder.json(response), len(rows))
+        for error in errors:
+            self.logger.warning('GraphQL error: %s', error.get('message'))
+        for row, repository in zip(rows, repositories):
+            if row in self.rows:
+                self.rows[row]['commits'] = graphql.history_commits(repository)
+                yield from self.resolve(row)
+            yield from self.response_done(row)
+
+    def histories_failed(self, failure):
+        results = []
+        for row in failure.request.meta['rows']:
+            if row in self.rows:
+                self.rows[row]['commits'] = []
+                results.extend(self.resolve(row))
+            results.extend(self.response_done(row))
+        return results
+
+    def resolve(self, row):
+        """Contributors of a repository from its scanned commits, by author for those not among them"""
+        state = self.rows.get(row)
+        if state is None or state['contributors'] is None or state['commits'] is None:
+            return
+
+        latest = {}
+        for commit_entry in state['commits']:
+            login = (commit_entry.get('author') or {}).get('login')
+            if login and login not in latest:
+                latest[login] = commit_entry
+
+        unresolved = []
+        for login in state['contributors']:
+            if login in latest:
+                self.crawler.stats.inc_value('top_contributors/resolved_locally')
+                yield from self.emit(state, login, [latest[login]])
+            else:
+                unresolved.append(login)
+        yield from self.author_requests(row, unresolved)
+
+    def author_requests(self, row, logins):
+        state = self.rows[row]
+        state['pending'] += len(logins)
+        for login in logins:
+            meta = {'row': row, 'login': login}
+            yield scrapy.Request(self.get_commits_list_url(dict(state, login=login)), callback=self.parse_commits,
+                                 errback=self.commits_failed, meta=meta, dont_filter=True)
 
     def parse_commits(self, response):
-        meta = response.meta
-        commits = json.loads(response.text)
+        row = response.meta['row']
+        state = self.rows.get(row)
+        if state is not None:
+            yield from self.emit(state, response.meta['login'], self.decoder.json(response) or [])
+        yield from self.response_done(row)
+
+    def contributors_of(self, meta, commits):
         contributors = []
         for commit_entry in commits:
             commit = commit_entry['commit']
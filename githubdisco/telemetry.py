@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+# Crawl telemetry: where do the requests (and the quota) go
+#
+# CrawlTelemetry is an extension counting, per library and split strategy
+# (meta['strategy']: root, size, order, query, unpacked, contents):
+#
+# * requests by response status, 403s and 429s included, and their latency
+# * retries, by RetryMiddleware or after a rate limit (GithubTokenPoolMiddleware)
+# * seconds spent parked waiting for a token
+# * new and duplicate search results, reported by the spider through the
+#   search_page_parsed signal
+#
+# The metrics are served in the Prometheus text format on
+# http://127.0.0.1:TELEMETRY_PORT/metrics while crawling, and written as
+# JSON to TELEMETRY_SUMMARY once the spider closes.
+
+import json
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+# Sent by spiders once a page of search results is parsed, with the
+# response and the number of new and duplicate results on it
+search_page_parsed = object()
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_HELP = {
+    'githubdisco_requests_total': 'Downloaded responses by status',
+    'githubdisco_retries_total': 'Requests retried, by RetryMiddleware or after a rate limit',
+    'githubdisco_token_wait_seconds_total': 'Seconds requests waited for a token',
+    'githubdisco_results_total': 'Search results by kind (new or duplicate)',
+    'githubdisco_request_latency_seconds': 'Download latency',
+}
+
+
+def request_labels(request):
+    meta = request.meta
+    library = meta.get('library')
+    if isinstance(library, dict):
+        library = library.get('library')
+    strategy = meta.get('strategy') or ('contents' if 'verify' in meta else 'root')
+    return library or '', strategy
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def as_dict(self):
+        return {'buckets': dict(zip(map(str, self.buckets), self.counts)), 'count': self.count, 'sum': self.sum}
+
+
+class CrawlTelemetry(object):
+
+    def __init__(self, port, summary):
+        self.port = port
+        self.summary = summary
+        self.listener = None
+        # metric name -> {labels (sorted tuple of pairs) -> value}
+        self.counters = {}
+        self.histograms = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('TELEMETRY_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler.settings.getint('TELEMETRY_PORT'), crawler.settings.get('TELEMETRY_SUMMARY'))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(ext.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.search_page_parsed, signal=search_page_parsed)
+        return ext
+
+    def inc(self, name, labels, value=1):
+        values = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        values[key] = values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        values = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        if key not in values:
+            values[key] = Histogram()
+        values[key].observe(value)
+
+    def request_scheduled(self, request, spider):
+        # Retries copy the meta of the failed request, children of a
+        # retried request inherit the counts already reported
+        meta = request.meta
+        retries = meta.get('retry_times', 0) + meta.get('rate_limit_retries', 0)
+        if retries > meta.get('telemetry_retries', 0):
+            library, strategy = request_labels(request)
+            self.inc('githubdisco_retries_total', {'library': library, 'strategy': strategy},
+                     retries - meta.get('telemetry_retries', 0))
+            meta['telemetry_retries'] = retries
+
+    def response_downloaded(self, response, request, spider):
+        library, strategy = request_labels(request)
+        self.inc('githubdisco_requests_total', {'library': library, 'strategy': strategy, 'status': str(response.status)})
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.observe('githubdisco_request_latency_seconds', {'library': library, 'strategy': strategy}, latency)
+
+    def response_received(self, response, request, spider):
+        meta = request.meta
+        wait = meta.get('token_wait', 0) - meta.get('telemetry_token_wait', 0)
+        if wait > 0:
+            library, strategy = request_labels(request)
+            self.inc('githubdisco_token_wait_seconds_total', {'library': library, 'strategy': strategy}, wait)
+            meta['telemetry_token_wait'] = meta['token_wait']
+
+    def search_page_parsed(self, response, new, duplicates):
+        library, strategy = request_labels(response.request)
+        self.inc('githubdisco_results_total', {'library': library, 'strategy': strategy, 'kind': 'new'}, new)
+        self.inc('githubdisco_results_total', {'library': library, 'strategy': strategy, 'kind': 'duplicate'}, duplicates)
+
+    def prometheus(self):
+        lines = []
+        for name, values in sorted(self.counters.items()):
+            lines.append('# HELP %s %s' % (name, METRIC_HELP[name]))
+            lines.append('# TYPE %s counter' % name)
+            for labels, value in sorted(values.items()):
+                lines.append('%s{%s} %s' % (name, self.format_labels(labels), value))
+        for name, values in sorted(self.histograms.items()):
+            lines.append('# HELP %s %s' % (name, METRIC_HELP[name]))
+            lines.append('# TYPE %s histogram' % name)
+            for labels, histogram in sorted(values.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append('%s_bucket{%s} %d' % (name, self.format_labels(labels + (('le', str(bound)),)), count))
+                lines.append('%s_bucket{%s} %d' % (name, self.format_labels(labels + (('le', '+Inf'),)), histogram.count))
+                lines.append('%s_sum{%s} %s' % (name, self.format_labels(labels), histogram.sum))
+                lines.append('%s_count{%s} %d' % (name, self.format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def format_labels(self, labels):
+        return ','.join('%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+
+    def as_dict(self):
+        metrics = {}
+        for name, values in self.counters.items():
+            metrics[name] = [dict(labels, value=value) for labels, value in sorted(values.items())]
+        for name, values in self.histograms.items():
+            metrics[name] = [dict(labels, **histogram.as_dict()) for labels, histogram in sorted(values.items())]
+        return metrics
+
+    def spider_opened(self, spider):
+        if self.port:
+            root = resource.Resource()
+            root.putChild(b'metrics', MetricsResource(self))
+            self.listener = reactor.listenTCP(self.port, server.Site(root), interface='127.0.0.1')
+            spider.logger.info('Telemetry on http://127.0.0.1:%d/metrics' % self.listener.getHost().port)
+
+    def spider_closed(self, spider):
+        if self.summary:
+            path = self.summary % {'name': spider.name}
+            with open(path, 'w') as summary_file:
+                json.dump(self.as_dict(), summary_file, indent=2, sort_keys=True)
+            spider.logger.info('Telemetry summary written to %s' % path)
+        if self.listener:
+            return self.listener.stopListening()
+
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, telemetry):
+        resource.Resource.__init__(self)
+        self.telemetry = telemetry
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4')
+        return self.telemetry.prometheus().encode('utf-8')
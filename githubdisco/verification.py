@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+# Content verification in a pool of worker processes
+#
+# Decoding a downloaded file and running the library regexps over it is CPU
+# bound and can take seconds on big pathological files, which would stall
+# the Twisted reactor and every request in flight. A VerificationPool runs
+# it in worker processes that build their own matchers once at start, and
+# hands the results back to the reactor as Deferreds.
+#
+# The match budget is only checked between patterns and segments (see
+# githubdisco/matcher.py), a single backtracking search can still run on for
+# ever. A file a worker hasn't verified within the timeout of the pool is
+# given up on as if it had exceeded the budget, the worker is killed and the
+# next file gets a new one.
+
+import base64
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from twisted.internet import defer, reactor
+
+from githubdisco import decoding
+from githubdisco.matcher import LibraryMatcher, MatchBudgetExceeded, decode_content
+from githubdisco.scanner import LibraryScanner
+
+# Matchers, scanner and time budget of a worker process, set by init_worker
+_matchers = None
+_scanner = None
+_budget = None
+
+
+def build_matchers(libraries, backend='re'):
+    """libraries is a list of (library, templates) pairs"""
+    matchers = {library['library']: LibraryMatcher(library, templates, backend) for library, templates in libraries}
+    return matchers, LibraryScanner(matchers)
+
+
+def init_worker(libraries, backend, budget):
+    global _matchers, _scanner, _budget
+    _matchers, _scanner = build_matchers(libraries, backend)
+    _budget = budget
+
+
+def content_text(body, content_format):
+    if content_format == 'contents':
+        # Contents API: JSON with the file base64 encoded
+        return decode_content(base64.b64decode(decoding.loads(body)['content']))
+    return decode_content(body)
+
+
+def match_libraries(matchers, scanner, path, text, skip=(), budget=None):
+    """Return ([(library name, matched regexp)], budget exceeded)
+
+    budget is the number of seconds matching the file may take, the
+    libraries matched before it ran out are still returned.
+    """
+    deadline = time.monotonic() + budget if budget else None
+    matches = []
+    try:
+        for name in scanner.candidates(text):
+            if name in skip:
+                continue
+            pattern = matchers[name].search(path, text, deadline)
+            if pattern:
+                matches.append((name, pattern.pattern))
+    except MatchBudgetExceeded:
+        return matches, True
+    return matches, False
+
+
+def verify(path, body, content_format, skip=()):
+    return match_libraries(_matchers, _scanner, path, content_text(body, content_format), skip, _budget)
+
+
+def worker_main(connection, libraries, backend, budget):
+    """Verify the files sent over connection until None comes"""
+    init_worker(libraries, backend, budget)
+    connection.send(None)
+    while True:
+        task = connection.recv()
+        if task is None:
+            return
+        try:
+            connection.send((True, verify(*task)))
+        except Exception as e:
+            connection.send((False, '%s: %s' % (type(e).__name__, e)))
+
+
+class VerificationError(Exception):
+    pass
+
+
+class VerificationWorker(object):
+    """A worker process and its end of the pipe, used by a single thread"""
+
+    def __init__(self, context, initargs):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child,) + initargs, daemon=True)
+        self.process.start()
+        child.close()
+        # Building the matchers doesn't count against the timeout
+        self.connection.recv()
+
+    def call(self, task, timeout=None):
+        """Result of verify(*task), None once it took more than timeout seconds"""
+        self.connection.send(task)
+        if timeout and not self.connection.poll(timeout):
+            return None
+        ok, result = self.connection.recv()
+        if not ok:
+            raise VerificationError(result)
+        return result
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+            self.process.join(1)
+        except (OSError, ValueError):
+            pass
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class VerificationPool(object):
+    """Bounded pool, at most max_pending files downloading or being verified"""
+
+    def __init__(self, libraries, processes, max_pending, backend='re', budget=None, timeout=None):
+        # A thread per worker process waits for its results
+        self.executor = ThreadPoolExecutor(processes)
+        # spawn, forking a process with a running reactor is asking for trouble
+        self.context = multiprocessing.get_context('spawn')
+        self.initargs = (libraries, backend, budget)
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.workers = []
+        # Files given up on after timeout seconds
+        self.timeouts = 0
+        self.max_pending = max_pending
+        self.pending = 0
+        self.waiting = []
+
+    def acquire(self):
+        """Take a slot, returns None or a Deferred firing once a slot is handed over"""
+        if self.pending < self.max_pending:
+            self.pending += 1
+            return None
+        d = defer.Deferred()
+        self.waiting.append(d)
+        return d
+
+    def release(self):
+        if self.waiting:
+            # The slot goes straight to the next waiter
+            self.waiting.pop(0).callback(None)
+        else:
+            self.pending -= 1
+
+    def submit(self, path, body, content_format, skip=()):
+        """Verify the file in a worker, the slot is released once done"""
+        d = defer.Deferred()
+        future = self.executor.submit(self.run, (path, body, content_format, tuple(skip)))
+        future.add_done_callback(lambda f: reactor.callFromThread(self.done, f, d))
+        return d
+
+    def run(self, task):
+        """verify(*task) in the worker of the calling thread, ([], True) once it timed out"""
+        worker = getattr(self.local, 'worker', None)
+        if worker is None:
+            worker = self.local.worker = VerificationWorker(self.context, self.initargs)
+            with self.lock:
+                self.workers.append(worker)
+        result = worker.call(task, self.timeout)
+        if result is None:
+            self.local.worker = None
+            with self.lock:
+                self.workers.remove(worker)
+                self.timeouts += 1
+            worker.kill()
+            return [], True
+        return result
+
+    def done(self, future, d):
+        self.release()
+        error = future.exception()
+        if error is not None:
+            d.errback(error)
+        else:
+            d.callback(future.result())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
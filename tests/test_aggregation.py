@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+from githubdisco.aggregation import RepoAggregator
+
+
+def hit(repo_name, name, library='paypal', forked=False):
+    return {'library': library, 'repo_name': repo_name, 'forked': forked, 'name': name}
+
+
+def by_repo(records):
+    return sorted(records, key=lambda record: (record['library'], record['repo_name']))
+
+
+@pytest.fixture(params=['memory', 'db'])
+def aggregator(request, tmp_path):
+    if request.param == 'memory':
+        return RepoAggregator()
+    return RepoAggregator(sqlite3.connect(str(tmp_path / 'state.sqlite')))
+
+
+def test_a_record_per_library_and_repository(aggregator):
+    aggregator.add(hit('a/b', 'checkout.md'))
+    aggregator.add(hit('a/b', 'README.md'))
+    aggregator.add(hit('a/b', 'README.md'))
+    aggregator.add(hit('a/b', 'pay.md', library='braintree'))
+    aggregator.add(hit('c/d', 'pay.md', forked=True))
+
+    assert by_repo(aggregator.records()) == [
+        {'library': 'braintree', 'repo_name': 'a/b', 'forked': False, 'hits': 1, 'names': ['pay.md']},
+        {'library': 'paypal', 'repo_name': 'a/b', 'forked': False, 'hits': 3, 'names': ['README.md', 'checkout.md']},
+        {'library': 'paypal', 'repo_name': 'c/d', 'forked': True, 'hits': 1, 'names': ['pay.md']},
+    ]
+
+
+def test_records_are_forgotten_once_returned(aggregator):
+    aggregator.add(hit('a/b', 'README.md'))
+    aggregator.records()
+
+    aggregator.add(hit('a/b', 'pay.md'))
+
+    assert aggregator.records() == [
+        {'library': 'paypal', 'repo_name': 'a/b', 'forked': False, 'hits': 1, 'names': ['pay.md']},
+    ]
+    assert aggregator.records() == []
+
+
+def test_committed_records_outlive_the_run(tmp_path):
+    path = str(tmp_path / 'state.sqlite')
+    db = sqlite3.connect(path)
+    aggregator = RepoAggregator(db)
+    aggregator.add(hit('a/b', 'README.md'))
+    db.commit()
+    aggregator.add(hit('a/b', 'uncommitted.md'))
+    db.close()
+
+    resumed = RepoAggregator(sqlite3.connect(path))
+    resumed.add(hit('a/b', 'pay.md'))
+
+    assert resumed.records() == [
+        {'library': 'paypal', 'repo_name': 'a/b', 'forked': False, 'hits': 2, 'names': ['README.md', 'pay.md']},
+    ]
@@ -0,0 +1,68 @@
+import json
+
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from githubdisco import graphql
+from githubdisco.feeder import InputFeeder
+from githubdisco.spiders.augment_toggled_repos_spider import AugmentToggledReposSpider
+
+
+def graphql_spider(repo_names):
+    crawler = get_crawler(AugmentToggledReposSpider)
+    spider = AugmentToggledReposSpider.from_crawler(crawler, api='graphql', contributors='none')
+    crawler.stats.open_spider(spider)
+    spider.feeder = InputFeeder([], spider.augment_requests, spider.max_in_flight)
+    spider.feeder.in_flight = len(repo_names)
+    for repo_name in repo_names:
+        spider.start_augmenting(repo_name)
+    return spider
+
+
+def repositories_response(repo_names, data, errors):
+    body = json.dumps({'data': data, 'errors': errors})
+    return TextResponse(graphql.graphql_url(), body=body.encode('utf-8'), encoding='utf-8',
+                        request=Request(graphql.graphql_url(), method='POST', meta={'repo_names': repo_names}))
+
+
+def test_only_not_found_repositories_are_missing():
+    repo_names = ['owner/forbidden', 'owner/gone', 'owner/empty']
+    spider = graphql_spider(repo_names)
+    empty = {'diskUsage': 0, 'parent': None, 'pushedAt': None, 'createdAt': '2020-01-01T00:00:00Z',
+             'primaryLanguage': None, 'defaultBranchRef': None}
+    errors = [{'type': 'FORBIDDEN', 'path': ['r0'], 'message': 'Resource protected'},
+              {'type': 'NOT_FOUND', 'path': ['r1'], 'message': 'Could not resolve to a Repository'}]
+
+    results = list(spider.parse_repositories(repositories_response(repo_names, {'r0': None, 'r1': None, 'r2': empty}, errors)))
+
+    items = {result['repo_name']: result for result in results if isinstance(result, dict)}
+    assert sorted(items) == ['owner/empty', 'owner/gone']
+    assert items['owner/gone']['repo_not_found'] and not items['owner/empty'].get('repo_not_found')
+    # The forbidden one is asked to the REST API instead
+    assert sorted(request.meta['repo_name'] for request in results if isinstance(request, Request)) == \
+        ['owner/forbidden', 'owner/forbidden']
+    assert 'repo_not_found' not in spider.augmented['owner/forbidden']
+
+
+def test_failed_single_repository_query_falls_back_to_rest():
+    spider = graphql_spider(['owner/repo'])
+    errors = [{'type': 'TIMEOUT', 'message': 'Timeout on validation of query'}]
+
+    results = list(spider.parse_repositories(repositories_response(['owner/repo'], None, errors)))
+
+    assert [request.callback for request in results] == [spider.parse_repo_info, spider.parse_commit_stats]
+
+
+def test_fork_of_a_fork_is_augmented_through_rest():
+    spider = graphql_spider(['owner/fork', 'owner/forkfork'])
+    repository = {'diskUsage': 1, 'pushedAt': None, 'createdAt': '2020-01-01T00:00:00Z', 'primaryLanguage': None,
+                  'defaultBranchRef': None}
+    data = {'r0': dict(repository, parent={'nameWithOwner': 'upstream/repo', 'isFork': False}),
+            'r1': dict(repository, parent={'nameWithOwner': 'owner/fork', 'isFork': True})}
+
+    results = list(spider.parse_repositories(repositories_response(['owner/fork', 'owner/forkfork'], data, [])))
+
+    items = [result for result in results if isinstance(result, dict)]
+    assert [(item['repo_name'], item['forked_from']) for item in items] == [('owner/fork', 'upstream/repo')]
+    assert [(request.meta['repo_name'], request.callback) for request in results if isinstance(request, Request)] == \
+        [('owner/forkfork', spider.parse_repo_info), ('owner/forkfork', spider.parse_commit_stats)]
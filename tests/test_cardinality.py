@@ -0,0 +1,24 @@
+import time
+
+from githubdisco.cardinality import TermCounts, bound_url
+
+
+def test_bound_url_searches_the_term_alone_a_result_per_page():
+    probe = 'https://api.github.com/search/code?q=%22paypal.com%22+a+size:100..200+extension:md&per_page=100'
+
+    assert bound_url(probe) == 'https://api.github.com/search/code?q=a+size:100..200+extension:md&per_page=1'
+
+
+def test_counts_survive_a_reopen_until_too_old(tmp_path):
+    path = str(tmp_path / 'term_counts.sqlite')
+    counts = TermCounts(path)
+    counts.put('https://api.github.com/search/code?q=a&per_page=1', 0)
+    counts.close()
+
+    counts = TermCounts(path)
+    assert counts.get('https://api.github.com/search/code?q=a&per_page=1') == 0
+    assert counts.get('https://api.github.com/search/code?q=b&per_page=1') is None
+
+    counts.max_age = 0
+    time.sleep(0.01)
+    assert counts.get('https://api.github.com/search/code?q=a&per_page=1') is None
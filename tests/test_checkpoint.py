@@ -0,0 +1,29 @@
+import json
+import sqlite3
+
+from githubdisco.checkpoint import CrawlCheckpoint
+
+URL = 'https://api.github.com/search/code?q=%22paypal.com%22&page=1'
+
+
+def test_libraries_searching_the_same_url_have_nodes_of_their_own(tmp_path):
+    checkpoint = CrawlCheckpoint(str(tmp_path / 'checkpoint.sqlite'))
+    for name in ('paypal', 'braintree'):
+        checkpoint.add_pending('paypal+braintree', URL, {'library': {'library': name}, 'page': 1, 'strategy': 'unpacked'})
+    checkpoint.mark_done('paypal', URL)
+
+    assert checkpoint.pending('paypal+braintree') == [(URL, {'page': 1, 'strategy': 'unpacked', 'library': 'braintree'})]
+
+
+def test_frontier_keyed_by_url_is_migrated(tmp_path):
+    path = str(tmp_path / 'checkpoint.sqlite')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE frontier (url TEXT PRIMARY KEY, scope TEXT NOT NULL, meta TEXT NOT NULL, '
+               'done INTEGER NOT NULL DEFAULT 0)')
+    db.execute('INSERT INTO frontier (url, scope, meta) VALUES (?, ?, ?)', (URL, 'paypal', json.dumps({'page': 1})))
+    db.commit()
+    db.close()
+
+    checkpoint = CrawlCheckpoint(path)
+
+    assert checkpoint.pending('paypal') == [(URL, {'page': 1, 'library': 'paypal'})]
@@ -0,0 +1,25 @@
+from githubdisco.commits import CommitStatsCache, first_page_stats, last_page
+
+LINK = ('<https://api.github.com/repositories/1/commits?per_page=1&page=2>; rel="next", '
+        '<https://api.github.com/repositories/1/commits?per_page=1&page=1234>; rel="last"')
+
+
+def test_last_page_of_the_link_header():
+    assert last_page(LINK) == 1234
+    assert last_page(LINK.encode('utf-8')) == 1234
+    assert last_page(None) is None
+
+
+def test_first_page_tells_the_first_commit_of_a_single_commit_history():
+    assert first_page_stats(None, [{'sha': 'abc'}]) == (1, 'abc')
+    assert first_page_stats(None, []) == (0, None)
+    assert first_page_stats(LINK, [{'sha': 'head'}]) == (1234, None)
+
+
+def test_cached_first_commit_is_dropped_once_the_history_shrank(tmp_path):
+    cache = CommitStatsCache(str(tmp_path / 'commits.sqlite'))
+    cache.put('owner/repo', 'first', 100)
+
+    assert cache.first_commit('owner/repo', 120) == 'first'
+    assert cache.first_commit('owner/repo', 99) is None
+    assert cache.first_commit('owner/other', 1) is None
@@ -0,0 +1,32 @@
+import pytest
+
+from githubdisco import contents, github
+from githubdisco.contents import ContentFetcher, content_hit
+
+MATCH = {'path': 'src/my app.js', 'sha': 'b' * 40,
+         'url': github.API_URL + '/repositories/1/contents/src/my%20app.js?ref=' + 'a' * 40}
+
+
+def test_hit_has_the_ref_of_its_url():
+    assert content_hit(MATCH)['ref'] == 'a' * 40
+    assert content_hit(dict(MATCH, url=None))['ref'] is None
+
+
+def test_url_of_every_mode():
+    hit = content_hit(MATCH)
+
+    assert ContentFetcher('raw').url('owner/repo', hit) == '%s/owner/repo/%s/src/my%%20app.js' % (contents.RAW_URL, 'a' * 40)
+    assert ContentFetcher('api').url('owner/repo', hit) == MATCH['url']
+    assert ContentFetcher('blob').url('owner/repo', hit) == github.API_URL + '/repos/owner/repo/git/blobs/' + 'b' * 40
+    # No ref to build a raw url from
+    assert ContentFetcher('raw').url('owner/repo', dict(hit, ref=None)).endswith('/git/blobs/' + 'b' * 40)
+
+
+def test_raw_bytes_are_asked_for_from_the_api_only():
+    blob_url = github.API_URL + '/repos/owner/repo/git/blobs/' + 'b' * 40
+
+    assert ContentFetcher('blob').headers(blob_url) == {'Accept': contents.RAW_MEDIA_TYPE}
+    assert ContentFetcher('raw').headers(contents.RAW_URL + '/owner/repo/x') == {}
+    assert ContentFetcher('api').headers(MATCH['url']) == {}
+    with pytest.raises(ValueError):
+        ContentFetcher('ftp')
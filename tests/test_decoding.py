@@ -0,0 +1,23 @@
+import json
+
+import pytest
+from scrapy.http import Response
+
+from githubdisco import decoding
+from githubdisco.decoding import ResponseDecoder
+
+
+def test_every_installed_backend_decodes_the_bytes_alike():
+    body = json.dumps({'total_count': 1, 'items': [{'name': 'café.md'}]}).encode('utf-8')
+
+    for backend in decoding.available_backends():
+        assert ResponseDecoder(backend).json(Response('https://api.github.com/x', body=body)) == json.loads(body)
+
+
+def test_empty_body_decodes_to_none():
+    assert ResponseDecoder('json').json(Response('https://api.github.com/x', status=204)) is None
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        decoding.loader('yaml')
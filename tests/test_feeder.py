@@ -0,0 +1,38 @@
+from githubdisco.feeder import InputFeeder, unique
+
+
+def test_unique_drops_recent_duplicates():
+    rows = ['a', 'a', 'b', 'a', 'c', 'b']
+    assert list(unique(rows, lambda row: row)) == ['a', 'b', 'c']
+
+
+def test_unique_remembers_a_bounded_number_of_keys():
+    rows = ['a', 'b', 'c', 'a', 'c']
+    assert list(unique(rows, lambda row: row, recent=2)) == ['a', 'b', 'c', 'a']
+
+
+def test_feeder_keeps_at_most_max_in_flight_rows():
+    fed = []
+    feeder = InputFeeder(iter(range(5)), lambda rows: fed.append(rows) or rows, 2)
+
+    assert feeder.feed() == [0, 1]
+    assert feeder.feed() == []
+    assert feeder.done() == [2]
+    assert feeder.done(2) == [3, 4]
+    assert feeder.done(2) == [] and feeder.exhausted
+
+
+def test_feeder_hands_rows_over_in_batches():
+    feeder = InputFeeder(iter(range(7)), lambda rows: [rows], 5, batch_size=2)
+
+    # 4 of 5, room for no batch more
+    assert feeder.feed() == [[0, 1, 2, 3]]
+    assert feeder.done() == [[4, 5]]
+    assert feeder.done(5) == [[6]]
+
+
+def test_idle_feeder_gives_up_on_the_rows_in_flight():
+    feeder = InputFeeder(iter(range(3)), lambda rows: rows, 2)
+    feeder.feed()
+
+    assert feeder.idle() == ([2], 2)
@@ -0,0 +1,82 @@
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from githubdisco import github
+from githubdisco.github import TokenPool, load_tokens
+from githubdisco.middlewares import GithubTokenPoolMiddleware
+from githubdisco.spiders.toggled_repos_spider import ToggledReposSpider
+
+
+class Clock(object):
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_tokens_stop_at_the_first_missing_one():
+    assert load_tokens({'Github_1': 'a', 'Github_2': 'b', 'Github_4': 'd'}) == ['a', 'b']
+
+
+def test_token_with_the_most_quota_left_is_handed_out():
+    pool = TokenPool(['a', 'b'], clock=Clock())
+    pool.update(0, 'core', 10, None)
+
+    assert pool.acquire('core') == (1, 0)
+
+
+def test_exhausted_bucket_waits_for_the_earliest_reset():
+    clock = Clock()
+    pool = TokenPool(['a', 'b'], clock=clock)
+    pool.exhaust(0, 'search', clock.now + 30)
+    pool.exhaust(1, 'search', clock.now + 10)
+
+    assert pool.acquire('search') == (None, 10)
+    # The other buckets are charged separately
+    assert pool.acquire('core')[0] is not None
+
+    clock.now += 10
+    assert pool.acquire('search') == (1, 0)
+
+
+def test_request_is_parked_while_every_token_is_exhausted():
+    crawler = get_crawler(ToggledReposSpider)
+    spider = ToggledReposSpider.from_crawler(crawler)
+    crawler.stats.open_spider(spider)
+    clock = Clock()
+    pool = TokenPool(['a'], clock=clock)
+    pool.exhaust(0, 'search', clock.now + 30)
+    middleware = GithubTokenPoolMiddleware(pool, crawler.stats)
+    request = Request(github.API_URL + '/search/code?q=paypal')
+
+    parked = middleware.process_request(request, spider)
+
+    assert isinstance(parked, defer.Deferred)
+    parked.cancel()
+    parked.addErrback(lambda failure: None)
+    assert request.meta['token_wait'] == 30
+    assert crawler.stats.get_value('token_pool/parked/search') == 1
+    assert 'Authorization' not in request.headers
+
+
+def test_rate_limited_response_is_retried_with_another_token():
+    crawler = get_crawler(ToggledReposSpider)
+    spider = ToggledReposSpider.from_crawler(crawler)
+    crawler.stats.open_spider(spider)
+    clock = Clock()
+    pool = TokenPool(['a', 'b'], clock=clock)
+    middleware = GithubTokenPoolMiddleware(pool, crawler.stats)
+    request = Request(github.API_URL + '/repos/owner/repo')
+    middleware.process_request(request, spider)
+    token_id = request.meta['token_id']
+    headers = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(clock.now) + 600), 'X-RateLimit-Resource': 'core'}
+
+    retry = middleware.process_response(request, Response(request.url, status=403, headers=headers), spider)
+
+    assert isinstance(retry, Request) and retry.dont_filter and 'token_id' not in retry.meta
+    assert pool.quota(token_id, 'core').remaining == 0
+    middleware.process_request(retry, spider)
+    assert retry.meta['token_id'] != token_id
@@ -0,0 +1,50 @@
+from scrapy.http import Request, Response, TextResponse
+from scrapy.utils.test import get_crawler
+
+from githubdisco import github
+from githubdisco.httpcache import ConditionalCacheStorage
+from githubdisco.middlewares import GithubConditionalCacheMiddleware
+from githubdisco.spiders.augment_toggled_repos_spider import AugmentToggledReposSpider
+
+URL = github.API_URL + '/repos/owner/repo'
+
+
+def cache_middleware(tmp_path):
+    crawler = get_crawler(AugmentToggledReposSpider)
+    spider = AugmentToggledReposSpider.from_crawler(crawler)
+    crawler.stats.open_spider(spider)
+    return GithubConditionalCacheMiddleware(ConditionalCacheStorage(str(tmp_path / 'responses.sqlite')), crawler.stats), spider
+
+
+def test_key_depends_on_the_media_type_not_the_token(tmp_path):
+    storage = ConditionalCacheStorage(str(tmp_path / 'responses.sqlite'))
+
+    assert storage.key(Request(URL, headers={'Authorization': 'Bearer a'})) == storage.key(Request(URL))
+    assert storage.key(Request(URL, headers={'Accept': 'application/vnd.github.v3.raw'})) != storage.key(Request(URL))
+
+
+def test_not_modified_response_is_replayed_from_the_cache(tmp_path):
+    middleware, spider = cache_middleware(tmp_path)
+    first = Request(URL)
+    middleware.process_request(first, spider)
+    response = TextResponse(URL, body=b'{"full_name": "owner/repo"}', encoding='utf-8', headers={'ETag': '"v1"'})
+    middleware.process_response(first, response, spider)
+
+    again = Request(URL)
+    middleware.process_request(again, spider)
+    assert again.headers['If-None-Match'] == b'"v1"'
+    replayed = middleware.process_response(again, Response(URL, status=304), spider)
+
+    assert replayed.status == 200 and replayed.body == b'{"full_name": "owner/repo"}' and 'cached' in replayed.flags
+    assert middleware.stats.get_value('github_httpcache/revalidated') == 1
+
+
+def test_uncached_requests_are_left_alone(tmp_path):
+    middleware, spider = cache_middleware(tmp_path)
+    request = Request(URL, meta={'dont_cache': True})
+    middleware.process_response(request, Response(URL, headers={'ETag': '"v1"'}), spider)
+
+    assert middleware.storage.validators(Request(URL)) is None
+    # A 304 without a stored response goes through as it is
+    not_modified = Response(URL, status=304)
+    assert middleware.process_response(Request(URL), not_modified, spider) is not_modified
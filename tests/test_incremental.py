@@ -0,0 +1,25 @@
+from githubdisco.incremental import IncrementalState
+
+
+def test_marks_are_only_advanced_by_a_finished_run(tmp_path):
+    path = str(tmp_path / 'incremental.sqlite')
+    state = IncrementalState(path)
+    state.set_mark('paypal q', [1, 2])
+    state.close(finished=False)
+
+    state = IncrementalState(path)
+    assert state.mark('paypal q') is None
+    state.set_mark('paypal q', [1, 2])
+    state.close(finished=True)
+
+    assert IncrementalState(path).mark('paypal q') == {1, 2}
+
+
+def test_results_are_known_per_scope(tmp_path):
+    path = str(tmp_path / 'incremental.sqlite')
+    state = IncrementalState(path)
+    state.add('paypal', 42)
+    state.close(finished=False)
+
+    state = IncrementalState(path)
+    assert state.known('paypal', 42) and not state.known('stripe', 42)
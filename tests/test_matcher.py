@@ -0,0 +1,64 @@
+import re
+import time
+
+import pytest
+
+from githubdisco.matcher import LibraryMatcher, MatchBudgetExceeded, RePattern, SegmentedPattern, compile_pattern
+
+JAVASCRIPT = [
+    ['(?:devDependencies|dependencies)":[\\S\\W]*"${artifact_name}"', None, r'json$'],
+    ['(?:require.+|import.+|from.+)(?:"|\')${artifact_name}(?:"|\')', None, r'(?:js|jsx|ts|tsx)$'],
+]
+STRIPE = {'library': 'stripe', 'artifacts': ['@stripe/stripe-js,1.0'], 'imports_usages': []}
+
+
+def test_patterns_only_apply_to_their_paths():
+    matcher = LibraryMatcher(STRIPE, JAVASCRIPT)
+
+    assert matcher.search('package.json', '{"dependencies": {"react": "1", "@stripe/stripe-js": "1"}}')
+    assert matcher.search('src/pay.js', 'import { loadStripe } from "@stripe/stripe-js"')
+    assert matcher.search('README.md', 'import { loadStripe } from "@stripe/stripe-js"') is None
+    assert matcher.search('src/pay.js', '{"dependencies": {"@stripe/stripe-js": "1"}}') is None
+
+
+def test_placeholders_are_substituted_escaped_once():
+    matcher = LibraryMatcher(dict(STRIPE, artifacts=['stripe.js,1.0']), JAVASCRIPT)
+
+    # The artifact version is not part of the patterns, the dot is no wildcard
+    assert matcher.literals == {'stripe.js'}
+    assert sum(len(patterns) for patterns in matcher.patterns_by_path.values()) == 2
+    assert matcher.search('src/pay.js', 'import x from "stripe.js"')
+    assert matcher.search('src/pay.js', 'import x from "stripe-js"') is None
+
+
+def test_segmented_pattern_finds_what_re_finds():
+    regexp = '(?:devDependencies|dependencies)":[\\S\\W]*"stripe"'
+    pattern = compile_pattern(regexp, 0, 'segmented')
+    assert isinstance(pattern, SegmentedPattern)
+
+    for text in ['{"dependencies": {"react": "1", "stripe": "2"}}', '{"stripe": "2", "dependencies": {}}',
+                 '{"devDependencies": {"x": "1"}, "dependencies": {"stripe": "3"}}']:
+        assert bool(pattern.search(text)) == bool(re.search(regexp, text))
+
+
+def test_earliest_end_bisects_to_the_shortest_match():
+    pattern = SegmentedPattern('x[\\S\\W]*c', 0)
+    segment = re.compile('xyz|y')
+
+    # The leftmost match is 'xyz', the 'y' after it ends earlier
+    assert pattern.earliest_end(segment, 'xyz', 0) == 2
+
+
+def test_unsupported_patterns_fall_back_to_re():
+    # Unbounded segment before the gap, and a gap inside a group
+    assert isinstance(compile_pattern('a+[\\S\\W]*b', 0, 'segmented'), RePattern)
+    assert isinstance(compile_pattern('(a[\\S\\W]*b)', 0, 'segmented'), RePattern)
+    assert isinstance(compile_pattern('a|b[\\S\\W]*c', 0, 'segmented'), RePattern)
+
+
+def test_segmented_search_stops_at_the_deadline():
+    pattern = SegmentedPattern('a[\\S\\W]*b[\\S\\W]*c', 0)
+
+    with pytest.raises(MatchBudgetExceeded):
+        pattern.search('abc', deadline=time.monotonic() - 1)
+    assert pattern.search('abc', deadline=time.monotonic() + 60)
@@ -0,0 +1,45 @@
+from githubdisco.partition import SizeHistogram, SizePartitioner
+
+
+def assert_partition(ranges, size_from, size_to):
+    assert ranges[0][0] == size_from and ranges[-1][1] == size_to
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert start <= end and next_start == end + 1
+
+
+def test_observed_counts_are_kept_per_range():
+    histogram = SizeHistogram(100000)
+    histogram.observe(0, 100000, 3000)
+    assert round(histogram.estimate(0, 100000)) == 3000
+    rest = histogram.estimate(1000, 100000)
+
+    histogram.observe(0, 999, 2000)
+
+    assert round(histogram.estimate(0, 999)) == 2000
+    # Only the observed range is rescaled
+    assert histogram.estimate(1000, 100000) == rest
+
+
+def test_quantiles_follow_the_observed_density():
+    histogram = SizeHistogram(100000)
+    histogram.observe(0, 999, 900)
+    histogram.observe(1000, 100000, 100)
+
+    # Half of the results are in the first 1000 bytes, far below the middle of the range
+    point, = histogram.quantiles(0, 100000, 2)
+    assert point < 1000
+
+
+def test_split_covers_the_range_in_parts_below_the_target():
+    partitioner = SizePartitioner(100000, max_results=1000)
+    ranges = partitioner.split('paypal', 0, 100000, 4000)
+
+    assert_partition(ranges, 0, 100000)
+    assert 5 <= len(ranges) <= 8
+    assert all(partitioner.estimate('paypal', start, end) <= 1000 for start, end in ranges)
+
+
+def test_split_of_a_narrow_range_halves_it():
+    partitioner = SizePartitioner(100000)
+
+    assert partitioner.split('paypal', 10, 11, 5000) == [(10, 10), (11, 11)]
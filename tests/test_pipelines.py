@@ -0,0 +1,69 @@
+import logging
+
+import pyarrow.ipc
+import pyarrow.parquet
+import pytest
+from scrapy.exceptions import NotConfigured
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from githubdisco.pipelines import ColumnarExportPipeline
+
+
+class Spider(object):
+    name = 'test'
+    item_schema = [('repo_name', 'string'), ('stars', 'int'), ('forked', 'bool'), ('topics', 'strings')]
+    logger = logging.getLogger('test')
+
+
+def export(path, file_format, items, batch_rows):
+    stats = MemoryStatsCollector(get_crawler())
+    pipeline = ColumnarExportPipeline(stats, path, file_format, 'zstd', batch_rows)
+    spider = Spider()
+    pipeline.open_spider(spider)
+    for item in items:
+        pipeline.process_item(item, spider)
+    pipeline.close_spider(spider)
+    return stats
+
+
+ITEMS = [
+    {'repo_name': 'a/b', 'stars': 3, 'forked': False, 'topics': ['x'], 'ignored': 1},
+    {'repo_name': 'c/d', 'forked': True},
+    {'repo_name': 'e/f', 'stars': 0, 'forked': False, 'topics': []},
+]
+
+
+def test_parquet_row_groups_of_batch_rows(tmp_path):
+    path = str(tmp_path / '%(name)s.parquet')
+
+    stats = export(path, 'parquet', ITEMS, 2)
+
+    parquet = pyarrow.parquet.ParquetFile(str(tmp_path / 'test.parquet'))
+    assert parquet.metadata.num_row_groups == 2
+    assert parquet.read().to_pylist() == [
+        {'repo_name': 'a/b', 'stars': 3, 'forked': False, 'topics': ['x']},
+        {'repo_name': 'c/d', 'stars': None, 'forked': True, 'topics': None},
+        {'repo_name': 'e/f', 'stars': 0, 'forked': False, 'topics': []},
+    ]
+    assert stats.get_value('columnar/rows') == 3 and stats.get_value('columnar/batches') == 2
+
+
+def test_arrow_ipc_file(tmp_path):
+    path = str(tmp_path / 'out' / 'items.arrow')
+
+    export(path, 'arrow', ITEMS, 50000)
+
+    reader = pyarrow.ipc.open_file(path)
+    assert reader.num_record_batches == 1
+    assert reader.read_all().column('repo_name').to_pylist() == ['a/b', 'c/d', 'e/f']
+
+
+def test_disabled_without_an_output():
+    with pytest.raises(NotConfigured):
+        ColumnarExportPipeline.from_crawler(get_crawler())
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        ColumnarExportPipeline(None, 'items.csv', 'csv')
@@ -0,0 +1,53 @@
+from githubdisco.planner import MAX_QUERY_LENGTH, QueryPlan, attribute, group_scope, or_query, pack, query_length
+
+TERMS = [('paypal', 'paypal.com'), ('stripe', 'js.stripe.com')]
+
+
+def test_search_string_found_whatever_the_punctuation():
+    assert attribute(TERMS, ['<script src="https://www.paypal-com/sdk.js">']) == ['paypal']
+    assert attribute(TERMS, ['see PayPal com for details']) == ['paypal']
+    assert attribute(TERMS, ['<script src="https://js.stripe.com/v3/">']) == ['stripe']
+
+
+def test_search_string_is_matched_word_by_word():
+    assert attribute(TERMS, ['mypaypal.community']) == []
+
+
+def test_pack_keeps_every_query_within_the_limits():
+    search_strings = ['lib%d' % i for i in range(20)] + ['x' * 120, 'y' * 120]
+    packed = pack(search_strings, 10)
+
+    assert [search_string for query in packed for search_string in query] == search_strings
+    # At most 5 OR operators, 256 characters
+    assert all(len(query) <= 6 and query_length(query) <= MAX_QUERY_LENGTH for query in packed)
+    assert pack(['a', 'b', 'c'], 2) == [['a', 'b'], ['c']]
+
+
+def test_query_length_bounds_the_query():
+    query = ['paypal.com', 'js.stripe.com']
+
+    assert query_length(query) >= len(or_query(query).replace('%22', '"').replace('+', ' '))
+
+
+def test_plan_shares_queries_by_qualifiers_and_search_string():
+    paypal, braintree, stripe = ({'library': name} for name in ('paypal', 'braintree', 'stripe'))
+    plan = QueryPlan(5)
+    plan.add(paypal, 'paypal.com', 'extension:js')
+    plan.add(braintree, 'paypal.com', 'extension:js')
+    plan.add(stripe, 'js.stripe.com', 'extension:js')
+    plan.add(stripe, 'stripe', 'extension:py')
+
+    groups = plan.groups()
+
+    assert [(qualifiers, [(library['library'], search_string) for library, search_string in terms])
+            for qualifiers, terms in groups] == [
+        ('extension:js', [('paypal', 'paypal.com'), ('braintree', 'paypal.com'), ('stripe', 'js.stripe.com')]),
+        ('extension:py', [('stripe', 'stripe')]),
+    ]
+
+
+def test_group_scope_of_libraries_with_several_search_strings():
+    paypal = {'library': 'paypal', 'languages': 'javascript'}
+    group = group_scope([paypal, paypal, {'library': 'stripe', 'languages': 'javascript'}])
+
+    assert group['library'] == 'paypal+stripe' and group['members'] == ['paypal', 'stripe']
@@ -0,0 +1,49 @@
+import json
+
+from scrapy.http import TextResponse
+from scrapy.utils.test import get_crawler
+
+from githubdisco.feeder import InputFeeder
+from githubdisco.repostore import LOCAL_URL, RepoStore
+from githubdisco.spiders.top_contributors_spider import TopContributorsSpider
+
+
+def test_fresh_records_outlive_the_store(tmp_path):
+    path = str(tmp_path / 'repos.sqlite')
+    store = RepoStore(path)
+    store.put('Owner/Repo', 'augmented', {'size_bytes': 1})
+    store.close()
+
+    store = RepoStore(path)
+    assert store.get('owner/repo', 'augmented') == {'size_bytes': 1}
+    assert store.get('owner/repo', 'contributors') is None
+
+    store.max_age = -1
+    assert store.get('owner/repo', 'augmented') is None
+
+
+def test_contributors_of_stored_repositories_are_not_requested(tmp_path):
+    path = str(tmp_path / 'repos.sqlite')
+    store = RepoStore(path)
+    store.put('owner/stored', 'contributors', [{'repo_name': 'owner/stored', 'login': 'alice', 'name': 'alice',
+                                                'email': 'alice@alice.org'}])
+    store.close()
+    crawler = get_crawler(TopContributorsSpider)
+    spider = TopContributorsSpider.from_crawler(crawler, repo_store=path)
+    crawler.stats.open_spider(spider)
+    spider.feeder = InputFeeder([], spider.contributors_requests, spider.max_in_flight)
+    spider.feeder.in_flight = 2
+
+    requests = spider.contributors_requests([{'library': 'braintree', 'repo_name': 'owner/stored'},
+                                             {'library': 'paypal', 'repo_name': 'owner/new'}])
+
+    assert [request.url for request in requests] == [spider.get_contributors_url({'repo_name': 'owner/new'}), LOCAL_URL]
+    results = list(spider.parse_stored(TextResponse(LOCAL_URL, body=b'', request=requests[1])))
+    assert results == [{'library': 'braintree', 'repo_name': 'owner/stored', 'login': 'alice', 'name': 'alice',
+                        'email': 'alice@alice.org'}]
+    assert spider.feeder.in_flight == 1 and crawler.stats.get_value('repo_store/hits') == 1
+
+    # owner/new has no contributors, stored once its response is in
+    list(spider.parse_contributors(TextResponse(requests[0].url, body=json.dumps([]).encode('utf-8'),
+                                                encoding='utf-8', request=requests[0])))
+    assert spider.repo_store.get('owner/new', 'contributors') == []
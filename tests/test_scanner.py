@@ -0,0 +1,22 @@
+from githubdisco.scanner import LibraryScanner
+
+
+class Matcher(object):
+
+    def __init__(self, *literals):
+        self.literals = set(literals)
+
+
+def test_candidates_are_the_libraries_whose_literals_are_in_the_text():
+    scanner = LibraryScanner({'stripe': Matcher('stripe'), 'paypal': Matcher('paypal.com', 'braintree')})
+
+    assert scanner.candidates('<script src="https://js.Stripe.com/v3"></script>') == {'stripe'}
+    assert scanner.candidates('braintree and stripe') == {'stripe', 'paypal'}
+    assert scanner.candidates('nothing to see') == set()
+
+
+def test_a_literal_counts_for_the_literals_it_contains():
+    scanner = LibraryScanner({'stripe': Matcher('stripe'), 'stripe_js': Matcher('stripe-js')})
+
+    # Only the longer literal is reported at the position both start at
+    assert scanner.candidates('"stripe-js": "1.0"') == {'stripe', 'stripe_js'}
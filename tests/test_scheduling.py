@@ -0,0 +1,43 @@
+from scrapy.http import Request
+
+from githubdisco.scheduling import SearchScheduler
+
+
+def probe(priority, splitter='"a'):
+    return Request('https://api.github.com/search/code?q=%s&p=%d' % (splitter, priority), priority=priority,
+                   meta={'splitter': splitter})
+
+
+def test_best_probes_go_first_and_at_most_max_splitters_at_once():
+    scheduler = SearchScheduler(100, 1000, 2)
+
+    ready = scheduler.submit([probe(1), probe(30), probe(20)])
+
+    assert [request.priority for request in ready] == [30, 20]
+    assert [request.priority for request in scheduler.done()] == [1]
+    assert scheduler.done() == [] and scheduler.in_flight == 1
+
+
+def test_waiting_probes_covered_meanwhile_are_skipped():
+    scheduler = SearchScheduler(100, 1000, 1, skip=lambda request: request.meta['splitter'] == '"b')
+    scheduler.submit([probe(30), probe(20, '"b'), probe(10)])
+
+    assert [request.priority for request in scheduler.done()] == [10]
+
+
+def test_splitter_rate_is_learned_from_the_probes():
+    scheduler = SearchScheduler(100, 1000, 8)
+    assert scheduler.splitter_priority('a', 4000, 1.0) == 100
+
+    scheduler.observe_splitter('a', 4000, 40)
+
+    assert scheduler.splitter_priority('a', 4000, 1.0) == 40
+    # Half of the page was known already
+    assert scheduler.splitter_priority('a', 4000, 0.5) == 20
+
+
+def test_next_pages_go_before_new_queries():
+    scheduler = SearchScheduler(100, 1000, 8)
+
+    assert scheduler.next_page_priority(150, 1, 1.0) > scheduler.size_split_priority(5000, 1.0)
+    assert scheduler.content_priority > scheduler.next_page_priority(5000, 1, 1.0)
@@ -0,0 +1,30 @@
+import os
+
+from githubdisco.seen import SeenSet, result_key
+
+
+def test_markers_of_a_result_found_in_several_ranges():
+    seen = SeenSet()
+    key = result_key('owner/repo', 'README.md', 'abc')
+    seen.add(key, '0..999')
+    seen.add(key, '0..999')
+    seen.add(key, '0..499')
+
+    assert seen.markers(key) == {'0..999', '0..499'}
+    assert seen.markers(result_key('owner/repo', 'README.md', 'abd')) is None
+    assert len(seen) == 1
+
+
+def test_spilled_entries_are_still_seen(tmp_path):
+    seen = SeenSet(str(tmp_path), max_entries=10)
+    keys = [result_key('owner/repo%d' % i, 'README.md', 'abc') for i in range(25)]
+    for key in keys:
+        seen.add(key, '0..999')
+    seen.add(keys[0], '0..499')
+
+    assert len(seen.entries) <= 10
+    assert all(key in seen for key in keys) and len(seen) == 25
+    assert seen.markers(keys[0]) == {'0..999', '0..499'}
+    path = seen.spill_path
+    seen.close()
+    assert not os.path.exists(path)
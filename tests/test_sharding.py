@@ -0,0 +1,65 @@
+import csv
+
+import pytest
+
+from githubdisco.sharding import library_groups, merge, plan, size_ranges, token_subsets
+
+
+def write_feed(path, fieldnames, rows):
+    with open(str(path), 'w') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(fieldnames)
+        writer.writerows(rows)
+    return str(path)
+
+
+def read_feed(path):
+    with open(str(path)) as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def test_shards_partition_the_libraries_and_sizes():
+    assert library_groups(['a', 'b', 'c'], 2) == [['a', 'c'], ['b']]
+    assert library_groups(['a'], 3) == [['a']]
+    assert size_ranges(1, 100, [50, 20, 500, 1]) == [(1, 19), (20, 49), (50, 100)]
+    assert size_ranges(1, 100, []) == [(1, 100)]
+
+    shards = plan(['a', 'b'], 2, 1, 100, [50])
+
+    assert [(shard['shard'], shard['libraries'], shard['from'], shard['to']) for shard in shards] == [
+        (0, ['a'], 1, 49), (1, ['a'], 50, 100), (2, ['b'], 1, 49), (3, ['b'], 50, 100)]
+
+
+def test_workers_get_disjoint_tokens():
+    assert token_subsets(['t1', 't2', 't3'], 2) == [['t1', 't3'], ['t2']]
+    assert token_subsets(['t1'], 4) == [['t1']]
+    with pytest.raises(ValueError):
+        token_subsets([], 1)
+
+
+def test_merge_deduplicates_the_rows(tmp_path):
+    fields = ['library', 'repo_name', 'name']
+    feeds = [
+        write_feed(tmp_path / 'shard-0.csv', fields, [['paypal', 'a/b', 'README.md'], ['paypal', 'c/d', 'pay.md']]),
+        write_feed(tmp_path / 'shard-1.csv', fields, [['paypal', 'a/b', 'README.md'], ['paypal', 'a/b', 'big.md']]),
+        write_feed(tmp_path / 'shard-2.csv', [], []),
+        str(tmp_path / 'missing.csv'),
+    ]
+
+    assert merge(feeds, str(tmp_path / 'merged.csv')) == 3
+    assert [row['name'] for row in read_feed(tmp_path / 'merged.csv')] == ['README.md', 'pay.md', 'big.md']
+
+
+def test_merge_adds_up_the_records_of_a_repository(tmp_path):
+    fields = ['library', 'repo_name', 'forked', 'hits', 'names']
+    feeds = [
+        write_feed(tmp_path / 'shard-0.csv', fields, [['paypal', 'a/b', 'False', '2', 'README.md,pay.md'],
+                                                       ['braintree', 'a/b', 'False', '1', 'pay.md']]),
+        write_feed(tmp_path / 'shard-1.csv', fields, [['paypal', 'a/b', 'False', '3', 'big.md,pay.md']]),
+    ]
+
+    assert merge(feeds, str(tmp_path / 'merged.csv')) == 2
+    assert read_feed(tmp_path / 'merged.csv') == [
+        {'library': 'paypal', 'repo_name': 'a/b', 'forked': 'False', 'hits': '5', 'names': 'README.md,big.md,pay.md'},
+        {'library': 'braintree', 'repo_name': 'a/b', 'forked': 'False', 'hits': '1', 'names': 'pay.md'},
+    ]
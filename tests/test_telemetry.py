@@ -0,0 +1,31 @@
+from scrapy.http import Request, Response
+
+from githubdisco.telemetry import CrawlTelemetry
+
+
+def search_request(**meta):
+    return Request('https://api.github.com/search/code?q=paypal', meta=dict({'library': {'library': 'paypal'}}, **meta))
+
+
+def test_retries_are_counted_once_per_retry():
+    telemetry = CrawlTelemetry(None, None)
+    request = search_request(strategy='size', retry_times=1)
+    telemetry.request_scheduled(request, None)
+    # A child request inherits the meta of its retried parent
+    telemetry.request_scheduled(request.replace(meta=dict(request.meta)), None)
+    telemetry.request_scheduled(request.replace(meta=dict(request.meta, rate_limit_retries=1)), None)
+
+    assert telemetry.counters['githubdisco_retries_total'] == {(('library', 'paypal'), ('strategy', 'size')): 2}
+
+
+def test_metrics_in_the_prometheus_text_format():
+    telemetry = CrawlTelemetry(None, None)
+    request = search_request(download_latency=0.2)
+    telemetry.response_downloaded(Response(request.url, status=403), request, None)
+
+    lines = telemetry.prometheus().splitlines()
+
+    assert 'githubdisco_requests_total{library="paypal",status="403",strategy="root"} 1' in lines
+    assert 'githubdisco_request_latency_seconds_bucket{library="paypal",strategy="root",le="0.25"} 1' in lines
+    assert 'githubdisco_request_latency_seconds_bucket{library="paypal",strategy="root",le="0.1"} 0' in lines
+    assert 'githubdisco_request_latency_seconds_count{library="paypal",strategy="root"} 1' in lines
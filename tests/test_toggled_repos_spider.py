@@ -0,0 +1,82 @@
+import json
+
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from githubdisco.planner import group_scope
+from githubdisco.seen import result_key
+from githubdisco.spiders.toggled_repos_spider import ToggledReposSpider
+
+
+def probe_response(spider, items):
+    library = spider.libraries[0]
+    url = next(spider.search_urls(library)).replace('size:0..1000000', 'size:5000..5000')
+    meta = {'library': library, 'page': 1, 'per_page': spider.per_page, 'from': 5000, 'to': 5000,
+            'strategy': 'query', 'splitter': '"a', 'parent_total': 2000}
+    body = json.dumps({'total_count': len(items), 'incomplete_results': False, 'items': items})
+    return TextResponse(url, body=body.encode('utf-8'), encoding='utf-8', request=Request(url, meta=meta))
+
+
+def test_parsed_probe_releases_its_slot():
+    crawler = get_crawler(ToggledReposSpider)
+    spider = ToggledReposSpider.from_crawler(crawler)
+    crawler.stats.open_spider(spider)
+    spider.scheduler.in_flight = spider.max_splitters
+    items = [{'name': 'README.md', 'path': 'README.md', 'sha': '%040d' % i,
+              'repository': {'full_name': 'owner/repo%d' % i, 'fork': False}} for i in range(3)]
+
+    results = list(spider.parse(probe_response(spider, items)))
+
+    assert len([result for result in results if isinstance(result, dict)]) == 3
+    assert spider.scheduler.in_flight == spider.max_splitters - 1
+
+
+def test_resumed_unpacked_search_keeps_its_library(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.sqlite')
+    spider = ToggledReposSpider(checkpoint=checkpoint)
+    library = spider.libraries[0]
+    other = dict(library, library='other')
+    spider.libraries_by_name['other'] = other
+    group = group_scope([library, other])
+    url = next(spider.search_urls(library))
+    spider.checkpoint.add_pending(group['library'], url, {'library': library, 'page': 1, 'from': 0, 'to': 1000000,
+                                                          'per_page': 100, 'strategy': 'unpacked'})
+    spider.checkpoint.close()
+
+    spider = ToggledReposSpider(checkpoint=checkpoint)
+    requests = list(spider.resume(group))
+
+    assert [request.meta['library']['library'] for request in requests] == [library['library']]
+
+
+def test_incremental_result_is_known_once_verified(tmp_path):
+    crawler = get_crawler(ToggledReposSpider)
+    spider = ToggledReposSpider.from_crawler(crawler, contents='raw', incremental=str(tmp_path / 'incremental.sqlite'))
+    crawler.stats.open_spider(spider)
+    # Per scope state, as start_requests resets it
+    spider.repositories = spider.new_seen_set()
+    spider.exclude_pattern = {}
+    item = {'name': 'App.java', 'path': 'src/App.java', 'sha': '%040d' % 1, 'url': '',
+            'repository': {'full_name': 'owner/repo', 'fork': False}}
+    scope = spider.libraries[0]['library']
+    key = result_key('owner/repo', 'App.java', item['sha'])
+
+    request = [result for result in spider.parse(probe_response(spider, [item])) if result.callback == spider.parse_contents][0]
+    assert not spider.incremental.known(scope, key)
+
+    list(request.callback(TextResponse(request.url, body=b'class App {}', encoding='utf-8', request=request)))
+    assert spider.incremental.known(scope, key)
+
+
+def test_unattributed_shared_query_hit_counts_for_every_library():
+    crawler = get_crawler(ToggledReposSpider)
+    spider = ToggledReposSpider.from_crawler(crawler)
+    crawler.stats.open_spider(spider)
+    library = spider.libraries[0]
+    other = dict(library, library='other')
+    group = group_scope([library, other])
+    group['terms'] = [(library['library'], 'first.search'), (other['library'], 'second.search')]
+    match = {'path': 'index.html', 'text_matches': [{'fragment': '... first-sea'}]}
+
+    assert spider.attribute(group, match) == [library['library'], other['library']]
+    assert spider.attribute(group, {'path': 'index.html', 'text_matches': [{'fragment': 'first search'}]}) == [library['library']]
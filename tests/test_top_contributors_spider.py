@@ -0,0 +1,59 @@
+import json
+
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from githubdisco.feeder import InputFeeder
+from githubdisco.spiders.top_contributors_spider import TopContributorsSpider
+
+
+def scan_spider(**kwargs):
+    crawler = get_crawler(TopContributorsSpider)
+    spider = TopContributorsSpider.from_crawler(crawler, emails='scan', **kwargs)
+    crawler.stats.open_spider(spider)
+    spider.feeder = InputFeeder([], spider.contributors_requests, spider.max_in_flight)
+    return spider
+
+
+def json_response(request, data):
+    return TextResponse(request.url, body=json.dumps(data).encode('utf-8'), encoding='utf-8', request=request)
+
+
+def commit(login, email):
+    return {'author': {'login': login}, 'commit': {'author': {'name': login, 'email': email},
+                                                   'committer': {'name': login, 'email': email}}}
+
+
+def test_commits_scan_resolves_the_contributors_among_its_authors():
+    spider = scan_spider()
+    contributors, scan = spider.contributors_requests([{'library': 'paypal', 'repo_name': 'owner/repo'}])
+    spider.feeder.in_flight = 1
+
+    assert list(spider.parse_contributors(json_response(contributors, [{'login': 'alice'}, {'login': 'bob'}]))) == []
+    results = list(spider.parse_scan(json_response(scan, [commit('alice', 'new@alice.org'), commit('carol', 'c@c.org'),
+                                                          commit('alice', 'old@alice.org')])))
+
+    # alice's latest commit is in the scan, bob is looked up by author
+    assert results[0] == {'library': 'paypal', 'repo_name': 'owner/repo', 'login': 'alice', 'name': 'alice',
+                          'email': 'new@alice.org'}
+    assert [request.url for request in results[1:]] == [spider.get_commits_list_url({'repo_name': 'owner/repo',
+                                                                                       'login': 'bob'})]
+    assert spider.crawler.stats.get_value('top_contributors/resolved_locally') == 1
+
+    results = list(spider.parse_commits(json_response(results[1], [commit('bob', 'bob@users.noreply.github.com')])))
+
+    assert results == [] and spider.rows == {} and spider.feeder.in_flight == 0
+
+
+def test_failed_scan_looks_every_contributor_up_by_author():
+    spider = scan_spider()
+    contributors, scan = spider.contributors_requests([{'library': 'paypal', 'repo_name': 'owner/repo'}])
+    list(spider.parse_contributors(json_response(contributors, [{'login': 'alice'}, {'login': 'bob'}])))
+
+    class Failure(object):
+        request = scan
+        value = None
+
+    results = spider.scan_failed(Failure())
+
+    assert [request.meta['login'] for request in results] == ['alice', 'bob']
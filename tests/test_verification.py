@@ -0,0 +1,29 @@
+from githubdisco.verification import VerificationPool
+
+LIBRARIES = [({'library': 'slow', 'artifacts': ['b'], 'imports_usages': []}, [['(a+)+${artifact_name}c', 0, '']])]
+
+
+def test_stuck_worker_is_replaced_after_the_timeout():
+    pool = VerificationPool(LIBRARIES, 1, 1, backend='re', timeout=2)
+    try:
+        # Backtracks for ever, a deadline between patterns never comes
+        assert pool.run(('slow.txt', b'a' * 40 + b'b', 'raw', ())) == ([], True)
+        assert pool.timeouts == 1
+        assert pool.run(('fast.txt', b'aab' + b'c', 'raw', ())) == ([('slow', '(a+)+bc')], False)
+        assert len(pool.workers) == 1
+    finally:
+        pool.close()
+
+
+def test_slots_go_straight_to_the_waiting_requests():
+    pool = VerificationPool(LIBRARIES, 1, 2)
+    assert pool.acquire() is None and pool.acquire() is None
+    waiting = pool.acquire()
+    handed_over = []
+    waiting.addCallback(handed_over.append)
+
+    pool.release()
+    assert handed_over == [None] and pool.pending == 2
+    pool.release()
+    assert pool.pending == 1
+    pool.close()